@@ -0,0 +1,283 @@
+"""Latency and throughput of check_key, create_key, renew_key and get_usage_stats on each backend.
+
+For each backend and number of keys, a fresh key table is seeded with create_keys, then every operation is
+timed call by call on a single thread. Throughput and p50/p99 latencies are written as JSON, to be kept
+and compared between releases.
+
+Usage:
+    python benchmarks/backends.py [--keys 10000,100000,1000000] [--calls 2000] [--scans 5]
+        [--backends memory,sqlite,sqlite-memory,postgres,mysql] [--output results.json]
+
+Backends:
+    memory          DATABASE_MODE=memory, persisted to a temporary directory. The baseline: the difference
+                    with the other backends is the cost of their database
+    sqlite          database file in a temporary directory
+    sqlite-memory   database file on /dev/shm. SQLiteAccess opens one connection per thread, and a
+                    ":memory:" database is private to the connection that opened it
+    postgres        POSTGRES_URI, or the local server. Tables are created in the fastapi_auth_bench schema,
+                    which is dropped afterwards
+    mysql           MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD and MYSQL_PORT. Tables are created in the
+                    fastapi_auth_bench database, which is dropped afterwards
+
+A backend whose server cannot be reached is skipped, and listed in the "skipped" results.
+Run it from the repository root with the package installed (`pip install -e .`).
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+# The key cache would answer every check without touching the database
+os.environ["FASTAPI_AUTH_CACHE_SIZE"] = "0"
+os.environ.setdefault("FASTAPI_AUTH_DB_LOCATION", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import fastapi_auth  # noqa: E402
+from fastapi_auth._memory_access import MemoryAccess  # noqa: E402
+from fastapi_auth._sqlite_access import SQLiteAccess  # noqa: E402
+
+BENCH_SCHEMA = "fastapi_auth_bench"
+# Users created per create_keys call while seeding
+SEED_BATCH = 10000
+
+
+def percentile(latencies: List[int], q: float) -> float:
+    # Nearest-rank percentile of sorted latencies in nanoseconds, in milliseconds
+    return latencies[max(0, math.ceil(q * len(latencies)) - 1)] / 1e6
+
+
+def measure(backend: str, keys: int, operation: str, calls: List[Callable[[], object]]) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for call in calls:
+        call_start = time.perf_counter_ns()
+        call()
+        latencies.append(time.perf_counter_ns() - call_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    result = {
+        "backend": backend,
+        "keys": keys,
+        "operation": operation,
+        "calls": len(calls),
+        "throughput": round(len(calls) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5), 4),
+        "p99_ms": round(percentile(latencies, 0.99), 4),
+    }
+    print(
+        f"{backend:>13} {keys:>9,} keys {operation:>15}: {result['throughput']:>10,.1f}/s "
+        f"p50 {result['p50_ms']:.3f} ms p99 {result['p99_ms']:.3f} ms",
+        file=sys.stderr,
+    )
+    return result
+
+
+def seed(access, keys: int) -> List[str]:
+    api_keys = []
+    for start in range(0, keys, SEED_BATCH):
+        users = [
+            (f"seed{i}", f"seed{i}@example.com", "pw", True)
+            for i in range(start, min(keys, start + SEED_BATCH))
+        ]
+        api_keys += [result["api-key"] for result in access.create_keys(users)]
+
+    return api_keys
+
+
+def run_backend(backend: str, access, keys: int, calls: int, scans: int) -> List[dict]:
+    seed_start = time.perf_counter()
+    api_keys = seed(access, keys)
+    print(
+        f"{backend:>13} {keys:>9,} keys seeded in {time.perf_counter() - seed_start:.1f} s",
+        file=sys.stderr,
+    )
+
+    rng = random.Random(keys)
+    sample = [rng.choice(api_keys) for _ in range(calls)]
+    expiration_date = (datetime.utcnow() + timedelta(days=30)).isoformat(timespec="seconds")
+
+    results = [
+        measure(backend, keys, "check_key", [lambda k=k: access.check_key(k) for k in sample]),
+        measure(
+            backend,
+            keys,
+            "create_key",
+            [
+                lambda i=i: access.create_key(f"bench{i}", f"bench{i}@example.com", "pw", False)
+                for i in range(calls)
+            ],
+        ),
+        measure(
+            backend,
+            keys,
+            "renew_key",
+            [lambda k=k: access.renew_key(k, expiration_date) for k in sample],
+        ),
+        measure(
+            backend, keys, "get_usage_stats", [access.get_usage_stats for _ in range(scans)]
+        ),
+    ]
+    access.usage_recorder.stop()
+
+    return results
+
+
+def memory_backend() -> Callable[[], tuple]:
+    def open_access():
+        location = tempfile.mkdtemp()
+        access = MemoryAccess(path=location)
+
+        def close():
+            access.close()
+            shutil.rmtree(location, ignore_errors=True)
+
+        return access, close
+
+    return open_access
+
+
+def sqlite_backend(directory: str) -> Callable[[], tuple]:
+    def open_access():
+        location = tempfile.mkdtemp(dir=directory)
+        os.environ["FASTAPI_AUTH_DB_LOCATION"] = os.path.join(location, "bench.db")
+        access = SQLiteAccess()
+
+        def close():
+            access.close()
+            shutil.rmtree(location, ignore_errors=True)
+
+        return access, close
+
+    return open_access
+
+
+def postgres_backend() -> Callable[[], tuple]:
+    import psycopg2
+
+    from fastapi_auth import _postgres_access
+
+    uri = os.getenv("POSTGRES_URI") or ""
+    ssl = os.getenv("POSTGRES_SSL")
+    # Fails early if the server cannot be reached
+    psycopg2.connect(uri, sslmode=ssl).close()
+
+    def execute(query: str):
+        connection = psycopg2.connect(uri, sslmode=ssl)
+        connection.autocommit = True
+        with connection.cursor() as c:
+            c.execute(query)
+        connection.close()
+
+    def open_access():
+        execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+        if "://" in uri:
+            separator = "&" if "?" in uri else "?"
+            _postgres_access.POSTGRES_URI = f"{uri}{separator}options=-csearch_path%3D{BENCH_SCHEMA}"
+        else:
+            _postgres_access.POSTGRES_URI = f"{uri} options='-c search_path={BENCH_SCHEMA}'"
+        _postgres_access.POSTGRES_SSL = ssl
+        access = _postgres_access.PostgresAccess()
+
+        def close():
+            access.pool.close()
+            execute(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE")
+
+        return access, close
+
+    return open_access
+
+
+def mysql_backend() -> Callable[[], tuple]:
+    from fastapi_auth import _mysql_access
+
+    database = _mysql_access.MYSQL_DATABASE
+
+    def execute(query: str):
+        _mysql_access.MYSQL_DATABASE = None
+        connection = _mysql_access._connect()
+        with connection.cursor() as c:
+            c.execute(query)
+        connection.close()
+        _mysql_access.MYSQL_DATABASE = database
+
+    # Fails early if the server cannot be reached
+    execute("SELECT 1")
+
+    def open_access():
+        execute(f"DROP DATABASE IF EXISTS {BENCH_SCHEMA}")
+        execute(f"CREATE DATABASE {BENCH_SCHEMA}")
+        _mysql_access.MYSQL_DATABASE = BENCH_SCHEMA
+        access = _mysql_access.MySQLAccess()
+
+        def close():
+            access.pool.close()
+            execute(f"DROP DATABASE {BENCH_SCHEMA}")
+
+        return access, close
+
+    return open_access
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", default="10000,100000,1000000")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--scans", type=int, default=5, help="calls of get_usage_stats")
+    parser.add_argument("--backends", default="memory,sqlite,sqlite-memory,postgres,mysql")
+    parser.add_argument("--output", help="JSON file of the results, stdout by default")
+    args = parser.parse_args()
+
+    factories = {
+        "memory": memory_backend,
+        "sqlite": lambda: sqlite_backend(tempfile.gettempdir()),
+        "sqlite-memory": lambda: sqlite_backend("/dev/shm"),
+        "postgres": postgres_backend,
+        "mysql": mysql_backend,
+    }
+
+    report = {
+        "version": fastapi_auth.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.utcnow().isoformat(timespec="seconds"),
+        "calls": args.calls,
+        "results": [],
+        "skipped": [],
+    }
+    for backend in args.backends.split(","):
+        if backend == "sqlite-memory" and not os.path.isdir("/dev/shm"):
+            report["skipped"].append({"backend": backend, "reason": "/dev/shm is not available"})
+            continue
+        try:
+            open_access = factories[backend]()
+        except Exception as e:
+            print(f"{backend} skipped: {e}", file=sys.stderr)
+            report["skipped"].append({"backend": backend, "reason": str(e).strip()})
+            continue
+
+        for keys in (int(keys) for keys in args.keys.split(",")):
+            access, close = open_access()
+            try:
+                report["results"] += run_backend(backend, access, keys, args.calls, args.scans)
+            finally:
+                close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
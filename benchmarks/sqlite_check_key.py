@@ -0,0 +1,114 @@
+"""Throughput of SQLiteAccess.check_key, against the previous connection-per-call implementation.
+
+Usage:
+    python benchmarks/sqlite_check_key.py [--keys 10000] [--checks 20000] [--threads 8]
+
+Run it from the repository root with the package installed (`pip install -e .`).
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# The key cache would answer every check without touching the database
+os.environ["FASTAPI_AUTH_CACHE_SIZE"] = "0"
+os.environ.setdefault("FASTAPI_AUTH_DB_LOCATION", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+from fastapi_auth._sqlite_access import SQLiteAccess  # noqa: E402
+
+
+def legacy_check_key(db_location: str, api_key: str) -> bool:
+    # check_key as it was before persistent connections and the usage recorder
+    with sqlite3.connect(db_location) as connection:
+        c = connection.cursor()
+        c.execute(
+            """
+        SELECT is_active, total_queries, expiration_date, never_expire
+        FROM FASTAPI_AUTH
+        WHERE api_key = ?""",
+            (api_key,),
+        )
+        response = c.fetchone()
+        if not response or response[0] != 1:
+            return False
+
+        threading.Thread(
+            target=legacy_update_usage, args=(db_location, api_key, response[1])
+        ).start()
+        return True
+
+
+def legacy_update_usage(db_location: str, api_key: str, usage_count: int):
+    with sqlite3.connect(db_location) as connection:
+        connection.execute(
+            """
+        UPDATE FASTAPI_AUTH
+        SET total_queries = ?, latest_query_date = ?
+        WHERE api_key = ?
+        """,
+            (usage_count + 1, datetime.utcnow().isoformat(timespec="seconds"), api_key),
+        )
+        connection.commit()
+
+
+def run(check, api_keys, checks: int, threads: int) -> float:
+    per_thread = checks // threads
+
+    def worker(offset: int):
+        for i in range(per_thread):
+            check(api_keys[(offset + i) % len(api_keys)])
+
+    workers = [
+        threading.Thread(target=worker, args=(i * per_thread,)) for i in range(threads)
+    ]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--checks", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    db_location = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["FASTAPI_AUTH_DB_LOCATION"] = db_location
+    access = SQLiteAccess()
+    api_keys = [
+        access.create_key(f"user{i}", f"user{i}@example.com", "pw", True)["api-key"]
+        for i in range(args.keys)
+    ]
+
+    legacy_db = os.path.join(tempfile.mkdtemp(), "legacy.db")
+    with sqlite3.connect(db_location) as source, sqlite3.connect(legacy_db) as target:
+        source.backup(target)
+    with sqlite3.connect(legacy_db) as connection:
+        connection.execute("PRAGMA journal_mode=DELETE")
+
+    for threads in (1, args.threads):
+        legacy = run(
+            lambda api_key: legacy_check_key(legacy_db, api_key),
+            api_keys,
+            args.checks,
+            threads,
+        )
+        current = run(access.check_key, api_keys, args.checks, threads)
+        print(
+            f"{threads} thread(s): before {legacy:,.0f} checks/s, "
+            f"after {current:,.0f} checks/s ({current / legacy:.1f}x)"
+        )
+
+    access.usage_recorder.stop()
+
+
+if __name__ == "__main__":
+    main()
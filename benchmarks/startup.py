@@ -0,0 +1,89 @@
+"""Boot time of a worker: the time taken to import fastapi_auth, and the database drivers it loads.
+
+Each run imports the package in a new interpreter, like a worker starting, with the DATABASE_MODE under test.
+The median and max import times are written as JSON, with the drivers found in sys.modules afterwards.
+
+Usage:
+    python benchmarks/startup.py [--modes sqlite,postgres,mysql,mongodb] [--runs 5] [--output results.json]
+
+Run it from the repository root with the package installed (`pip install -e .`).
+Unreachable database servers are part of the measure, as they are for a worker.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+DRIVERS = ["psycopg2", "pymysql", "pymongo"]
+
+WORKER = f"""
+import json, sys, time
+start = time.perf_counter()
+import fastapi_auth
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "drivers": [d for d in {DRIVERS!r} if d in sys.modules]}}))
+"""
+
+
+def boot(mode: str) -> dict:
+    env = dict(os.environ, DATABASE_MODE=mode)
+    env.setdefault("FASTAPI_AUTH_DB_LOCATION", os.path.join(tempfile.mkdtemp(), "bench.db"))
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    ).stdout
+
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", default="sqlite")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="JSON file of the results, stdout by default")
+    args = parser.parse_args()
+
+    import fastapi_auth
+
+    report = {
+        "version": fastapi_auth.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.utcnow().isoformat(timespec="seconds"),
+        "runs": args.runs,
+        "results": [],
+    }
+    for mode in args.modes.split(","):
+        runs = [boot(mode) for _ in range(args.runs)]
+        seconds = [run["seconds"] for run in runs]
+        result = {
+            "database_mode": mode,
+            "median_s": round(statistics.median(seconds), 4),
+            "max_s": round(max(seconds), 4),
+            "drivers": runs[-1]["drivers"],
+        }
+        print(
+            f"{mode:>8}: median {result['median_s']:.3f} s, max {result['max_s']:.3f} s, "
+            f"drivers imported: {', '.join(result['drivers']) or 'none'}",
+            file=sys.stderr,
+        )
+        report["results"].append(result)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Asyncio interface to the database backends.
+
+The sync backends block on every query, which would stall the event loop if awaited directly from an
+``async`` dependency. ``ThreadedAsyncAccess`` runs them in the threadpool instead, and the native drivers
+(``FASTAPI_AUTH_ASYNC_DRIVER=native``) run the key validation hot path on asyncpg, aiomysql or aiosqlite.
+The in-memory backend never blocks on validation, so ``InlineAsyncAccess`` calls its check_key_status directly.
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from fastapi_auth._key_storage import key_codec
+
+if sys.version_info >= (3, 8):
+    from typing import Protocol
+else:
+    from typing_extensions import Protocol
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+
+def numbered_placeholders(query: str) -> str:
+    """
+    Converts the %s placeholders of a psycopg2 query to the $1, $2... placeholders of asyncpg
+    """
+    parts = query.split("%s")
+
+    return parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+
+
+class AsyncAccess(Protocol):
+    """Methods every async backend provides"""
+
+    async def create_key(self, username, email, password, never_expire) -> dict:
+        ...
+
+    async def renew_key(self, api_key: str, new_expiration_date: str) -> Optional[str]:
+        ...
+
+    async def revoke_key(self, api_key: str):
+        ...
+
+    async def check_key(self, api_key: str) -> bool:
+        ...
+
+    async def check_key_status(self, api_key: str) -> Optional[str]:
+        ...
+
+    async def get_usage_stats(self) -> List[Tuple]:
+        ...
+
+
+class ThreadedAsyncAccess:
+    """Adapter running the methods of a sync backend in the threadpool, off the event loop"""
+
+    def __init__(self, access):
+        self.access = access
+
+    async def create_key(self, username, email, password, never_expire) -> dict:
+        return await run_in_threadpool(
+            self.access.create_key, username, email, password, never_expire
+        )
+
+    async def renew_key(self, api_key: str, new_expiration_date: str) -> Optional[str]:
+        return await run_in_threadpool(
+            self.access.renew_key, api_key, new_expiration_date
+        )
+
+    async def revoke_key(self, api_key: str):
+        return await run_in_threadpool(self.access.revoke_key, api_key)
+
+    async def check_key(self, api_key: str) -> bool:
+        return await self.check_key_status(api_key) is None
+
+    async def check_key_status(self, api_key: str) -> Optional[str]:
+        return await run_in_threadpool(self.access.check_key_status, api_key)
+
+    async def get_usage_stats(self) -> List[Tuple]:
+        return await run_in_threadpool(self.access.get_usage_stats)
+
+
+class AsyncPostgresAccess(ThreadedAsyncAccess):
+    """asyncpg driver for the key validation hot path, the other methods go through the threadpool"""
+
+    def __init__(self, access):
+        super().__init__(access)
+        self._pool = None
+        self._pool_lock = None
+        self._check_key_query = None
+
+    async def _get_pool(self):
+        if self._pool is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self._pool is None:
+                    from fastapi_auth._postgres_access import (
+                        CHECK_KEY_QUERY,
+                        POSTGRES_SSL,
+                        POSTGRES_URI,
+                    )
+
+                    # The query of PostgresAccess.check_key_status, so both drivers validate keys alike
+                    self._check_key_query = numbered_placeholders(CHECK_KEY_QUERY)
+                    self._pool = await asyncpg.create_pool(
+                        POSTGRES_URI,
+                        ssl=POSTGRES_SSL,
+                        min_size=1,
+                        max_size=int(os.getenv("FASTAPI_AUTH_ASYNC_POOL_SIZE", "10")),
+                    )
+
+        return self._pool
+
+    async def check_key_status(self, api_key: str) -> Optional[str]:
+        """
+        The check_key_status function fetches the key row with asyncpg, then validates it like PostgresAccess.check_key_status.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        pool = await self._get_pool()
+        response = await pool.fetchrow(self._check_key_query, key_codec.encode(api_key))
+
+        return self.access._check_status(
+            api_key, tuple(response) if response else None
+        )
+
+
+class AsyncMySQLAccess(ThreadedAsyncAccess):
+    """aiomysql driver for the key validation hot path, the other methods go through the threadpool"""
+
+    def __init__(self, access):
+        super().__init__(access)
+        self._pool = None
+        self._pool_lock = None
+
+    async def _get_pool(self):
+        if self._pool is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self._pool is None:
+                    from fastapi_auth import _mysql_access
+
+                    self._pool = await aiomysql.create_pool(
+                        host=_mysql_access.MYSQL_HOST,
+                        port=_mysql_access.MYSQL_PORT,
+                        user=_mysql_access.MYSQL_USER,
+                        password=_mysql_access.MYSQL_PASSWORD,
+                        db=_mysql_access.MYSQL_DATABASE,
+                        minsize=1,
+                        maxsize=int(os.getenv("FASTAPI_AUTH_ASYNC_POOL_SIZE", "10")),
+                        autocommit=True,
+                    )
+
+        return self._pool
+
+    async def check_key_status(self, api_key: str) -> Optional[str]:
+        """
+        The check_key_status function fetches the key row with aiomysql, then validates it like MySQLAccess.check_key_status.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        from fastapi_auth._mysql_access import CHECK_KEY_QUERY
+
+        pool = await self._get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as c:
+                await c.execute(CHECK_KEY_QUERY, (key_codec.encode(api_key),))
+                response = await c.fetchone()
+
+        return self.access._check_status(api_key, response)
+
+
+class AsyncSQLiteAccess(ThreadedAsyncAccess):
+    """aiosqlite driver for the key validation hot path, the other methods go through the threadpool"""
+
+    def __init__(self, access):
+        super().__init__(access)
+        self._connection = None
+        self._connection_lock = None
+
+    async def _get_connection(self):
+        if self._connection is None:
+            if self._connection_lock is None:
+                self._connection_lock = asyncio.Lock()
+            async with self._connection_lock:
+                if self._connection is None:
+                    self._connection = await aiosqlite.connect(self.access.db_location)
+
+        return self._connection
+
+    async def check_key_status(self, api_key: str) -> Optional[str]:
+        """
+        The check_key_status function fetches the key row with aiosqlite, then validates it like SQLiteAccess.check_key_status.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        from fastapi_auth._sqlite_access import CHECK_KEY_QUERY
+
+        connection = await self._get_connection()
+        async with connection.execute(
+            CHECK_KEY_QUERY, (int(time.time()), key_codec.encode(api_key))
+        ) as c:
+            response = await c.fetchone()
+
+        return self.access._check_status(api_key, response)
+
+
+class InlineAsyncAccess(ThreadedAsyncAccess):
+    """Adapter for the in-memory backend, whose check_key_status is a dict lookup called directly on the event loop"""
+
+    async def check_key_status(self, api_key: str) -> Optional[str]:
+        return self.access.check_key_status(api_key)
+
+
+# Native driver per DATABASE_MODE, with the python package it needs
+NATIVE_DRIVERS = {
+    "postgres": (AsyncPostgresAccess, asyncpg),
+    "mysql": (AsyncMySQLAccess, aiomysql),
+    "sqlite": (AsyncSQLiteAccess, aiosqlite),
+}
+
+
+def get_async_access(access, database_mode: Optional[str]) -> AsyncAccess:
+    """
+    The get_async_access function wraps a sync backend into its async counterpart.
+    The native driver is used if FASTAPI_AUTH_ASYNC_DRIVER is set to native and its package is installed,
+    otherwise the sync backend runs in the threadpool.
+
+    Args:
+        access: The sync backend instance
+        database_mode:Optional[str]: The DATABASE_MODE the backend was chosen for
+
+    Returns:
+        An object implementing AsyncAccess
+    """
+    # Handing a dict lookup to the threadpool would cost more than the lookup
+    if database_mode == "memory":
+        return InlineAsyncAccess(access)
+
+    if os.getenv("FASTAPI_AUTH_ASYNC_DRIVER", "thread") == "native":
+        driver, package = NATIVE_DRIVERS.get(database_mode or "sqlite", (None, None))
+        if package is not None:
+            return driver(access)
+
+        print(
+            f"No native async driver installed for {database_mode or 'sqlite'}, "
+            "running the backend in the threadpool."
+        )
+
+    return ThreadedAsyncAccess(access)
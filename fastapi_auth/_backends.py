@@ -0,0 +1,47 @@
+"""Registry of the database backends.
+
+Only the backend selected by DATABASE_MODE is imported and constructed, on first use. A worker does not
+import the drivers of the other databases, nor try to connect to them, when it starts.
+"""
+import importlib
+import os
+from typing import Optional
+
+# DATABASE_MODE -> module of the backend and name of its singleton
+BACKENDS = {
+    "postgres": ("fastapi_auth._postgres_access", "postgres_access"),
+    "mysql": ("fastapi_auth._mysql_access", "mysql_access"),
+    "mongodb": ("fastapi_auth._mongodb_access", "mongodb_access"),
+    "sqlite": ("fastapi_auth._sqlite_access", "sqlite_access"),
+    "memory": ("fastapi_auth._memory_access", "memory_access"),
+}
+
+
+def database_mode() -> str:
+    """
+    The database_mode function returns the backend selected by DATABASE_MODE.
+
+    Returns:
+        postgres, mysql, mongodb or memory, and sqlite if DATABASE_MODE is not set or unknown
+    """
+    mode = os.getenv("DATABASE_MODE")
+    if mode not in BACKENDS:
+        return "sqlite"
+
+    return mode
+
+
+def get_backend(mode: Optional[str] = None):
+    """
+    The get_backend function returns the backend of a DATABASE_MODE, importing its module on the first call.
+    The module builds the backend, which is then shared by every caller.
+
+    Args:
+        mode:Optional[str]: postgres, mysql, mongodb, sqlite or memory, DATABASE_MODE by default
+
+    Returns:
+        The backend instance
+    """
+    module, name = BACKENDS[mode or database_mode()]
+
+    return getattr(importlib.import_module(module), name)
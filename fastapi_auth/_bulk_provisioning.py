@@ -0,0 +1,128 @@
+"""Creation of API keys in bulk, shared by the backends.
+
+Users are processed in batches: one set-based query finds the usernames and emails already taken,
+then the new keys of the batch are inserted with a single statement and transaction.
+"""
+import os
+import uuid
+from typing import Any, Callable, Iterable, List, Optional, Set, Tuple
+
+from fastapi_auth._key_filter import key_filter
+from fastapi_auth._key_storage import key_codec
+
+BATCH_SIZE = int(os.getenv("FASTAPI_AUTH_BULK_BATCH_SIZE", "1000"))
+
+DUPLICATE_USER = "This user already exists in the database. Please choose another username or password."
+
+# username, email, hashed password, never_expire
+NewUser = Tuple[Optional[str], Optional[str], Optional[str], bool]
+
+
+def create_keys_in_batches(
+    users: List[NewUser],
+    expiration_date: Any,
+    find_existing: Callable[[List[str], List[str]], Tuple[Set[str], Set[str]]],
+    insert: Callable[[List[tuple]], Set[int]],
+    batch_size: Optional[int] = None,
+) -> List[dict]:
+    """
+    The create_keys_in_batches function creates an API key for each user, skipping the users that already exist.
+
+    Args:
+        users:List[NewUser]: The users to create
+        expiration_date:Any: Expiration date of the new keys, in the type of the backend's column
+        find_existing:Callable: Returns the usernames and emails, among the given ones, already in the database
+        insert:Callable: Inserts rows of stored api_key, is_active, never_expire, expiration_date, latest_query_date,
+            total_queries, username, email and password in one transaction, and returns the positions of
+            the rows rejected by a unique index
+        batch_size:Optional[int]: Number of users per query and transaction
+
+    Returns:
+        One dictionary per user, in order, with either the api-key created or the error
+    """
+    batch_size = batch_size or BATCH_SIZE
+    results: List[dict] = [{} for _ in users]
+    # Users repeated within the request are created once
+    seen_usernames: Set[str] = set()
+    seen_emails: Set[str] = set()
+
+    for start in range(0, len(users), batch_size):
+        batch = list(enumerate(users[start : start + batch_size], start))
+        existing_usernames, existing_emails = find_existing(
+            list(_not_none(user[0] for _, user in batch)),
+            list(_not_none(user[1] for _, user in batch)),
+        )
+
+        rows = []
+        for index, (username, email, password, never_expire) in batch:
+            # Users without a username or an email never conflict on it
+            if (
+                username is not None
+                and (username in existing_usernames or username in seen_usernames)
+            ) or (email is not None and (email in existing_emails or email in seen_emails)):
+                results[index] = {"error": DUPLICATE_USER}
+                continue
+
+            if username is not None:
+                seen_usernames.add(username)
+            if email is not None:
+                seen_emails.add(email)
+
+            api_key = str(uuid.uuid4())
+            rows.append(
+                (
+                    index,
+                    api_key,
+                    (
+                        key_codec.encode(api_key),
+                        1,
+                        1 if never_expire else 0,
+                        expiration_date,
+                        None,
+                        0,
+                        username,
+                        email,
+                        password,
+                    ),
+                )
+            )
+
+        if not rows:
+            continue
+
+        # Users created by a concurrent request since find_existing are rejected by the unique indexes
+        rejected = insert([row for _, _, row in rows])
+        for position, (index, api_key, _) in enumerate(rows):
+            if position in rejected:
+                results[index] = {"error": DUPLICATE_USER}
+            else:
+                key_filter.add(api_key)
+                results[index] = {"api-key": api_key}
+
+    return results
+
+
+def existing_users(rows: Iterable[Tuple[Optional[str], Optional[str]]]) -> Tuple[Set[str], Set[str]]:
+    """
+    The existing_users function builds the result of find_existing from the username and email of the matching rows.
+    A row matched on its email may have no username, and the reverse, so None is left out of the sets.
+
+    Args:
+        rows:Iterable[Tuple[Optional[str], Optional[str]]]: Username and email of each matching row
+
+    Returns:
+        The usernames and the emails taken
+    """
+    usernames: Set[str] = set()
+    emails: Set[str] = set()
+    for username, email in rows:
+        if username is not None:
+            usernames.add(username)
+        if email is not None:
+            emails.add(email)
+
+    return usernames, emails
+
+
+def _not_none(values: Iterable[Optional[str]]) -> Iterable[str]:
+    return (value for value in values if value is not None)
@@ -0,0 +1,130 @@
+"""Selection of the API keys revoked or renewed in bulk, shared by the backends.
+
+A selection is either a list of API keys or a filter, and is applied with a single UPDATE.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
+
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._usage_logs import escape_wildcards
+
+
+@dataclass
+class KeySelection:
+    """API keys of a bulk revoke or renew, the criteria are combined with AND"""
+
+    api_keys: Optional[List[str]] = None
+    username: Optional[str] = None
+    # Matches the emails ending with @email_domain
+    email_domain: Optional[str] = None
+    # Expiration window, naive UTC datetimes. Keys that never expire are not in any window
+    expires_after: Optional[datetime] = None
+    expires_before: Optional[datetime] = None
+
+    def is_empty(self) -> bool:
+        """
+        Whether the selection has no criteria, and would select every API key
+        """
+        return (
+            self.api_keys is None
+            and self.username is None
+            and self.email_domain is None
+            and self.expires_after is None
+            and self.expires_before is None
+        )
+
+
+def check_selection(selection: KeySelection):
+    """
+    The check_selection function rejects the selections without criteria, so that a malformed request
+    cannot revoke or renew every API key.
+
+    Args:
+        selection:KeySelection: The selected API keys
+
+    Raises:
+        HTTPException 422 if the selection has no criteria
+    """
+    if selection.is_empty():
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Select the API keys with api_keys, username, email_domain, expires_after or expires_before.",
+        )
+
+
+def to_utc(date: datetime) -> datetime:
+    """
+    The to_utc function converts a datetime to the naive UTC datetime stored by the backends, at the second.
+
+    Args:
+        date:datetime: The datetime to convert, naive datetimes are taken as UTC
+
+    Returns:
+        A naive UTC datetime
+    """
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date.replace(microsecond=0)
+
+
+def sql_selection_conditions(
+    selection: KeySelection,
+    placeholder: str,
+    username_column: str,
+    to_date: Callable[[datetime], object],
+) -> Tuple[List[str], list]:
+    """
+    The sql_selection_conditions function translates the filters of a KeySelection into SQL conditions.
+    The api_keys list is left to the backends, whose drivers pass lists differently.
+
+    Args:
+        selection:KeySelection: The selected API keys
+        placeholder:str: The parameter placeholder of the driver
+        username_column:str: The column holding the username
+        to_date:Callable: Converts a naive UTC datetime to the type of the date columns
+
+    Returns:
+        The conditions to join with AND, and their parameters
+    """
+    conditions = []
+    parameters = []
+
+    if selection.username is not None:
+        conditions.append(f"{username_column} = {placeholder}")
+        parameters.append(selection.username)
+    if selection.email_domain is not None:
+        conditions.append(f"email LIKE {placeholder} ESCAPE '!'")
+        parameters.append("%@" + escape_wildcards(selection.email_domain))
+    if selection.expires_after is not None or selection.expires_before is not None:
+        conditions.append("never_expire = 0")
+    if selection.expires_after is not None:
+        conditions.append(f"expiration_date >= {placeholder}")
+        parameters.append(to_date(selection.expires_after))
+    if selection.expires_before is not None:
+        conditions.append(f"expiration_date < {placeholder}")
+        parameters.append(to_date(selection.expires_before))
+
+    return conditions, parameters
+
+
+def invalidate_selection(selection: KeySelection):
+    """
+    The invalidate_selection function drops the selected API keys from the validation cache of the process.
+    Without an api_keys list the keys matched by the filters are not known, so the whole cache is cleared.
+
+    Args:
+        selection:KeySelection: The API keys that were revoked or renewed
+
+    Returns:
+        Nothing
+    """
+    if selection.api_keys is not None:
+        for api_key in selection.api_keys:
+            key_cache.invalidate(api_key)
+    else:
+        key_cache.clear()
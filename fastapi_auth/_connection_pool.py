@@ -0,0 +1,240 @@
+"""Thread-safe pool of DB-API connections, shared by the Postgres and MySQL backends.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+
+class ConnectionPool:
+    """Bounded connection pool with acquire timeout, health checks and usage statistics"""
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        check: Callable[[Any], None],
+        reset: Callable[[Any], None],
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        check_interval: Optional[float] = None,
+    ):
+        self._connect = connect
+        self._check = check
+        self._reset = reset
+        self.min_size = (
+            int(os.getenv("FASTAPI_AUTH_POOL_MIN_SIZE", "1"))
+            if min_size is None
+            else min_size
+        )
+        self.max_size = (
+            int(os.getenv("FASTAPI_AUTH_POOL_MAX_SIZE", "10"))
+            if max_size is None
+            else max_size
+        )
+        self.timeout = (
+            float(os.getenv("FASTAPI_AUTH_POOL_TIMEOUT", "5"))
+            if timeout is None
+            else timeout
+        )
+        self.check_interval = (
+            float(os.getenv("FASTAPI_AUTH_POOL_CHECK_INTERVAL", "30"))
+            if check_interval is None
+            else check_interval
+        )
+
+        # Idle connections with the time they were returned, most recent last
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def fill(self):
+        """
+        Opens connections until the pool holds at least min_size of them
+        """
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+
+            try:
+                connection = self._connect()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+
+            with self._condition:
+                self._idle.append((connection, time.monotonic()))
+                self._condition.notify()
+
+    def acquire(self) -> Any:
+        """
+        The acquire function checks a connection out of the pool.
+        It reuses an idle connection, opens a new one while the pool is below max_size,
+        and otherwise waits for a connection to be released.
+
+        Args:
+            self: Access the class attributes
+
+        Returns:
+            A DB-API connection
+
+        Raises:
+            HTTPException 503 if no connection became available within the timeout
+        """
+        if self._size < self.min_size:
+            self.fill()
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        connection = None
+        returned_at = None
+
+        with self._condition:
+            while True:
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise HTTPException(
+                        status_code=HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="No database connection available, please retry later.",
+                    )
+
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_use += 1
+            wait_time = time.monotonic() - start
+            self.acquisitions += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        try:
+            if connection is None:
+                connection = self._connect()
+            elif time.monotonic() - returned_at > self.check_interval:
+                connection = self._checked(connection)
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+        return connection
+
+    def _checked(self, connection: Any) -> Any:
+        # Connections idle for a while may have been dropped by the server or a proxy
+        try:
+            self._check(connection)
+            return connection
+        except Exception:
+            self._close(connection)
+            self.discarded += 1
+            return self._connect()
+
+    def release(self, connection: Any, discard: bool = False):
+        """
+        Returns a connection to the pool, or closes it if it is broken
+
+        Args:
+            connection: the connection obtained from acquire
+            discard: close the connection instead of reusing it
+        """
+        if not discard:
+            try:
+                self._reset(connection)
+            except Exception:
+                discard = True
+
+        if discard:
+            self._close(connection)
+
+        with self._condition:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self.discarded += 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager checking a connection out of the pool for the duration of the block.
+        Uncommitted changes are rolled back when the connection is returned.
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        """
+        Closes every idle connection
+        """
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the pool occupancy and how long callers waited for a connection.
+
+        Returns:
+            A dictionary of the pool settings and metrics
+        """
+        with self._condition:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "acquisitions": self.acquisitions,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "total_wait_time": self.total_wait_time,
+                "max_wait_time": self.max_wait_time,
+                "average_wait_time": (
+                    self.total_wait_time / self.acquisitions if self.acquisitions else 0.0
+                ),
+            }
+
+    @staticmethod
+    def _close(connection: Any):
+        try:
+            connection.close()
+        except Exception:
+            pass
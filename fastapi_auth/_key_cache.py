@@ -0,0 +1,107 @@
+"""In-process cache of validated API keys.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class KeyCache:
+    """Bounded TTL/LRU cache of positive API key validations"""
+
+    def __init__(self, max_size: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_size = (
+            int(os.getenv("FASTAPI_AUTH_CACHE_SIZE", "1024"))
+            if max_size is None
+            else max_size
+        )
+        self.ttl = (
+            float(os.getenv("FASTAPI_AUTH_CACHE_TTL", "30")) if ttl is None else ttl
+        )
+
+        # api_key -> deadline on the monotonic clock
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def hit(self, api_key: str) -> bool:
+        """
+        The hit function looks up a previously validated API key.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to look up
+
+        Returns:
+            True if the key is cached and still fresh, False otherwise
+        """
+        if not self.enabled:
+            return False
+
+        with self._lock:
+            deadline = self._entries.get(api_key)
+            if deadline is None:
+                return False
+
+            if deadline <= time.monotonic():
+                # Stale entry, the backend has to validate the key again
+                del self._entries[api_key]
+                return False
+
+            self._entries.move_to_end(api_key)
+
+            return True
+
+    def add(self, api_key: str, expires_at: Optional[float] = None):
+        """
+        The add function caches a key the backend has just validated.
+        The entry lives for at most the configured TTL, and never past the key's own expiration date.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The validated API key
+            expires_at:Optional[float]: UTC epoch of the expiration date, None for keys that never expire
+        """
+        if not self.enabled:
+            return
+
+        lifetime = self.ttl
+        if expires_at is not None:
+            lifetime = min(lifetime, expires_at - time.time())
+
+        if lifetime <= 0:
+            return
+
+        with self._lock:
+            self._entries[api_key] = time.monotonic() + lifetime
+            self._entries.move_to_end(api_key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, api_key: str):
+        """
+        Drops an API key from the cache, e.g. after it was revoked or renewed
+
+        Args:
+            api_key: the API key to forget
+        """
+        with self._lock:
+            self._entries.pop(api_key, None)
+
+    def clear(self):
+        """
+        Drops every cached API key
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+key_cache = KeyCache()
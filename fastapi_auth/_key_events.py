@@ -0,0 +1,228 @@
+"""Cross-worker invalidation through Postgres LISTEN/NOTIFY.
+
+With FASTAPI_AUTH_PG_NOTIFY=true, PostgresAccess sends a notification in the transaction of every key it
+creates, revokes or renews, so it is delivered when the change commits. Each worker listens on a dedicated
+connection in a background thread and applies the notifications of the other workers to its key cache,
+key filter, memory-mapped key store and revoked set of signed keys.
+"""
+import json
+import os
+import select
+import threading
+import time
+import uuid
+from typing import Any, Callable, Iterable, List, Optional
+
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._key_filter import key_filter
+from fastapi_auth._key_store import key_store
+from fastapi_auth._signed_keys import signed_keys
+
+CHANNEL = "fastapi_auth_keys"
+# Notification payloads are limited to 8000 bytes
+KEYS_PER_NOTIFICATION = 150
+# Idle time after which the listening connection is checked, so a dead connection is noticed
+HEALTH_CHECK_INTERVAL = 5.0
+RECONNECT_DELAY = 1.0
+
+
+class KeyEvents:
+    """Sends the key changes of this worker and applies the ones of the other workers"""
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = (
+            os.getenv("FASTAPI_AUTH_PG_NOTIFY", "false").lower() in ("1", "true")
+            if enabled is None
+            else enabled
+        )
+        # Notifications sent by this worker are already applied, they are only measured
+        self.origin = uuid.uuid4().hex
+
+        self.connected = False
+        self.received = 0
+        self.applied = 0
+        self.reconnections = 0
+        self.last_delay = 0.0
+        self.max_delay = 0.0
+        self.total_delay = 0.0
+        self._lock = threading.Lock()
+        self._get_revoked_keys = None
+        self._get_api_keys = None
+        self._listen_thread = None
+
+    def payloads(self, event: str, api_keys: Optional[List[str]]) -> List[str]:
+        """
+        The payloads function builds the notifications of a key change, split to fit the payload size limit.
+
+        Args:
+            self: Access the class attributes
+            event:str: create, revoke or renew
+            api_keys:Optional[List[str]]: The keys changed, None if they were selected by filters and are not known
+
+        Returns:
+            A list of JSON payloads
+        """
+        chunks = (
+            [None]
+            if api_keys is None
+            else [
+                api_keys[i : i + KEYS_PER_NOTIFICATION]
+                for i in range(0, len(api_keys), KEYS_PER_NOTIFICATION)
+            ]
+        )
+
+        return [
+            json.dumps({"event": event, "keys": chunk, "sent": time.time(), "origin": self.origin})
+            for chunk in chunks
+        ]
+
+    def notify(self, cursor: Any, event: str, api_keys: Optional[List[str]]):
+        """
+        The notify function queues the notifications of a key change in the transaction of the cursor.
+        Postgres delivers them when the transaction commits, and drops them if it is rolled back.
+
+        Args:
+            self: Access the class attributes
+            cursor: A cursor of the connection making the change
+            event:str: create, revoke or renew
+            api_keys:Optional[List[str]]: The keys changed, None if they were selected by filters
+        """
+        if not self.enabled or api_keys == []:
+            return
+
+        cursor.execute(
+            "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+            (CHANNEL, self.payloads(event, api_keys)),
+        )
+
+    def apply(self, payload: str):
+        """
+        The apply function updates the state of this worker with a notification and measures its propagation delay,
+        the time between the change and its notification being received.
+
+        Args:
+            self: Access the class attributes
+            payload:str: The JSON payload of the notification
+        """
+        message = json.loads(payload)
+        delay = max(0.0, time.time() - message["sent"])
+
+        with self._lock:
+            self.received += 1
+            self.last_delay = delay
+            self.max_delay = max(self.max_delay, delay)
+            self.total_delay += delay
+
+        if message["origin"] == self.origin:
+            return
+
+        event, api_keys = message["event"], message["keys"]
+        if event == "create":
+            for api_key in api_keys:
+                key_filter.add(api_key)
+
+        elif api_keys is None:
+            self._resync()
+
+        else:
+            for api_key in api_keys:
+                key_cache.invalidate(api_key)
+            key_store.invalidate(*api_keys)
+            if event == "revoke":
+                signed_keys.revoke(*api_keys)
+            else:
+                signed_keys.reinstate(*api_keys)
+
+        with self._lock:
+            self.applied += 1
+
+    def _resync(self):
+        # The changed keys are not known: nothing cached can be trusted
+        key_cache.clear()
+        key_store.invalidate_all()
+        # Keys created through the other workers meanwhile are missing from the filter
+        if key_filter.enabled and self._get_api_keys is not None:
+            key_filter.load(self._get_api_keys())
+        if signed_keys.enabled and self._get_revoked_keys is not None:
+            signed_keys.load(self._get_revoked_keys())
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the state of the listener and the propagation delay of the notifications received.
+
+        Returns:
+            A dictionary of the listener metrics, the delays are in seconds
+        """
+        with self._lock:
+            return {
+                "connected": self.connected,
+                "received": self.received,
+                "applied": self.applied,
+                "reconnections": self.reconnections,
+                "last_delay": self.last_delay,
+                "max_delay": self.max_delay,
+                "average_delay": self.total_delay / self.received if self.received else 0.0,
+            }
+
+    def start(
+        self,
+        connect: Callable[[], Any],
+        get_revoked_keys: Callable[[], Iterable[str]],
+        get_api_keys: Callable[[], Iterable[str]],
+    ):
+        """
+        The start function starts the background thread listening to the notifications of the other workers.
+
+        Args:
+            self: Access the class attributes
+            connect:Callable[[], Any]: Opens a new psycopg2 connection, dedicated to the listener
+            get_revoked_keys:Callable[[], Iterable[str]]: Backend method returning the api_key of every revoked key
+            get_api_keys:Callable[[], Iterable[str]]: Backend method returning every api_key value, to rebuild the key filter
+        """
+        if not self.enabled or self._listen_thread is not None:
+            return
+
+        self._get_revoked_keys = get_revoked_keys
+        self._get_api_keys = get_api_keys
+        self._listen_thread = threading.Thread(target=self._listen, args=(connect,), daemon=True)
+        self._listen_thread.start()
+
+    def _listen(self, connect: Callable[[], Any]):
+        while True:
+            connection = None
+            try:
+                connection = connect()
+                connection.autocommit = True
+                with connection.cursor() as c:
+                    c.execute(f"LISTEN {CHANNEL}")
+
+                if self.reconnections:
+                    # Notifications sent while the listener was disconnected were lost
+                    self._resync()
+                self.connected = True
+
+                while True:
+                    if select.select([connection], [], [], HEALTH_CHECK_INTERVAL) == ([], [], []):
+                        with connection.cursor() as c:
+                            c.execute("SELECT 1")
+                        continue
+
+                    connection.poll()
+                    while connection.notifies:
+                        self.apply(connection.notifies.pop(0).payload)
+
+            except Exception as e:
+                print("Error while listening to the API key notifications:", e)
+
+            self.connected = False
+            with self._lock:
+                self.reconnections += 1
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            time.sleep(RECONNECT_DELAY)
+
+
+key_events = KeyEvents()
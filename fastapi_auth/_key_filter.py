@@ -0,0 +1,187 @@
+"""Negative lookup filter for API keys.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+
+class KeyFilter:
+    """Bloom filter over every known API key, used to reject unknown keys without a database query"""
+
+    def __init__(
+        self,
+        capacity: Optional[int] = None,
+        error_rate: Optional[float] = None,
+        enabled: Optional[bool] = None,
+    ):
+        self.enabled = (
+            os.getenv("FASTAPI_AUTH_KEY_FILTER", "false").lower() in ("1", "true")
+            if enabled is None
+            else enabled
+        )
+        self.capacity = (
+            int(os.getenv("FASTAPI_AUTH_KEY_FILTER_CAPACITY", "1000000"))
+            if capacity is None
+            else capacity
+        )
+        self.error_rate = (
+            float(os.getenv("FASTAPI_AUTH_KEY_FILTER_ERROR_RATE", "0.001"))
+            if error_rate is None
+            else error_rate
+        )
+        self.refresh_interval = float(
+            os.getenv("FASTAPI_AUTH_KEY_FILTER_REFRESH", "60")
+        )
+
+        # Optimal bit count and number of hash functions for the target error rate
+        self.num_bits = max(
+            8,
+            math.ceil(
+                -self.capacity * math.log(self.error_rate) / (math.log(2) ** 2)
+            ),
+        )
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+
+        self.count = 0
+        self.ready = False
+        self._bits = bytearray()
+        self._lock = threading.Lock()
+        # Keys created while the filter is being rebuilt
+        self._added_during_load = None
+        self._refresh_thread = None
+
+    @property
+    def size_in_bytes(self) -> int:
+        return (self.num_bits + 7) // 8
+
+    @property
+    def false_positive_rate(self) -> float:
+        """
+        The false_positive_rate property estimates the probability that an unknown key passes the filter,
+        given the number of keys added so far.
+
+        Returns:
+            A float between 0 and 1
+        """
+        return (
+            1 - math.exp(-self.num_hashes * self.count / self.num_bits)
+        ) ** self.num_hashes
+
+    def _positions(self, api_key: str):
+        digest = hashlib.blake2b(api_key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def _set(self, bits: bytearray, api_key: str):
+        for position in self._positions(api_key):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def add(self, api_key: str):
+        """
+        Adds a newly created API key to the filter
+
+        Args:
+            api_key: the API key to add
+        """
+        with self._lock:
+            if self._added_during_load is not None:
+                self._added_during_load.append(api_key)
+
+            if self.ready:
+                self._set(self._bits, api_key)
+                self.count += 1
+
+    def might_contain(self, api_key: str) -> bool:
+        """
+        The might_contain function tells whether an API key may exist in the database.
+        A False answer is definitive, a True answer has to be confirmed by the backend.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to look up
+
+        Returns:
+            False if the key is definitely unknown, True otherwise
+        """
+        if not self.ready:
+            # Nothing was loaded, every key has to go through the backend
+            return True
+
+        bits = self._bits
+        for position in self._positions(api_key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+
+        return True
+
+    def load(self, api_keys: Iterable[str]):
+        """
+        The load function (re)builds the filter from every API key known to the backend.
+        The new filter replaces the previous one only once it is complete.
+
+        Args:
+            self: Access the class attributes
+            api_keys:Iterable[str]: Every api_key value stored in the backend
+        """
+        with self._lock:
+            self._added_during_load = []
+
+        bits = bytearray(self.size_in_bytes)
+        count = 0
+        try:
+            for api_key in api_keys:
+                self._set(bits, api_key)
+                count += 1
+        except Exception:
+            with self._lock:
+                self._added_during_load = None
+            raise
+
+        with self._lock:
+            for api_key in self._added_during_load:
+                self._set(bits, api_key)
+            count += len(self._added_during_load)
+            self._added_during_load = None
+
+            self._bits = bits
+            self.count = count
+            self.ready = True
+
+    def start(self, get_api_keys: Callable[[], Iterable[str]]):
+        """
+        The start function loads the filter and, unless FASTAPI_AUTH_KEY_FILTER_REFRESH is 0,
+        rebuilds it periodically in a background thread so keys created by other workers are picked up.
+
+        Args:
+            self: Access the class attributes
+            get_api_keys:Callable[[], Iterable[str]]: Backend method returning every api_key value
+        """
+        if not self.enabled:
+            return
+
+        try:
+            self.load(get_api_keys())
+        except Exception as e:
+            print("Error while loading the API key filter:", e)
+
+        if self.refresh_interval > 0 and self._refresh_thread is None:
+            self._refresh_thread = threading.Thread(
+                target=self._refresh, args=(get_api_keys,), daemon=True
+            )
+            self._refresh_thread.start()
+
+    def _refresh(self, get_api_keys: Callable[[], Iterable[str]]):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.load(get_api_keys())
+            except Exception as e:
+                print("Error while refreshing the API key filter:", e)
+
+
+key_filter = KeyFilter()
@@ -0,0 +1,76 @@
+"""Storage format of the API keys in the databases.
+
+API keys are UUID4 strings. By default they are stored as 36 characters of text; with
+FASTAPI_AUTH_KEY_STORAGE=uuid they are packed into their 16 bytes, which makes the primary key
+index, and every index carrying api_key, less than half the size.
+"""
+import os
+import uuid
+from typing import Optional, Union
+
+STORAGE_FORMATS = ("text", "uuid")
+
+
+class KeyCodec:
+    """Converts API keys between their text form and their stored form"""
+
+    def __init__(self, storage: Optional[str] = None):
+        self.storage = storage or os.getenv("FASTAPI_AUTH_KEY_STORAGE") or "text"
+        if self.storage not in STORAGE_FORMATS:
+            raise ValueError(
+                f"FASTAPI_AUTH_KEY_STORAGE must be one of {', '.join(STORAGE_FORMATS)}, not {self.storage}"
+            )
+
+    @property
+    def binary(self) -> bool:
+        return self.storage == "uuid"
+
+    def encode(self, api_key: str) -> Optional[Union[str, bytes]]:
+        """
+        The encode function converts an API key to its stored form, to be passed as a query parameter.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key, as given to the user
+
+        Returns:
+            The stored form, or None for a key that cannot be stored in this format, and so cannot exist
+        """
+        if not self.binary:
+            return api_key
+
+        try:
+            packed = uuid.UUID(api_key)
+        except (ValueError, TypeError, AttributeError):
+            return None
+        # uuid.UUID also parses other spellings of the same key, only the issued one is accepted
+        if str(packed) != api_key:
+            return None
+
+        return packed.bytes
+
+    def decode(self, stored: Union[str, bytes, bytearray, memoryview]) -> str:
+        """
+        The decode function converts a stored API key back to its text form.
+        Keys stored as text are returned unchanged, so rows read during a migration are decoded either way.
+
+        Args:
+            self: Access the class attributes
+            stored: The api_key value read from the database
+
+        Returns:
+            The API key, as given to the user
+        """
+        if isinstance(stored, (bytes, bytearray, memoryview)):
+            return str(uuid.UUID(bytes=bytes(stored)))
+
+        return stored
+
+    def decode_row(self, row: tuple) -> tuple:
+        """
+        Decodes the api_key of a usage stats row, its first column
+        """
+        return (self.decode(row[0]), *row[1:])
+
+
+key_codec = KeyCodec()
@@ -0,0 +1,389 @@
+"""Read-only key store shared by the workers of a host through a memory-mapped file.
+
+With FASTAPI_AUTH_KEY_STORE_PATH set, the validity of every API key is written to a file holding an open addressing
+hash table: a header followed by fixed size records of the key digest, its expiration epoch and its flags. Each worker
+maps the file, so all the workers of the host share one copy in the page cache, and ``api_key_security`` answers
+the keys the table knows to be valid with a hash probe in the mapping, without querying the backend. Keys not in the
+table, or not valid in it, still go through the backend, which stays the reference.
+
+One process per host, the one holding the lock file, rebuilds the table from the backend every
+FASTAPI_AUTH_KEY_STORE_REFRESH seconds, writing a new file renamed over the previous one. The workers map the new file
+within a second. Revocations and renewals made through a worker are patched in place in the mapped file, so every
+worker of the host stops trusting these keys at once, and are patched again into the next file if it was read
+from the backend before them.
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from calendar import timegm
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+from fastapi_auth._bulk_updates import to_utc
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b"FAKEYSTO"
+VERSION = 1
+# magic, version, stale flag, number of slots, number of keys, epoch the backend was read at
+HEADER = struct.Struct("<8sIIQQd")
+STALE_OFFSET = 12
+# key digest, expiration epoch, flags
+RECORD = struct.Struct("<16sIB3x")
+FLAGS_OFFSET = 20
+DIGEST_SIZE = 16
+EMPTY = bytes(DIGEST_SIZE)
+ACTIVE = 1
+NEVER_EXPIRE = 2
+# At most half of the slots are used, so a probe reads one or two records on average
+MAX_LOAD = 0.5
+# Seconds between checks for a new file
+CHECK_INTERVAL = 1.0
+
+
+def key_digest(api_key: str) -> bytes:
+    """
+    The key_digest function hashes an API key into the digest stored in the table, the keys themselves are not written.
+
+    Args:
+        api_key:str: The API key, as stored by the backend
+
+    Returns:
+        A 16 bytes digest, never all zeros as that marks the empty slots
+    """
+    digest = hashlib.blake2b(api_key.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+    if digest == EMPTY:
+        return b"\x01" + digest[1:]
+
+    return digest
+
+
+def to_epoch(date: Optional[str]) -> int:
+    """
+    Converts an ISO 8601 expiration date of the usage stats to a UTC epoch that fits the records
+    """
+    if date is None:
+        return 0
+
+    return min(max(0, timegm(to_utc(datetime.fromisoformat(date)).timetuple())), 2**32 - 1)
+
+
+class KeyStore:
+    """Memory-mapped hash table of the API keys, rebuilt from the backend by one process per host"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        refresh_interval: Optional[float] = None,
+        updater: Optional[bool] = None,
+    ):
+        self.path = os.getenv("FASTAPI_AUTH_KEY_STORE_PATH", "") if path is None else path
+        self.enabled = bool(self.path)
+        self.refresh_interval = (
+            float(os.getenv("FASTAPI_AUTH_KEY_STORE_REFRESH", "60"))
+            if refresh_interval is None
+            else refresh_interval
+        )
+        self.updater = (
+            os.getenv("FASTAPI_AUTH_KEY_STORE_UPDATER", "true").lower() in ("1", "true")
+            if updater is None
+            else updater
+        )
+
+        # Mapping, slot mask and whether it can be patched, replaced as a whole so it is read without the lock
+        self._table = None
+        self._file_id = None
+        self.count = 0
+        self.built_at = 0.0
+        self.builds = 0
+        self.last_build_duration = 0.0
+
+        self._lock = threading.Lock()
+        # Digests invalidated by this process and when, patched into the files read from the backend before
+        self._invalidated: Dict[bytes, float] = {}
+        # When this process last invalidated keys it does not know, for bulk updates selected by filters
+        self._stale_since: Optional[float] = None
+        self._lock_file = None
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self._table is not None
+
+    def _find(self, table, digest: bytes) -> Optional[int]:
+        mapping, mask, _ = table
+        slot = int.from_bytes(digest[:8], "little") & mask
+
+        while True:
+            offset = HEADER.size + slot * RECORD.size
+            stored = mapping[offset : offset + DIGEST_SIZE]
+            if stored == digest:
+                return offset
+            if stored == EMPTY:
+                return None
+            slot = (slot + 1) & mask
+
+    def is_valid(self, api_key: str) -> bool:
+        """
+        The is_valid function looks an API key up in the mapped table.
+        False does not mean the key is invalid: it may have been created or renewed since the table was built,
+        or the table may not be loaded, and the backend has to be asked.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            True if the table knows the key to be active and not expired
+        """
+        table = self._table
+        # The changes made through this process are also checked here, as a read-only mapping cannot be patched
+        if table is None or table[0][STALE_OFFSET] or self._stale_since is not None:
+            return False
+
+        digest = key_digest(api_key)
+        if digest in self._invalidated:
+            return False
+
+        offset = self._find(table, digest)
+        if offset is None:
+            return False
+
+        _, expires_at, flags = RECORD.unpack_from(table[0], offset)
+        return bool(flags & ACTIVE) and bool(flags & NEVER_EXPIRE or expires_at >= time.time())
+
+    def _clear(self, table, digest: bytes):
+        # A single byte is written, the other workers never see a torn record
+        offset = self._find(table, digest)
+        if offset is not None and table[2]:
+            table[0][offset + FLAGS_OFFSET] = 0
+
+    def invalidate(self, *api_keys: str):
+        """
+        The invalidate function stops the table from validating API keys that were revoked or renewed,
+        until the next file read from the backend after the change. The backend validates them meanwhile.
+
+        Args:
+            self: Access the class attributes
+            *api_keys:str: The API keys that changed
+        """
+        if not self.enabled:
+            return
+
+        now = time.time()
+        with self._lock:
+            for api_key in api_keys:
+                digest = key_digest(api_key)
+                self._invalidated[digest] = now
+                if self._table is not None:
+                    self._clear(self._table, digest)
+
+    def invalidate_all(self):
+        """
+        The invalidate_all function stops the table from validating any API key until the next file is built,
+        for the bulk updates selected by filters, whose keys are only known to the backend.
+        The updater builds the next file right away.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._stale_since = time.time()
+            if self._table is not None and self._table[2]:
+                self._table[0][STALE_OFFSET] = 1
+
+    def build(self, rows: Iterable[tuple]) -> int:
+        """
+        The build function writes a new table file from the usage stats of every API key, then renames it over the
+        previous one, so the workers always map a complete file.
+
+        Args:
+            self: Access the class attributes
+            rows:Iterable[tuple]: Rows of iter_usage_stats, starting with api_key, is_active, never_expire and expiration_date
+
+        Returns:
+            The number of API keys written
+        """
+        start = time.perf_counter()
+        # Changes made after this instant may be missing from the rows, they are patched in when the file is mapped
+        built_at = time.time()
+        records = [
+            (
+                key_digest(api_key),
+                to_epoch(expiration_date),
+                (ACTIVE if is_active else 0) | (NEVER_EXPIRE if never_expire else 0),
+            )
+            for api_key, is_active, never_expire, expiration_date, *_ in rows
+        ]
+
+        slots = 1 << max(4, math.ceil(math.log2(len(records) / MAX_LOAD + 1)))
+        mask = slots - 1
+        table = bytearray(HEADER.size + slots * RECORD.size)
+        HEADER.pack_into(table, 0, MAGIC, VERSION, 0, slots, len(records), built_at)
+        for digest, expires_at, flags in records:
+            slot = int.from_bytes(digest[:8], "little") & mask
+            offset = HEADER.size + slot * RECORD.size
+            while table[offset : offset + DIGEST_SIZE] != EMPTY:
+                slot = (slot + 1) & mask
+                offset = HEADER.size + slot * RECORD.size
+            RECORD.pack_into(table, offset, digest, expires_at, flags)
+
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(table)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+        self.builds += 1
+        self.last_build_duration = time.perf_counter() - start
+        return len(records)
+
+    def load(self) -> bool:
+        """
+        The load function maps the current file if it changed since the last call, then patches into it the changes
+        this process made after its rows were read from the backend.
+
+        Args:
+            self: Access the class attributes
+
+        Returns:
+            True if a new file was mapped
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if (stat.st_dev, stat.st_ino) == self._file_id:
+            return False
+
+        try:
+            f = open(self.path, "r+b")
+            writable = True
+        except PermissionError:
+            f = open(self.path, "rb")
+            writable = False
+        with f:
+            stat = os.fstat(f.fileno())
+            mapping = mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            )
+
+        magic, version, _, slots, count, built_at = HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC or version != VERSION or len(mapping) != HEADER.size + slots * RECORD.size:
+            mapping.close()
+            raise ValueError(f"{self.path} is not a key store file of version {VERSION}")
+
+        table = (mapping, slots - 1, writable)
+        with self._lock:
+            self._invalidated = {
+                digest: changed_at
+                for digest, changed_at in self._invalidated.items()
+                if changed_at >= built_at
+            }
+            for digest in self._invalidated:
+                self._clear(table, digest)
+            if self._stale_since is not None:
+                if self._stale_since < built_at:
+                    self._stale_since = None
+                elif writable:
+                    mapping[STALE_OFFSET] = 1
+
+            # The previous mapping is closed once the lookups still using it are done with it
+            self._table = table
+            self._file_id = (stat.st_dev, stat.st_ino)
+            self.count = count
+            self.built_at = built_at
+
+        return True
+
+    def _is_updater(self) -> bool:
+        # The process holding the lock file rebuilds the table, the lock is released when it exits
+        if self._lock_file is not None:
+            return True
+        if not self.updater:
+            return False
+
+        lock_file = open(f"{self.path}.lock", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+
+        self._lock_file = lock_file
+        return True
+
+    def _update(self, get_rows: Callable[[], Iterable[tuple]]):
+        if not self._is_updater():
+            return
+
+        table = self._table
+        if (
+            table is None
+            or table[0][STALE_OFFSET]
+            or 0 < self.refresh_interval <= time.time() - self.built_at
+        ):
+            self.build(get_rows())
+
+    def start(self, get_rows: Callable[[], Iterable[tuple]]):
+        """
+        The start function maps the table, building it first if this process is the updater and it is missing or old,
+        then checks for new files, and rebuilds them if this process is the updater, in a background thread.
+
+        Args:
+            self: Access the class attributes
+            get_rows:Callable[[], Iterable[tuple]]: Backend method yielding the usage stats of every API key
+        """
+        if not self.enabled:
+            return
+
+        try:
+            self.load()
+            self._update(get_rows)
+            self.load()
+        except Exception as e:
+            print("Error while loading the API key store:", e)
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh, args=(get_rows,), daemon=True)
+            self._thread.start()
+
+    def _refresh(self, get_rows: Callable[[], Iterable[tuple]]):
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            try:
+                self._update(get_rows)
+                self.load()
+            except Exception as e:
+                print("Error while refreshing the API key store:", e)
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the state of the mapped table and of its builds.
+
+        Returns:
+            A dictionary of the store settings and metrics
+        """
+        table = self._table
+        return {
+            "path": self.path,
+            "ready": int(table is not None),
+            "updater": int(self._lock_file is not None),
+            "stale": int(table is not None and bool(table[0][STALE_OFFSET])),
+            "keys": self.count,
+            "age": time.time() - self.built_at if table is not None else 0.0,
+            "builds": self.builds,
+            "last_build_duration": self.last_build_duration,
+        }
+
+
+key_store = KeyStore()
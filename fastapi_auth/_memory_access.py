@@ -0,0 +1,796 @@
+"""In-memory backend, selected with DATABASE_MODE=memory.
+
+The keys live in a dict of api_key to KeyRecord, objects with __slots__, with dicts of the usernames and emails
+for the duplicate checks. check_key is a dict lookup, so validations take microseconds.
+
+Every change is an operation applied to the dicts and appended to a log, written to
+FASTAPI_AUTH_MEMORY_PATH every FASTAPI_AUTH_MEMORY_SYNC_INTERVAL seconds. Every
+FASTAPI_AUTH_MEMORY_SNAPSHOT_INTERVAL seconds, the whole state is written to a new snapshot file, atomically
+renamed over the previous one, and the logs it contains are deleted. On startup the snapshot is loaded and the
+logs written after it are replayed, so a crash loses at most the last sync interval.
+
+The data is private to the process: with several workers, each one has its own keys.
+"""
+import atexit
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.status import (
+    HTTP_403_FORBIDDEN,
+    HTTP_404_NOT_FOUND,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+)
+
+from fastapi_auth._bulk_provisioning import (
+    DUPLICATE_USER,
+    NewUser,
+    create_keys_in_batches,
+)
+from fastapi_auth._bulk_updates import (
+    KeySelection,
+    check_selection,
+    invalidate_selection,
+    to_utc,
+)
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._key_filter import key_filter
+from fastapi_auth._key_storage import key_codec
+from fastapi_auth._usage_logs import UsageQuery, fetch_usage_page
+from fastapi_auth._usage_recorder import UsageRecorder
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+LOG_PREFIX = "log."
+SNAPSHOT_FORMAT = 1
+
+
+class KeyRecord:
+    """Columns of an API key, the api_key itself is the key of the dict holding the record"""
+
+    __slots__ = (
+        "is_active",
+        "never_expire",
+        "expiration_date",
+        "latest_query_date",
+        "total_queries",
+        "username",
+        "email",
+        "password",
+        "rate_limit",
+        "rate_limit_burst",
+        "rate_limit_count",
+    )
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def row(self) -> list:
+        return [getattr(self, field) for field in self.__slots__]
+
+    def is_valid(self, now: float) -> bool:
+        return self.is_active == 1 and (self.never_expire == 1 or self.expiration_date >= now)
+
+
+def to_epoch(date: datetime) -> int:
+    """
+    Converts a datetime to an integer UTC epoch, naive datetimes are taken as UTC
+    """
+    return int(to_utc(date).replace(tzinfo=timezone.utc).timestamp())
+
+
+def to_iso(epoch: Optional[int]) -> Optional[str]:
+    """
+    Formats an epoch like the dates of the usage stats of the SQL backends
+    """
+    if epoch is None:
+        return None
+
+    return datetime.utcfromtimestamp(epoch).isoformat(timespec="seconds")
+
+
+class MemoryAccess:
+    """Class holding the API keys in memory, persisted to a snapshot and an append log"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        sync_interval: Optional[float] = None,
+        snapshot_interval: Optional[float] = None,
+    ):
+        # An empty path keeps the keys in memory only
+        self.path = os.getenv("FASTAPI_AUTH_MEMORY_PATH", "fastapi_auth_memory") if path is None else path
+        self.sync_interval = (
+            float(os.getenv("FASTAPI_AUTH_MEMORY_SYNC_INTERVAL", "1"))
+            if sync_interval is None
+            else sync_interval
+        )
+        self.snapshot_interval = (
+            float(os.getenv("FASTAPI_AUTH_MEMORY_SNAPSHOT_INTERVAL", "300"))
+            if snapshot_interval is None
+            else snapshot_interval
+        )
+
+        try:
+            self.expiration_limit = int(os.getenv("FASTAPI_AUTH_AUTOMATIC_EXPIRATION"))
+        except (KeyError, TypeError):
+            self.expiration_limit = 15
+
+        self._keys: Dict[str, KeyRecord] = {}
+        self._usernames: Dict[str, str] = {}
+        self._emails: Dict[str, str] = {}
+        # (api_key, bucket start epoch) -> query count
+        self._rollups: Dict[Tuple[str, int], int] = {}
+
+        # Changes are serialized by _lock, reads go to the dicts directly
+        self._lock = threading.Lock()
+        # Operations applied since the last write of the log, and sequence number of the log being written
+        self._pending: List[list] = []
+        self._sequence = 0
+        # Operations applied since the last snapshot
+        self._changes = 0
+        # Only one thread writes the files at a time
+        self._persist_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.usage_recorder = UsageRecorder(
+            self._update_usage, flush_rollups=self._update_usage_rollups
+        )
+
+        if self.path:
+            self.load()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _apply(self, operation: list):
+        """
+        The _apply function applies an operation of the log to the dicts. It is used for the changes, and to replay the logs.
+
+        Args:
+            self: Access the class attributes
+            operation:list: The name of the operation followed by its arguments
+        """
+        kind = operation[0]
+        if kind == "create":
+            api_key, *values = operation[1]
+            record = self._keys[api_key] = KeyRecord(*values)
+            if record.username is not None:
+                self._usernames[record.username] = api_key
+            if record.email is not None:
+                self._emails[record.email] = api_key
+        elif kind == "set":
+            for api_key in operation[1]:
+                record = self._keys.get(api_key)
+                if record is not None:
+                    for field, value in operation[2].items():
+                        setattr(record, field, value)
+        elif kind == "usage":
+            for delta, last_seen, api_key in operation[1]:
+                record = self._keys.get(api_key)
+                if record is not None:
+                    record.total_queries += delta
+                    record.latest_query_date = max(record.latest_query_date or 0, last_seen)
+        elif kind == "rate_counts":
+            for delta, api_key in operation[1]:
+                record = self._keys.get(api_key)
+                if record is not None:
+                    record.rate_limit_count += delta
+        elif kind == "rollups":
+            for count, bucket_start, api_key in operation[1]:
+                key = (api_key, bucket_start)
+                self._rollups[key] = self._rollups.get(key, 0) + count
+
+    def _commit(self, operation: list):
+        # Called with _lock held
+        self._apply(operation)
+        if self.path:
+            self._pending.append(operation)
+            self._changes += 1
+
+    def load(self):
+        """
+        The load function restores the keys from the snapshot, then replays the logs written after it.
+        A line cut short by a crash ends the replay of its log. New changes go to a new log.
+
+        Args:
+            self: Access the class attributes
+        """
+        sequence = 0
+        snapshot = os.path.join(self.path, SNAPSHOT_FILE)
+        if os.path.exists(snapshot):
+            with open(snapshot) as f:
+                sequence = json.loads(f.readline())["sequence"]
+                for line in f:
+                    entry = json.loads(line)
+                    if entry[0] == "key":
+                        self._apply(["create", entry[1:]])
+                    else:
+                        self._apply(["rollups", [entry[1:]]])
+
+        for log_sequence in self._log_sequences():
+            if log_sequence < sequence:
+                continue
+            with open(self._log_file(log_sequence)) as f:
+                for line in f:
+                    try:
+                        operation = json.loads(line)
+                    except ValueError:
+                        break
+                    self._apply(operation)
+            sequence = log_sequence + 1
+
+        self._sequence = sequence
+
+    def _log_sequences(self) -> List[int]:
+        if not os.path.isdir(self.path):
+            return []
+
+        return sorted(
+            int(name[len(LOG_PREFIX) :].split(".")[0])
+            for name in os.listdir(self.path)
+            if name.startswith(LOG_PREFIX)
+        )
+
+    def _log_file(self, sequence: int) -> str:
+        return os.path.join(self.path, f"{LOG_PREFIX}{sequence}.jsonl")
+
+    def sync(self):
+        """
+        The sync function appends the operations applied since the last sync to the log, and flushes it to the disk.
+
+        Args:
+            self: Access the class attributes
+        """
+        with self._persist_lock:
+            with self._lock:
+                operations, self._pending = self._pending, []
+            self._write_log(self._sequence, operations)
+
+    def _write_log(self, sequence: int, operations: List[list]):
+        if not operations:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._log_file(sequence), "a") as f:
+            f.write("".join(json.dumps(operation) + "\n" for operation in operations))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def snapshot(self):
+        """
+        The snapshot function writes every key to a new snapshot file, renamed over the previous one once it is complete,
+        then deletes the logs it replaces. The dicts are copied under the lock, and written out of it.
+
+        Args:
+            self: Access the class attributes
+        """
+        with self._persist_lock:
+            with self._lock:
+                operations, self._pending = self._pending, []
+                rows = [["key", api_key, *record.row()] for api_key, record in self._keys.items()]
+                rows += [["rollup", api_key, bucket_start, count] for (api_key, bucket_start), count in self._rollups.items()]
+                sequence = self._sequence
+                self._sequence += 1
+                self._changes = 0
+
+            # If the snapshot is not completed, the previous one and its logs are still there
+            self._write_log(sequence, operations)
+            os.makedirs(self.path, exist_ok=True)
+            temporary = os.path.join(self.path, SNAPSHOT_FILE + ".tmp")
+            with open(temporary, "w") as f:
+                f.write(json.dumps({"format": SNAPSHOT_FORMAT, "sequence": sequence + 1}) + "\n")
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, os.path.join(self.path, SNAPSHOT_FILE))
+
+            for log_sequence in self._log_sequences():
+                if log_sequence <= sequence:
+                    os.remove(self._log_file(log_sequence))
+
+    def close(self):
+        """
+        Stops the background threads, and writes the buffered usage and a last snapshot
+        """
+        if not self.path or self._stopped.is_set():
+            return
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.usage_recorder.stop()
+        if self._changes:
+            self.snapshot()
+
+    def _run(self):
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while not self._stopped.wait(self.sync_interval):
+            try:
+                if time.monotonic() >= next_snapshot and self._changes:
+                    next_snapshot = time.monotonic() + self.snapshot_interval
+                    self.snapshot()
+                else:
+                    self.sync()
+            except Exception as e:
+                print("Error while persisting the in-memory API keys:", e)
+
+    def _new_record(self, name, email, password, never_expire) -> list:
+        api_key = str(uuid.uuid4())
+
+        return [
+            api_key,
+            1,
+            1 if never_expire else 0,
+            int(time.time()) + self.expiration_limit * 86400,
+            None,
+            0,
+            name,
+            email,
+            password,
+            None,
+            None,
+            0,
+        ]
+
+    def create_key(self, name, email, password, never_expire) -> dict:
+        """
+        The create_key function creates a new API key for the user.
+
+        Args:
+            self: Access attributes of the class
+            name: Identify the user
+            email: Validate the email address
+            password: Store the hashed password
+            never_expire: Set the expiration date to none
+
+        Returns:
+            A dictionary with the api-key
+        """
+        row = self._new_record(name, email, password, never_expire)
+
+        with self._lock:
+            if name in self._usernames or email in self._emails:
+                raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail=DUPLICATE_USER)
+            self._commit(["create", row])
+
+        key_filter.add(row[0])
+        return {"api-key": row[0]}
+
+    def create_keys(self, users: List[NewUser]) -> List[dict]:
+        """
+        The create_keys function creates an API key for each user, like create_key, in batches.
+        Each batch is checked and inserted under the lock, and logged as one operation per key.
+
+        Args:
+            self: Access attributes of the class
+            users:List[NewUser]: Tuples of name, email, hashed password and never_expire
+
+        Returns:
+            One dictionary per user, in order, with either the api-key created or the error
+        """
+
+        def find_existing(names, emails):
+            return (
+                {name for name in names if name in self._usernames},
+                {email for email in emails if email in self._emails},
+            )
+
+        def insert(rows):
+            rejected = set()
+            with self._lock:
+                for position, row in enumerate(rows):
+                    api_key, *values = row
+                    username, email = values[5], values[6]
+                    if username in self._usernames or email in self._emails:
+                        rejected.add(position)
+                        continue
+                    self._commit(["create", [key_codec.decode(api_key), *values, None, None, 0]])
+            return rejected
+
+        return create_keys_in_batches(
+            users,
+            int(time.time()) + self.expiration_limit * 86400,
+            find_existing,
+            insert,
+        )
+
+    def renew_key(self, api_key: str, new_expiration_date: str) -> Optional[str]:
+        """
+        The renew_key function takes an API key and a new expiration date, and reactivates the key if it was revoked.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: Check if the api key exists in the database
+            new_expiration_date:str: Set a new expiration date for the api key
+
+        Returns:
+            A string with a message about the api key's new expiration date
+        """
+        if not new_expiration_date:
+            expiration_date = datetime.utcnow() + timedelta(days=self.expiration_limit)
+        else:
+            try:
+                expiration_date = datetime.fromisoformat(new_expiration_date)
+            except ValueError as exc:
+                raise HTTPException(
+                    status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="The expiration date could not be parsed. \
+                            Please use ISO 8601.",
+                ) from exc
+
+        response_lines = []
+        with self._lock:
+            record = self._keys.get(api_key)
+            if record is None:
+                raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="API key not found")
+
+            if record.is_active == 0:
+                response_lines.append("This API key was revoked and has been reactivated.")
+
+            self._commit(
+                ["set", [api_key], {"expiration_date": to_epoch(expiration_date), "is_active": 1}]
+            )
+
+        key_cache.invalidate(api_key)
+        response_lines.append(
+            f"The new expiration date for the API key is {expiration_date.isoformat(timespec='seconds')}"
+        )
+
+        return " ".join(response_lines)
+
+    def revoke_key(self, api_key: str):
+        """
+        Revokes an API key
+
+        Args:
+            api_key: the API key to revoke
+        """
+        with self._lock:
+            if api_key in self._keys:
+                self._commit(["set", [api_key], {"is_active": 0}])
+
+        key_cache.invalidate(api_key)
+
+    def _select(self, selection: KeySelection) -> Iterator[Tuple[str, KeyRecord]]:
+        """
+        The _select function yields the API keys of a selection, going through every key only without an api_keys list.
+
+        Args:
+            self: Access the class attributes
+            selection:KeySelection: The API keys, or the filters, of the keys to select
+
+        Returns:
+            An iterator over the api_key and record of the selected keys
+        """
+        check_selection(selection)
+        expires_after = None if selection.expires_after is None else to_epoch(selection.expires_after)
+        expires_before = None if selection.expires_before is None else to_epoch(selection.expires_before)
+        email_suffix = None if selection.email_domain is None else "@" + selection.email_domain
+
+        if selection.api_keys is not None:
+            candidates = (
+                (api_key, self._keys[api_key]) for api_key in set(selection.api_keys) if api_key in self._keys
+            )
+        else:
+            candidates = iter(list(self._keys.items()))
+
+        for api_key, record in candidates:
+            if selection.username is not None and record.username != selection.username:
+                continue
+            if email_suffix is not None and not (record.email or "").endswith(email_suffix):
+                continue
+            if expires_after is not None or expires_before is not None:
+                if record.never_expire:
+                    continue
+                if expires_after is not None and record.expiration_date < expires_after:
+                    continue
+                if expires_before is not None and record.expiration_date >= expires_before:
+                    continue
+            yield api_key, record
+
+    def revoke_keys(self, selection: KeySelection) -> dict:
+        """
+        The revoke_keys function revokes every API key of the selection, as a single operation of the log.
+
+        Args:
+            self: Access the class attributes
+            selection:KeySelection: The API keys, or the filters, of the keys to revoke
+
+        Returns:
+            The number of API keys revoked, keys already revoked are not counted
+        """
+        with self._lock:
+            api_keys = [api_key for api_key, record in self._select(selection) if record.is_active == 1]
+            self._commit(["set", api_keys, {"is_active": 0}])
+
+        invalidate_selection(selection)
+        return {"revoked": len(api_keys)}
+
+    def renew_keys(
+        self, selection: KeySelection, expiration_date: Optional[datetime] = None
+    ) -> dict:
+        """
+        The renew_keys function sets a new expiration date on every API key of the selection, reactivating the revoked ones.
+
+        Args:
+            self: Access the class attributes
+            selection:KeySelection: The API keys, or the filters, of the keys to renew
+            expiration_date:Optional[datetime]: The new expiration date, FASTAPI_AUTH_AUTOMATIC_EXPIRATION days from now by default
+
+        Returns:
+            The number of API keys renewed and their new expiration date
+        """
+        expiration_date = to_utc(
+            expiration_date or datetime.utcnow() + timedelta(days=self.expiration_limit)
+        )
+
+        with self._lock:
+            api_keys = [api_key for api_key, _ in self._select(selection)]
+            self._commit(
+                ["set", api_keys, {"expiration_date": to_epoch(expiration_date), "is_active": 1}]
+            )
+
+        invalidate_selection(selection)
+        return {"renewed": len(api_keys), "expiration_date": expiration_date.isoformat()}
+
+    def check_key(self, api_key: str) -> bool:
+        """
+        The check_key function checks if the API key is valid with a dict lookup.
+        Valid keys are cached like with the other backends, so api_key_security answers them on the event loop.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            True if the api key is valid, false otherwise
+        """
+        return self.check_key_status(api_key) is None
+
+    def check_key_status(self, api_key: str) -> Optional[str]:
+        """
+        The check_key_status function validates an API key like check_key, and tells why it is not valid.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        record = self._keys.get(api_key)
+        if record is None:
+            return "unknown"
+        if record.is_active == 0:
+            return "revoked"
+        if not record.is_valid(time.time()):
+            return "expired"
+
+        key_cache.add(api_key, None if record.never_expire else record.expiration_date)
+        self.usage_recorder.record(api_key)
+
+        return None
+
+    def _update_usage(self, usage: List[Tuple[int, int, str]]):
+        """
+        The _update_usage function is called by the usage recorder with every usage delta aggregated since its last flush.
+        They are applied and logged as a single operation.
+
+        Args:
+            self: Access the class attributes
+            usage:List[Tuple[int, int, str]]: Tuples of query count delta, latest query epoch and api_key
+        """
+        with self._lock:
+            self._commit(["usage", [list(row) for row in usage]])
+
+    def _update_usage_rollups(self, rollups: List[Tuple[int, int, str]]):
+        """
+        The _update_usage_rollups function is called by the usage recorder with the query counts of the rollup buckets that ended.
+
+        Args:
+            self: Access the class attributes
+            rollups:List[Tuple[int, int, str]]: Tuples of query count, bucket start epoch and api_key
+        """
+        with self._lock:
+            self._commit(["rollups", [list(row) for row in rollups]])
+
+    def get_usage_rollups(
+        self, api_key: Optional[str], start: datetime, end: datetime, granularity: int
+    ) -> List[Tuple[str, int]]:
+        """
+        The get_usage_rollups function sums the usage rollups of a period per bucket of the given granularity.
+
+        Args:
+            self: Access the class attributes
+            api_key:Optional[str]: Only count the queries of this API key, None for every key
+            start:datetime: Start of the period, naive UTC
+            end:datetime: End of the period, excluded, naive UTC
+            granularity:int: Size of the buckets returned, in seconds, a multiple of the rollup bucket
+
+        Returns:
+            A list of bucket start, in ISO 8601, and query count, for the buckets with queries
+        """
+        start, end = to_epoch(start), to_epoch(end)
+        buckets: Dict[int, int] = {}
+        for (key, bucket_start), count in list(self._rollups.items()):
+            if start <= bucket_start < end and (api_key is None or key == api_key):
+                bucket = bucket_start - bucket_start % granularity
+                buckets[bucket] = buckets.get(bucket, 0) + count
+
+        return [(to_iso(bucket), count) for bucket, count in sorted(buckets.items())]
+
+    def get_api_keys(self) -> Iterator[str]:
+        """
+        The get_api_keys function yields every API key stored in memory.
+        It is used to build the negative lookup filter at startup.
+
+        Returns:
+            An iterator over the api_key values
+        """
+        return iter(list(self._keys))
+
+    def get_revoked_keys(self) -> List[str]:
+        """
+        The get_revoked_keys function returns every revoked API key.
+        It is used to refresh the revoked set of the signed API keys.
+
+        Returns:
+            A list of api_key values
+        """
+        return [api_key for api_key, record in list(self._keys.items()) if record.is_active == 0]
+
+    def set_rate_limit(
+        self, api_key: str, rate: Optional[float], burst: Optional[int]
+    ) -> dict:
+        """
+        The set_rate_limit function sets the rate limit of an API key, overriding FASTAPI_AUTH_RATE_LIMIT.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to limit
+            rate:Optional[float]: Requests per second, 0 for no limit, None for the global rate
+            burst:Optional[int]: Requests allowed at once, None for the global burst
+
+        Returns:
+            The rate limit of the key
+        """
+        with self._lock:
+            if api_key not in self._keys:
+                raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="API key not found")
+            self._commit(["set", [api_key], {"rate_limit": rate, "rate_limit_burst": burst}])
+
+        return {"rate_limit": rate, "rate_limit_burst": burst}
+
+    def get_rate_limits(self) -> Dict[str, Tuple[Optional[float], Optional[int]]]:
+        """
+        The get_rate_limits function returns the API keys that have their own rate limit.
+
+        Returns:
+            A dictionary of api_key to rate and burst, None when the global one applies
+        """
+        return {
+            api_key: (record.rate_limit, record.rate_limit_burst)
+            for api_key, record in list(self._keys.items())
+            if record.rate_limit is not None or record.rate_limit_burst is not None
+        }
+
+    def _sync_rate_counts(self, counts: List[Tuple[int, str]]) -> Dict[str, int]:
+        """
+        The _sync_rate_counts function adds the requests allowed by the rate limiter to rate_limit_count, and reads the counts back.
+        Buckets are not shared between processes with this backend, as each one has its own keys.
+
+        Args:
+            self: Access the class attributes
+            counts:List[Tuple[int, str]]: Tuples of allowed requests delta and api_key
+
+        Returns:
+            A dictionary of api_key to rate_limit_count
+        """
+        with self._lock:
+            self._commit(["rate_counts", [[delta, api_key] for delta, api_key in counts if delta]])
+            return {
+                api_key: self._keys[api_key].rate_limit_count
+                for _, api_key in counts
+                if api_key in self._keys
+            }
+
+    def _usage_row(self, api_key: str, record: KeyRecord) -> tuple:
+        return (
+            api_key,
+            record.is_active,
+            record.never_expire,
+            to_iso(record.expiration_date),
+            to_iso(record.latest_query_date),
+            record.total_queries,
+            record.username,
+            record.email,
+        )
+
+    def get_usage_stats(self) -> List[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The get_usage_stats function returns the usage of every API key, most recently used first.
+
+        Returns:
+            A list of tuples with values being api_key, is_active, never_expire, expiration_date, latest_query_date,
+            total_queries, username and email
+        """
+        # Usage still buffered is applied first so the stats are up to date
+        self.usage_recorder.flush()
+
+        items = sorted(
+            list(self._keys.items()),
+            key=lambda item: item[1].latest_query_date or -1,
+            reverse=True,
+        )
+        return [self._usage_row(api_key, record) for api_key, record in items]
+
+    def get_usage_logs(self, query: UsageQuery) -> List[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The get_usage_logs function returns a page of the usage stats, sorted by latest query date then api_key,
+        most recent first, with the never used keys last. The page is picked with a heap, without sorting every key.
+
+        Args:
+            self: Access variables that belongs to the class
+            query:UsageQuery: The filters, page size and cursor
+
+        Returns:
+            A list of tuples like get_usage_stats
+        """
+        self.usage_recorder.flush()
+        now = time.time()
+
+        def matches(record: KeyRecord) -> bool:
+            if query.active and not record.is_valid(now):
+                return False
+            if query.expired and not (record.never_expire == 0 and record.expiration_date < now):
+                return False
+            if query.username_prefix and not (record.username or "").startswith(query.username_prefix):
+                return False
+            if query.email_prefix and not (record.email or "").startswith(query.email_prefix):
+                return False
+            if query.min_total_queries is not None and record.total_queries < query.min_total_queries:
+                return False
+            return True
+
+        def fetch(used, after_date, after_key, limit):
+            after = None
+            if after_key is not None:
+                after = (to_epoch(datetime.fromisoformat(after_date)) if used else 0, after_key)
+            page = heapq.nlargest(
+                limit,
+                (
+                    (record.latest_query_date or 0, api_key, record)
+                    for api_key, record in list(self._keys.items())
+                    if (record.latest_query_date is not None) == used
+                    and (after is None or (record.latest_query_date or 0, api_key) < after)
+                    and matches(record)
+                ),
+                key=lambda entry: entry[:2],
+            )
+            return [self._usage_row(api_key, record) for _, api_key, record in page]
+
+        return fetch_usage_page(fetch, query)
+
+    def iter_usage_stats(self) -> Iterator[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The iter_usage_stats function yields the usage stats of every API key, like get_usage_stats, in no particular order.
+
+        Returns:
+            An iterator over tuples like get_usage_stats
+        """
+        self.usage_recorder.flush()
+
+        for api_key, record in list(self._keys.items()):
+            yield self._usage_row(api_key, record)
+
+
+memory_access = MemoryAccess()
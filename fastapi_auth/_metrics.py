@@ -0,0 +1,182 @@
+"""Prometheus metrics of the API key validation hot path.
+
+With FASTAPI_AUTH_METRICS=true, ``api_key_security`` times each validation and counts its outcome, and
+``/auth/metrics`` exports them in the Prometheus text format, with the connection pool and usage buffer
+gauges read at scrape time.
+
+Observations only increment integers in memory, a few hundred nanoseconds per request. They are made from
+the event loop, which runs ``api_key_security``, so they need no lock.
+"""
+import os
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from fastapi_auth._backends import database_mode
+from fastapi_auth._key_store import key_store
+from fastapi_auth._rate_limiter import rate_limiter
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the latency histogram buckets, in seconds, from a cache hit to a slow database query
+LATENCY_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+# Gauges exported from the stats of the connection pool and of the usage recorder: name, stat, help
+POOL_GAUGES = [
+    ("fastapi_auth_pool_connections", "size", "Connections opened by the pool"),
+    ("fastapi_auth_pool_connections_in_use", "in_use", "Connections lent by the pool"),
+    ("fastapi_auth_pool_connections_idle", "idle", "Idle connections kept by the pool"),
+    ("fastapi_auth_pool_waiting", "waiting", "Callers waiting for a connection"),
+]
+USAGE_GAUGES = [
+    ("fastapi_auth_usage_pending_keys", "pending_keys", "API keys with usage waiting for the next flush"),
+    ("fastapi_auth_usage_flushes_in_progress", "flushing", "Usage flushes writing to the database"),
+    ("fastapi_auth_usage_rollup_keys", "rollup_keys", "API keys with a usage rollup bucket in progress"),
+]
+KEY_STORE_GAUGES = [
+    ("fastapi_auth_key_store_keys", "keys", "API keys in the mapped key store"),
+    ("fastapi_auth_key_store_age_seconds", "age", "Time since the mapped key store was read from the database"),
+    ("fastapi_auth_key_store_stale", "stale", "Whether the key store waits for a rebuild after a bulk update"),
+]
+
+
+class Histogram:
+    """Cumulative histogram of durations, with the bucket bounds in nanoseconds"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._bounds = [int(bound * 1e9) for bound in buckets]
+        # Observations per bucket, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum_ns = 0
+        self.count = 0
+
+    def observe(self, duration_ns: int):
+        self.counts[bisect_left(self._bounds, duration_ns)] += 1
+        self.sum_ns += duration_ns
+        self.count += 1
+
+
+class Metrics:
+    """Latency histograms and outcome counters of the API key validations"""
+
+    def __init__(self, enabled: Optional[bool] = None, backend: Optional[str] = None):
+        self.enabled = (
+            os.getenv("FASTAPI_AUTH_METRICS", "false").lower() in ("1", "true")
+            if enabled is None
+            else enabled
+        )
+        self.backend = backend or database_mode()
+
+        # (method, reason) -> latency of the validations, a single histogram also counts them by reason
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        # Requests without an API key, which are not timed
+        self.missing = 0
+
+    def observe(self, method: str, reason: str, duration_ns: int):
+        """
+        The observe function adds a validation to the histogram of the method that answered it and of its outcome.
+
+        Args:
+            self: Access the class attributes
+            method:str: cache, signed, store, filter or check_key
+            reason:str: valid, or why the key was denied: unknown, revoked or expired
+            duration_ns:int: Duration of the validation, in nanoseconds
+        """
+        histogram = self.latency.get((method, reason))
+        if histogram is None:
+            histogram = self.latency[method, reason] = Histogram()
+        histogram.observe(duration_ns)
+
+    def render(self, access) -> str:
+        """
+        The render function exports the metrics in the Prometheus text format.
+        The gauges are read from the connection pool and the usage recorder of the backend, and from the key store.
+
+        Args:
+            self: Access the class attributes
+            access: The database backend in use
+
+        Returns:
+            The metrics, in the Prometheus text exposition format 0.0.4
+        """
+        lines: List[str] = [
+            "# HELP fastapi_auth_validation_duration_seconds Duration of the API key validations, by the method that answered",
+            "# TYPE fastapi_auth_validation_duration_seconds histogram",
+        ]
+        # The histograms of the reasons are summed per method, and their counts per reason
+        methods: Dict[str, Histogram] = {}
+        validations: Dict[str, int] = {"missing": self.missing} if self.missing else {}
+        for (method, reason), histogram in list(self.latency.items()):
+            merged = methods.setdefault(method, Histogram())
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.sum_ns += histogram.sum_ns
+            merged.count += histogram.count
+            validations[reason] = validations.get(reason, 0) + histogram.count
+
+        for method, histogram in sorted(methods.items()):
+            labels = f'backend="{self.backend}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'fastapi_auth_validation_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines += [
+                f'fastapi_auth_validation_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}',
+                f"fastapi_auth_validation_duration_seconds_sum{{{labels}}} {histogram.sum_ns / 1e9}",
+                f"fastapi_auth_validation_duration_seconds_count{{{labels}}} {histogram.count}",
+            ]
+
+        lines += [
+            "# HELP fastapi_auth_validations_total API key validations, by result and reason",
+            "# TYPE fastapi_auth_validations_total counter",
+        ]
+        for reason, count in sorted(validations.items()):
+            result = "allow" if reason == "valid" else "deny"
+            lines.append(
+                f'fastapi_auth_validations_total{{result="{result}",reason="{reason}"}} {count}'
+            )
+
+        lines += [
+            "# HELP fastapi_auth_rate_limited_total Requests of valid API keys rejected by the rate limit",
+            "# TYPE fastapi_auth_rate_limited_total counter",
+            f"fastapi_auth_rate_limited_total {rate_limiter.limited}",
+        ]
+
+        pool = getattr(access, "pool", None)
+        if pool is not None:
+            lines += _gauges(POOL_GAUGES, pool.stats())
+        lines += _gauges(USAGE_GAUGES, access.usage_recorder.stats())
+        if key_store.enabled:
+            lines += _gauges(KEY_STORE_GAUGES, key_store.stats())
+
+        return "\n".join(lines) + "\n"
+
+
+def _gauges(gauges: List[Tuple[str, str, str]], stats: dict) -> List[str]:
+    lines = []
+    for name, stat, help in gauges:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {stats[stat]}"]
+
+    return lines
+
+
+metrics = Metrics()
@@ -1,10 +1,8 @@
 import os
-import threading
-from types import NoneType
-from urllib import response
+import re
 import uuid
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 
 
 from dotenv import load_dotenv
@@ -12,12 +10,27 @@ from fastapi import HTTPException
 
 
 import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from starlette.status import (
     HTTP_403_FORBIDDEN,
     HTTP_404_NOT_FOUND,
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
 
+from fastapi_auth._bulk_provisioning import NewUser, create_keys_in_batches, existing_users
+from fastapi_auth._bulk_updates import (
+    KeySelection,
+    check_selection,
+    invalidate_selection,
+    to_utc,
+)
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._key_filter import key_filter
+from fastapi_auth._key_storage import key_codec
+from fastapi_auth._usage_logs import UsageQuery, fetch_usage_page
+from fastapi_auth._usage_recorder import UsageRecorder
+
 load_dotenv()
 
 try:
@@ -31,189 +44,751 @@ try:
 except KeyError as e:
     print(e)
 
+# Fields of get_usage_stats and get_usage_logs, in the order of their tuples
+USAGE_FIELDS = [
+    "api_key",
+    "is_active",
+    "never_expire",
+    "expiration_date",
+    "latest_query_date",
+    "total_queries",
+    "username",
+    "email",
+]
+
+# Fields check_key needs to validate a key, or tell why it is denied, read by the api_key index lookup
+CHECK_KEY_PROJECTION = {
+    "_id": 0,
+    "expiration_date": 1,
+    "never_expire": 1,
+    "is_active": 1,
+}
+
+# Error code of a write rejected by a unique index
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _usage_row(document: dict) -> tuple:
+    # Tuple of get_usage_stats, with the api_key in its text form
+    return key_codec.decode_row(tuple(document.get(field) for field in USAGE_FIELDS))
+
 
 class MongodbAccess:
     """Class handling Remote Mongodb connection and writes. Change MONGODB_URI, if migrating database to a new location."""
 
     def __init__(self):
-        try:
-            # Connect to an existing database
-            connection = pymongo.MongoClient(MONGODB_URL)
-            mydb = connection["test"]
-            mytable = mydb["user"]
-            print("You are connected to - ", mytable.list_database_names, "\n")
-        except Exception as e:
-            print("Error while connecting to mongodb database!", e)
+        # A single client per process, it maintains its own connection pool
+        self.client = pymongo.MongoClient(
+            MONGODB_URL,
+            maxPoolSize=int(os.getenv("FASTAPI_AUTH_POOL_MAX_SIZE", "10")),
+        )
+        self.collection = self.client["test"]["user"]
+        # Query count of each API key per rollup bucket, bucket_start in epoch seconds
+        self.usage_rollups = self.client["test"]["usage_rollup"]
 
         try:
             self.expiration_limit = int(os.getenv("FASTAPI_AUTH_AUTOMATIC_EXPIRATION"))
-        except KeyError:
+        except (KeyError, TypeError):
             self.expiration_limit = 15
 
+        self.usage_recorder = UsageRecorder(
+            self._update_usage, flush_rollups=self._update_usage_rollups
+        )
+
         self.init_db()
 
     def init_db(self):
         """
-        The init_db function creates a new database in MongoDB.
-        
-        
+        The init_db function creates the indexes of the API key and usage rollup collections in MongoDB.
+        api_key, username and email are unique, and usage stats are sorted on latest_query_date.
+
         Args:
             self: Reference the class itself
-        
+
         Returns:
-            A dictionary of the inserted document
+            Nothing
         """
         try:
-            connection = pymongo.MongoClient(MONGODB_URL)
-            db = connection["test"]
-            mycol = db["user_database"]
-            mydict = {
-                "api_key": "api_key",
-                "is_active": "is_active",
-                "never_expire": "never_expire",
-                "expiration_date": "expiration_date",
-                "latest_query_date": "latest_query_date",
-                "total_queries": "total_queries",
-                "username": "username",
-                "email": "email",
-                "password": "password",
-            }
-            
-            # Create database
-            mycol.insert_one(mydict)
+            self.collection.create_index("api_key", unique=True)
+            # Keys created without a username or email do not collide on null
+            self.collection.create_index(
+                "username",
+                unique=True,
+                partialFilterExpression={"username": {"$type": "string"}},
+            )
+            self.collection.create_index(
+                "email",
+                unique=True,
+                partialFilterExpression={"email": {"$type": "string"}},
+            )
+            # Serves the sort and the keyset of the usage logs pages
+            self.collection.create_index(
+                [
+                    ("latest_query_date", pymongo.DESCENDING),
+                    ("api_key", pymongo.DESCENDING),
+                ]
+            )
+            self.usage_rollups.create_index(
+                [("api_key", pymongo.ASCENDING), ("bucket_start", pymongo.ASCENDING)],
+                unique=True,
+            )
+            self.usage_rollups.create_index("bucket_start")
+            if key_codec.binary:
+                self._migrate_keys()
         except Exception as e:
             print("Error while using mongodb:", e)
 
+    def _migrate_keys(self):
+        """
+        The _migrate_keys function packs the API keys stored as strings into their 16 bytes, with bulk updates of 1000 documents,
+        in the API key and usage rollup collections.
+
+        Args:
+            self: Reference the class itself
+
+        Returns:
+            Nothing
+        """
+        for collection in (self.collection, self.usage_rollups):
+            updates = []
+            for document in collection.find({"api_key": {"$type": "string"}}, {"api_key": 1}):
+                stored = key_codec.encode(document["api_key"])
+                # Keys that are not UUIDs cannot be packed, nor validated in this format, they are left as they are
+                if stored is not None:
+                    updates.append(UpdateOne({"_id": document["_id"]}, {"$set": {"api_key": stored}}))
+                if len(updates) == 1000:
+                    collection.bulk_write(updates, ordered=False)
+                    updates = []
+            if updates:
+                collection.bulk_write(updates, ordered=False)
+
     def create_key(self, username, email, password, never_expire) -> dict:
         """
-        The create_key function creates a new api key for the user. It takes in username, email, password and never_expire as parameters. 
+        The create_key function creates a new api key for the user. It takes in username, email, password and never_expire as parameters.
         It returns an api-key which is a string of random characters.
-        
+        Duplicate users are rejected by the unique indexes, in the same round trip as the insert.
+
         Args:
             self: Access variables that belongs to the class
             username: Store the username of the user
             email: Check if the user already exists in the database
             password: Store the password of the user in a hashed format
             never_expire: Determine if the api key will expire or not
-        
+
         Returns:
             A dictionary containing the api key
         """
         api_key = str(uuid.uuid4())
-        connection = pymongo.MongoClient(MONGODB_URL)
-        db = connection["test"]
-        mycol = db["user"]
         mydict = {
-                "api_key": api_key,
-                "is_active": 1,
-                "never_expire": 1 if never_expire else 0,
-                "expiration_date": (
-                    datetime.utcnow() + timedelta(days=self.expiration_limit)
-                ).isoformat(timespec="seconds"),
-                "latest_query_date": None,
-                "total_queries": 0,
-                "username": username,
-                "email": email,
-                "password": password,
-            }
-        # check if user already exists in the mongodb database and if not, create a new user
-        if (mycol.find_one({"username": username}) is None and mycol.find_one({"email": email}) is None):
-            mycol.insert_one(mydict)
-            # data = list()
-            # for x in mycol.find():
-            #     data.append(x)
-            #     print(data)
-            return {"api-key": api_key}
-        else:
-            raise HTTPException(status_code=HTTP_403_FORBIDDEN,
-                detail = "This user already exists")
-            
-            
-            
+            "api_key": key_codec.encode(api_key),
+            "is_active": 1,
+            "never_expire": 1 if never_expire else 0,
+            "expiration_date": (
+                datetime.utcnow() + timedelta(days=self.expiration_limit)
+            ).isoformat(timespec="seconds"),
+            "latest_query_date": None,
+            "total_queries": 0,
+            "username": username,
+            "email": email,
+            "password": password,
+        }
+        try:
+            self.collection.insert_one(mydict)
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=HTTP_403_FORBIDDEN, detail="This user already exists"
+            )
+
+        key_filter.add(api_key)
+        return {"api-key": api_key}
+
+    def create_keys(self, users: List[NewUser]) -> List[dict]:
+        """
+        The create_keys function creates an API key for each user, like create_key, in batches.
+        Each batch runs one duplicate user query and one unordered insert_many. Without a replica set
+        MongoDB has no multi-document transactions, a document rejected by the unique indexes does not undo the others.
+
+        Args:
+            self: Access variables that belongs to the class
+            users:List[NewUser]: Tuples of username, email, hashed password and never_expire
+
+        Returns:
+            One dictionary per user, in order, with either the api-key created or the error
+        """
+
+        def find_existing(usernames, emails):
+            existing = self.collection.find(
+                {"$or": [{"username": {"$in": usernames}}, {"email": {"$in": emails}}]},
+                {"_id": 0, "username": 1, "email": 1},
+            )
+            return existing_users(
+                (document.get("username"), document.get("email")) for document in existing
+            )
+
+        def insert(rows):
+            try:
+                self.collection.insert_many(
+                    [dict(zip(USAGE_FIELDS + ["password"], row)) for row in rows], ordered=False
+                )
+            except BulkWriteError as exc:
+                errors = exc.details["writeErrors"]
+                if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+                    raise
+                return {error["index"] for error in errors}
+            return set()
+
+        return create_keys_in_batches(
+            users,
+            (datetime.utcnow() + timedelta(days=self.expiration_limit)).isoformat(
+                timespec="seconds"
+            ),
+            find_existing,
+            insert,
+        )
+
     def renew_key(self, api_key: str, new_expiration_date: str) -> Optional[str]:
         """
-        This method has not been fully implemented yet. Will be worked on in future updates.
-        """
-        raise HTTPException(status = HTTP_422_UNPROCESSABLE_ENTITY, detail="This endpoint is tot implemented yet with Mongodb")  
-
-
-
-        # connection = pymongo.MongoClient(MONGODB_URL)
-        # db = connection["test"]
-        # mycol = db["user"]
-        # response = mycol.find_one({"api_key": api_key})
-       
-        # if response is None:
-        #     raise HTTPException(
-        #         status_code=HTTP_404_NOT_FOUND, detail="API key not found"
-        #     )
-
-        #     # Without an expiration date, we set it here
-        # if not new_expiration_date:
-        #     parsed_expiration_date = (
-        #         datetime.utcnow() + timedelta(days=self.expiration_limit)
-        #     ).isoformat(timespec="seconds")
-
-        # else:
-        #     try:
-        #         # We parse and re-write to the right timespec
-        #         parsed_expiration_date = datetime.fromisoformat(
-        #             new_expiration_date
-        #         ).isoformat(timespec="seconds")
-        #     except ValueError as exc:
-        #         raise HTTPException(
-        #             status_code=HTTP_422_UNPROCESSABLE_ENTITY,
-        #             detail="The expiration date could not be parsed. \
-        #                     Please use ISO 8601.",
-        #         ) from exc
-        # response_lines = []
-        # myquery = {"api_key": api_key, "expiration_date": new_expiration_date}
-        # if mycol.find_one(myquery) is not None:
-        #     newvalues = {"$set": {"expiration_date": parsed_expiration_date}}
-        #     mycol.update_one(myquery, newvalues)
-        #     response_lines.append(f"The expiration date has been set to {parsed_expiration_date}.")
-        #     return " ".join(response_lines)
-        # else:
-        #     print("error")
-            
-            
+        The renew_key function takes an API key and a new expiration date.
+        If the API key is not found, it raises a 404 error.
+        Otherwise, it updates the expiration date of the API key to be that specified by new_expiration_date (or 15 days from now if no argument is given),
+        reactivating the key if it was revoked.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: Check if the api key is valid
+            new_expiration_date:str: Set the new expiration date
+
+        Returns:
+            A string with a message about the api key's new expiration date
+        """
+        # Without an expiration date, we set it here
+        if not new_expiration_date:
+            parsed_expiration_date = (
+                datetime.utcnow() + timedelta(days=self.expiration_limit)
+            ).isoformat(timespec="seconds")
+
+        else:
+            try:
+                # We parse and re-write to the right timespec
+                parsed_expiration_date = datetime.fromisoformat(
+                    new_expiration_date
+                ).isoformat(timespec="seconds")
+            except ValueError as exc:
+                raise HTTPException(
+                    status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="The expiration date could not be parsed. \
+                            Please use ISO 8601.",
+                ) from exc
+
+        # The previous document tells whether the key was revoked
+        response = self.collection.find_one_and_update(
+            {"api_key": key_codec.encode(api_key)},
+            {"$set": {"expiration_date": parsed_expiration_date, "is_active": 1}},
+            projection={"_id": 0, "is_active": 1},
+        )
+
+        # API key not found
+        if response is None:
+            raise HTTPException(
+                status_code=HTTP_404_NOT_FOUND, detail="API key not found"
+            )
+
+        key_cache.invalidate(api_key)
+
+        response_lines = []
+
+        # Previously revoked key. Issue a text warning.
+        if response["is_active"] == 0:
+            response_lines.append("This API key was revoked and has been reactivated.")
+
+        response_lines.append(
+            f"The new expiration date for the API key is {parsed_expiration_date}"
+        )
+
+        return " ".join(response_lines)
+
     def revoke_key(self, api_key: str):
         """
         The revoke_key function takes an API key as a parameter and sets the is_active field to false.
         If the API key does not exist, it raises a 404 error.
-        
+
         Args:
             self: Access variables that belongs to the class
             api_key:str: Specify the api_key that is to be revoked
-        
+
         Returns:
             this api key has been revoked
-        
+
         Doc Author:
             Trelent
         """
-        connection = pymongo.MongoClient(MONGODB_URL)
-        db = connection["test"]
-        mycol = db["user"]
-        myquery = {"api_key": api_key}
-        if mycol.find_one(myquery) is not None:
-            newvalues = {"$set": {"is_active": 0}}
-            mycol.update_one(myquery, newvalues)
-            return "This API key has been revoked." 
-        else:
+        result = self.collection.update_one(
+            {"api_key": key_codec.encode(api_key)}, {"$set": {"is_active": 0}}
+        )
+        if result.matched_count == 0:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="API key not found")
 
+        key_cache.invalidate(api_key)
+        return "This API key has been revoked."
 
-    def check_key(self, api_key: str) -> Optional[str]:
+    def revoke_keys(self, selection: KeySelection) -> dict:
         """
-        The check_key function has not been fully implemented yet. Will be worked on in future updates.
+        The revoke_keys function revokes every API key of the selection with a single update_many.
+
+        Args:
+            self: Access variables that belongs to the class
+            selection:KeySelection: The API keys, or the filters, of the keys to revoke
+
+        Returns:
+            The number of API keys revoked, keys already revoked are not counted
         """
-        raise HTTPException(status = HTTP_422_UNPROCESSABLE_ENTITY, detail="This endpoint is tot implemented yet with Mongodb")  
-    
+        result = self.collection.update_many(
+            {"$and": [{"is_active": 1}, self._selection_filter(selection)]},
+            {"$set": {"is_active": 0}},
+        )
+
+        invalidate_selection(selection)
+        return {"revoked": result.modified_count}
+
+    def renew_keys(
+        self, selection: KeySelection, expiration_date: Optional[datetime] = None
+    ) -> dict:
+        """
+        The renew_keys function sets a new expiration date on every API key of the selection with a single update_many,
+        reactivating the revoked ones.
+
+        Args:
+            self: Access variables that belongs to the class
+            selection:KeySelection: The API keys, or the filters, of the keys to renew
+            expiration_date:Optional[datetime]: The new expiration date, FASTAPI_AUTH_AUTOMATIC_EXPIRATION days from now by default
+
+        Returns:
+            The number of API keys renewed and their new expiration date
+        """
+        expiration_date = to_utc(
+            expiration_date or datetime.utcnow() + timedelta(days=self.expiration_limit)
+        )
+        result = self.collection.update_many(
+            self._selection_filter(selection),
+            {"$set": {"expiration_date": expiration_date.isoformat(), "is_active": 1}},
+        )
+
+        invalidate_selection(selection)
+        return {"renewed": result.matched_count, "expiration_date": expiration_date.isoformat()}
+
+    @staticmethod
+    def _selection_filter(selection: KeySelection) -> dict:
+        # Same criteria as sql_selection_conditions, dates are compared as ISO 8601 strings
+        check_selection(selection)
+        filters = []
+        if selection.api_keys is not None:
+            filters.append(
+                {"api_key": {"$in": [key_codec.encode(api_key) for api_key in selection.api_keys]}}
+            )
+        if selection.username is not None:
+            filters.append({"username": selection.username})
+        if selection.email_domain is not None:
+            filters.append({"email": {"$regex": re.escape("@" + selection.email_domain) + "$"}})
+        if selection.expires_after is not None or selection.expires_before is not None:
+            filters.append({"never_expire": 0})
+        if selection.expires_after is not None:
+            filters.append({"expiration_date": {"$gte": to_utc(selection.expires_after).isoformat()}})
+        if selection.expires_before is not None:
+            filters.append({"expiration_date": {"$lt": to_utc(selection.expires_before).isoformat()}})
+
+        return {"$and": filters}
+
+    def check_key(self, api_key: str) -> bool:
+        """
+        The check_key function checks if the API key is valid.
+        It returns True if it is, False otherwise.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: Fetch the api_key from the database
+
+        Returns:
+            True if the api key is valid, false otherwise
+        """
+        return self.check_key_status(api_key) is None
+
+    def check_key_status(self, api_key: str) -> Optional[str]:
+        """
+        The check_key_status function validates an API key like check_key, and tells why it is not valid.
+        The reason comes from the same single document lookup, so the denial counters of the metrics cost no extra query.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: Fetch the api_key from the database
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        document = self.collection.find_one(
+            {"api_key": key_codec.encode(api_key)},
+            projection=CHECK_KEY_PROJECTION,
+        )
+        response = (
+            (document["expiration_date"], document["never_expire"], document["is_active"])
+            if document
+            else None
+        )
+
+        return self._check_status(api_key, response)
+
+    def _check_status(self, api_key: str, response: Optional[tuple]) -> Optional[str]:
+        """
+        The _check_status function decides if an API key is valid from the document fetched by check_key_status.
+        Valid keys are cached and their usage recorded.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key that was looked up
+            response:Optional[tuple]: The expiration_date, never_expire, is_active values, or None if the key is missing
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        if not response:
+            return "unknown"
+
+        expiration_date, never_expire, is_active = response
+        if not is_active:
+            return "revoked"
+        # ISO 8601 dates with the same timespec compare like the dates themselves
+        if not never_expire and expiration_date < datetime.utcnow().isoformat(timespec="seconds"):
+            return "expired"
+
+        # The key is valid
+        key_cache.add(
+            api_key,
+            None
+            if never_expire
+            else datetime.fromisoformat(expiration_date)
+            .replace(tzinfo=timezone.utc)
+            .timestamp(),
+        )
+
+        # Usage is aggregated in memory and written in bulk by a background thread
+        self.usage_recorder.record(api_key)
+
+        return None
+
+    def _update_usage(self, usage: List[Tuple[int, int, str]]):
+        """
+        The _update_usage function is called by the usage recorder with every usage delta aggregated since its last flush.
+        All the keys are updated with atomic $inc operations sent in a single unordered bulk write.
+
+        Args:
+            self: Access the class attributes
+            usage:List[Tuple[int, int, str]]: Tuples of query count delta, latest query epoch and api_key
+
+        Returns:
+            Nothing
+        """
+        self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"api_key": key_codec.encode(api_key)},
+                    {
+                        "$inc": {"total_queries": delta},
+                        "$max": {
+                            "latest_query_date": datetime.utcfromtimestamp(
+                                latest_query_date
+                            ).isoformat(timespec="seconds")
+                        },
+                    },
+                )
+                for delta, latest_query_date, api_key in usage
+            ],
+            ordered=False,
+        )
+
+    def _update_usage_rollups(self, rollups: List[Tuple[int, int, str]]):
+        """
+        The _update_usage_rollups function is called by the usage recorder with the query counts of the rollup buckets that ended.
+        Each count is added to its bucket, which other workers may have written too, with upserting $inc operations in a single unordered bulk write.
+
+        Args:
+            self: Access the class attributes
+            rollups:List[Tuple[int, int, str]]: Tuples of query count, bucket start epoch and api_key
+
+        Returns:
+            Nothing
+        """
+        self.usage_rollups.bulk_write(
+            [
+                UpdateOne(
+                    {"api_key": key_codec.encode(api_key), "bucket_start": bucket_start},
+                    {"$inc": {"count": count}},
+                    upsert=True,
+                )
+                for count, bucket_start, api_key in rollups
+            ],
+            ordered=False,
+        )
+
+    def get_usage_rollups(
+        self, api_key: Optional[str], start: datetime, end: datetime, granularity: int
+    ) -> List[Tuple[str, int]]:
+        """
+        The get_usage_rollups function sums the usage rollups of a period per bucket of the given granularity.
+
+        Args:
+            self: Access the class attributes
+            api_key:Optional[str]: Only count the queries of this API key, None for every key
+            start:datetime: Start of the period, naive UTC
+            end:datetime: End of the period, excluded, naive UTC
+            granularity:int: Size of the buckets returned, in seconds, a multiple of the rollup bucket
+
+        Returns:
+            A list of bucket start, in ISO 8601, and query count, for the buckets with queries
+        """
+        match = {
+            "bucket_start": {
+                "$gte": int(start.replace(tzinfo=timezone.utc).timestamp()),
+                "$lt": int(end.replace(tzinfo=timezone.utc).timestamp()),
+            }
+        }
+        if api_key is not None:
+            match["api_key"] = key_codec.encode(api_key)
+
+        buckets = self.usage_rollups.aggregate(
+            [
+                {"$match": match},
+                {
+                    "$group": {
+                        "_id": {
+                            "$subtract": [
+                                "$bucket_start",
+                                {"$mod": ["$bucket_start", granularity]},
+                            ]
+                        },
+                        "count": {"$sum": "$count"},
+                    }
+                },
+                {"$sort": {"_id": 1}},
+            ]
+        )
+
+        return [
+            (datetime.utcfromtimestamp(bucket["_id"]).isoformat(timespec="seconds"), bucket["count"])
+            for bucket in buckets
+        ]
+
+    def get_api_keys(self) -> Iterator[str]:
+        """
+        The get_api_keys function yields every API key stored in the database.
+        It is used to build the negative lookup filter at startup.
+
+        Args:
+            self: Access variables that belongs to the class
+
+        Returns:
+            An iterator over the api_key values
+        """
+        for document in self.collection.find({}, {"api_key": 1, "_id": 0}):
+            yield key_codec.decode(document["api_key"])
+
+    def get_revoked_keys(self) -> List[str]:
+        """
+        The get_revoked_keys function returns every revoked API key.
+        It is used to refresh the revoked set of the signed API keys.
+
+        Args:
+            self: Access variables that belongs to the class
+
+        Returns:
+            A list of api_key values
+        """
+        return [
+            key_codec.decode(document["api_key"])
+            for document in self.collection.find({"is_active": 0}, {"api_key": 1, "_id": 0})
+        ]
+
+    def set_rate_limit(
+        self, api_key: str, rate: Optional[float], burst: Optional[int]
+    ) -> dict:
+        """
+        The set_rate_limit function sets the rate limit of an API key, overriding FASTAPI_AUTH_RATE_LIMIT.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to limit
+            rate:Optional[float]: Requests per second, 0 for no limit, None for the global rate
+            burst:Optional[int]: Requests allowed at once, None for the global burst
+
+        Returns:
+            The rate limit of the key
+        """
+        response = self.collection.update_one(
+            {"api_key": key_codec.encode(api_key)},
+            {"$set": {"rate_limit": rate, "rate_limit_burst": burst}},
+        )
+        if not response.matched_count:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="API key not found")
+
+        return {"rate_limit": rate, "rate_limit_burst": burst}
+
+    def get_rate_limits(self) -> Dict[str, Tuple[Optional[float], Optional[int]]]:
+        """
+        The get_rate_limits function returns the API keys that have their own rate limit.
+        It is used to refresh the limits of the rate limiter.
+
+        Args:
+            self: Access the class attributes
+
+        Returns:
+            A dictionary of api_key to rate and burst, None when the global one applies
+        """
+        return {
+            key_codec.decode(document["api_key"]): (
+                document.get("rate_limit"),
+                document.get("rate_limit_burst"),
+            )
+            for document in self.collection.find(
+                {"$or": [{"rate_limit": {"$ne": None}}, {"rate_limit_burst": {"$ne": None}}]},
+                {"api_key": 1, "rate_limit": 1, "rate_limit_burst": 1, "_id": 0},
+            )
+        }
+
+    def _sync_rate_counts(self, counts: List[Tuple[int, str]]) -> Dict[str, int]:
+        """
+        The _sync_rate_counts function is called by the rate limiter to share the token buckets between the workers.
+        The requests each worker allowed are added to rate_limit_count, and the counts of the keys are read back.
+
+        Args:
+            self: Access the class attributes
+            counts:List[Tuple[int, str]]: Tuples of allowed requests delta and api_key
+
+        Returns:
+            A dictionary of api_key to rate_limit_count
+        """
+        updates = [
+            UpdateOne({"api_key": key_codec.encode(api_key)}, {"$inc": {"rate_limit_count": delta}})
+            for delta, api_key in counts
+            if delta
+        ]
+        if updates:
+            self.collection.bulk_write(updates, ordered=False)
+
+        return {
+            key_codec.decode(document["api_key"]): document.get("rate_limit_count", 0)
+            for document in self.collection.find(
+                {"api_key": {"$in": [key_codec.encode(api_key) for _, api_key in counts]}},
+                {"api_key": 1, "rate_limit_count": 1, "_id": 0},
+            )
+        }
+
     def get_usage_stats(self) -> List[Tuple[str, bool, bool, str, str, int, str, str]]:
         """
-        The get_usage_stats function has not been fully implemented yet. Will be worked on in future updates.
+        The get_usage_stats function returns a list of tuples with values being api_key, is_active, never_expire, expiration_date, \
+        latest_query_date, total_queries, username and email, computed by an aggregation pipeline.
+
+        Args:
+            self: Access variables that belongs to the class
+
+        Returns:
+            A list of tuples sorted by latest query date, most recent first
         """
-        raise HTTPException(status = HTTP_422_UNPROCESSABLE_ENTITY, detail="This endpoint is tot implemented yet with Mongodb")  
-        
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        pipeline = [
+            {"$sort": {"latest_query_date": pymongo.DESCENDING}},
+            {"$project": {"_id": 0, **{field: 1 for field in USAGE_FIELDS}}},
+        ]
+
+        return [
+            _usage_row(document)
+            for document in self.collection.aggregate(pipeline)
+        ]
+
+    def get_usage_logs(self, query: UsageQuery) -> List[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The get_usage_logs function returns a page of the usage stats, filtered and paginated by the database.
+        The documents are sorted by latest query date then api_key, most recent first, and the never used keys come last.
+
+        Args:
+            self: Access variables that belongs to the class
+            query:UsageQuery: The filters, page size and cursor
+
+        Returns:
+            A list of tuples like get_usage_stats
+        """
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        now = datetime.utcnow().isoformat(timespec="seconds")
+        filters = []
+        if query.active:
+            filters.append(
+                {
+                    "is_active": 1,
+                    "$or": [{"never_expire": 1}, {"expiration_date": {"$gte": now}}],
+                }
+            )
+        if query.expired:
+            filters.append({"never_expire": 0, "expiration_date": {"$lt": now}})
+        if query.username_prefix:
+            filters.append({"username": {"$regex": "^" + re.escape(query.username_prefix)}})
+        if query.email_prefix:
+            filters.append({"email": {"$regex": "^" + re.escape(query.email_prefix)}})
+        if query.min_total_queries is not None:
+            filters.append({"total_queries": {"$gte": query.min_total_queries}})
+
+        def fetch(used, after_date, after_key, limit):
+            after_key = None if after_key is None else key_codec.encode(after_key)
+            if not used:
+                page = [{"latest_query_date": None}]
+                if after_key is not None:
+                    page.append({"api_key": {"$lt": after_key}})
+            elif after_key is None:
+                page = [{"latest_query_date": {"$ne": None}}]
+            else:
+                page = [
+                    {
+                        "$or": [
+                            {"latest_query_date": {"$lt": after_date}},
+                            {"latest_query_date": after_date, "api_key": {"$lt": after_key}},
+                        ]
+                    }
+                ]
+
+            documents = (
+                self.collection.find(
+                    {"$and": page + filters},
+                    {"_id": 0, **{field: 1 for field in USAGE_FIELDS}},
+                )
+                .sort([("latest_query_date", pymongo.DESCENDING), ("api_key", pymongo.DESCENDING)])
+                .limit(limit)
+            )
+            return [_usage_row(document) for document in documents]
+
+        return fetch_usage_page(fetch, query)
+
+    def iter_usage_stats(self) -> Iterator[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The iter_usage_stats function yields the usage stats of every API key, like get_usage_stats,
+        reading the collection in batches so the whole collection is never held in memory.
+
+        Args:
+            self: Access variables that belongs to the class
+
+        Returns:
+            An iterator over tuples like get_usage_stats, in no particular order
+        """
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        documents = self.collection.find(
+            {}, {"_id": 0, **{field: 1 for field in USAGE_FIELDS}}, batch_size=10000
+        )
+        try:
+            for document in documents:
+                yield _usage_row(document)
+        finally:
+            documents.close()
+
+
 mongodb_access = MongodbAccess()
@@ -3,45 +3,118 @@ MySQL Connection Class. This class should be used in production. Set "DATABASE_M
 """
 
 import os
-import threading
 import uuid
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import pymysql
 from dotenv import load_dotenv
 from fastapi import HTTPException
-from pymysql import Error
+from pymysql.constants import SERVER_STATUS
 from starlette.status import (
     HTTP_403_FORBIDDEN,
     HTTP_404_NOT_FOUND,
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
 
+from fastapi_auth._bulk_provisioning import NewUser, create_keys_in_batches, existing_users
+from fastapi_auth._bulk_updates import (
+    KeySelection,
+    check_selection,
+    invalidate_selection,
+    sql_selection_conditions,
+    to_utc,
+)
+from fastapi_auth._connection_pool import ConnectionPool
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._key_filter import key_filter
+from fastapi_auth._key_storage import key_codec
+from fastapi_auth._usage_logs import (
+    UsageQuery,
+    fetch_usage_page,
+    sql_filter_conditions,
+    sql_page_conditions,
+)
+from fastapi_auth._usage_recorder import UsageRecorder
+
 load_dotenv()
 try:
     if os.getenv("DATABASE_MODE") == "mysql":
         MYSQL_URI = os.getenv("MYSQL_URI")
     else:
-        pass
+        MYSQL_URI = None
 except KeyError as e:
-    pass
     MYSQL_URI = None
 
-try:
-    host = os.getenv("MYSQL_HOST")
-    database = os.getenv("MYSQL_DATABASE")
-    user = os.getenv("MYSQL_USER")
-    password = os.getenv("MYSQL_PASSWORD")
-    port = int(os.getenv("MYSQL_PORT"))
-    try:
-        connection = pymysql.connect(
-            host=host, database=database, user=user, port=port, password=password
-        )
-    except Error as e:
-        connection = None
-except KeyError as e:
-    print(e)
+# Connection settings, no connection is opened before the first query
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
+MYSQL_PORT = int(os.getenv("MYSQL_PORT") or 3306)
+
+# Column type and the older types it is migrated from. MySQL can only index VARCHAR columns,
+# and dates are stored as DATETIME so the validity predicate is evaluated in SQL
+COLUMN_MIGRATIONS = {
+    "api_key": ("VARCHAR(128)", ("text",)),
+    "username": ("VARCHAR(255)", ("text",)),
+    "email": ("VARCHAR(255)", ("text",)),
+    "expiration_date": ("DATETIME", ("text", "varchar")),
+    "latest_query_date": ("DATETIME", ("text", "varchar")),
+}
+
+# Columns added since the table was first created, with their type.
+# ADD COLUMN IF NOT EXISTS is MariaDB only, the columns missing from information_schema are added instead
+ADDED_COLUMNS = {
+    "username": "VARCHAR(255)",
+    "email": "VARCHAR(255)",
+    "password": "TEXT",
+    "rate_limit": "DOUBLE",
+    "rate_limit_burst": "INTEGER",
+    "rate_limit_count": "BIGINT NOT NULL DEFAULT 0",
+}
+
+# Columns of get_usage_stats and get_usage_logs, with the dates formatted as ISO 8601.
+# The % are escaped for pymysql, the queries must be executed with parameters
+USAGE_COLUMNS = """api_key, is_active, never_expire, \
+                DATE_FORMAT(expiration_date, '%%Y-%%m-%%dT%%H:%%i:%%s'), \
+                DATE_FORMAT(latest_query_date, '%%Y-%%m-%%dT%%H:%%i:%%s'), \
+                total_queries, username, email"""
+
+# The row of a key tells why it is denied, NULL if it is valid
+CHECK_KEY_QUERY = """
+            SELECT expiration_date, never_expire,
+                CASE
+                    WHEN is_active = 0 THEN 'revoked'
+                    WHEN never_expire = 0 AND expiration_date < UTC_TIMESTAMP() THEN 'expired'
+                END
+            FROM user_database
+            WHERE api_key = %s"""
+
+INSERT_KEY_QUERY = """
+                    INSERT INTO user_database
+                    (api_key, is_active, never_expire, expiration_date, \
+                        latest_query_date, total_queries, username, email, password)
+                    VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """
+
+
+def _connect():
+    # Statements commit on their own, multi-statement writes open explicit transactions
+    return pymysql.connect(
+        host=MYSQL_HOST,
+        database=MYSQL_DATABASE,
+        user=MYSQL_USER,
+        port=MYSQL_PORT,
+        password=MYSQL_PASSWORD,
+        autocommit=True,
+    )
+
+
+def _reset(connection):
+    # Only roll back if a transaction was left open, to save a round trip per query
+    if connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+        connection.rollback()
 
 
 class MySQLAccess:
@@ -49,33 +122,36 @@ class MySQLAccess:
 
     def __init__(self):
         try:
-            connection = pymysql.connect(
-                host=host,
-                database=database,
-                user=user,
-                port=port,
-                password=password,
-                ssl="require",
-            )
-            # Create a cursor to perform database operations
-            cursor = connection.cursor()
-            # Print MySQLQL details
-            print("MySQLserver information")
-            # Executing a SQL query
-            cursor.execute("SELECT version();")
-            # Fetch result
-            record = cursor.fetchone()
-            print("You are connected to - ", record, "\n")
-
-        except (Exception, pymysql.err.OperationalError) as error:
-            print("Error while connecting to MySQL:", error)
-
-        try:
-            self.expiration_limit = int(os.environ("FASTAPI_AUTH_AUTOMATIC_EXPIRATION"))
+            self.expiration_limit = int(os.getenv("FASTAPI_AUTH_AUTOMATIC_EXPIRATION"))
         except (KeyError, TypeError) as e:
             self.expiration_limit = 15
 
-        self.init_db()
+        # Connections are opened lazily and shared by every method and thread through the pool
+        self.pool = ConnectionPool(
+            connect=_connect,
+            check=lambda connection: connection.ping(reconnect=False),
+            reset=_reset,
+        )
+        self.usage_recorder = UsageRecorder(
+            self._update_usage, flush_rollups=self._update_usage_rollups
+        )
+        self._initialized = False
+
+    def _connection(self):
+        """
+        The _connection function checks a connection out of the pool.
+        The first call creates and migrates the table.
+
+        Args:
+            self: Access variables that belong to the class
+
+        Returns:
+            A context manager yielding a pymysql connection
+        """
+        if not self._initialized:
+            self.init_db()
+
+        return self.pool.connection()
 
     def init_db(self):
         """
@@ -86,48 +162,155 @@ class MySQLAccess:
             self: Access variables that belong to the class
 
         Returns:
-            The connection to the database
+            Nothing
         """
         try:
+            with self.pool.connection() as connection:
+                c = connection.cursor()
+                # Print MySQL details
+                c.execute("SELECT version();")
+                print("You are connected to - ", c.fetchone(), "\n")
+                # Create database
+                c.execute(
+                    f"""
+                CREATE TABLE IF NOT EXISTS user_database (
+                    api_key {"BINARY(16)" if key_codec.binary else "VARCHAR(128)"} PRIMARY KEY,
+                    is_active INTEGER,
+                    never_expire INTEGER,
+                    expiration_date DATETIME,
+                    latest_query_date DATETIME,
+                    total_queries INTEGER,
+                    username VARCHAR(255),
+                    email VARCHAR(255),
+                    password TEXT,
+                    rate_limit DOUBLE,
+                    rate_limit_burst INTEGER,
+                    rate_limit_count BIGINT NOT NULL DEFAULT 0)
+                """
+                )
+                # Query count of each API key per rollup bucket, written once the bucket ended
+                c.execute(
+                    f"""
+                CREATE TABLE IF NOT EXISTS usage_rollup (
+                    api_key {"BINARY(16)" if key_codec.binary else "VARCHAR(128)"} NOT NULL,
+                    bucket_start DATETIME NOT NULL,
+                    count BIGINT NOT NULL,
+                    PRIMARY KEY (api_key, bucket_start),
+                    INDEX usage_rollup_bucket_start_idx (bucket_start))
+                """
+                )
+                self._migrate_columns(c)
+                if key_codec.binary:
+                    self._migrate_keys(c)
+                self._create_indexes(c)
+            self._initialized = True
+        except (pymysql.err.OperationalError, KeyError) as e:
+            print("Error while connecting to MySQL:", e)
+            # pass  # Column already exist
 
-            host = os.getenv("MYSQL_HOST_NAME")
-            database = os.getenv("MYSQL_DATABASE")
-            user = os.getenv("MYSQL_USER")
-            password = os.getenv("MYSQL_PASSWORD")
-            connection = pymysql.connect(
-                host=host, database=database, user=user, password=password
-            )
-            c = connection.cursor()
-            # Create database
+    def _migrate_columns(self, c):
+        """
+        The _migrate_columns function converts the columns of older tables in place, in a single ALTER TABLE:
+        TEXT columns that are indexed become VARCHAR, ISO 8601 dates become DATETIME, and missing columns are added.
+
+        Args:
+            self: Access variables that belong to the class
+            c: A cursor of the connection running init_db
+
+        Returns:
+            Nothing
+        """
+        c.execute(
+            """
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'user_database'"""
+        )
+        data_types = {name.lower(): data_type.lower() for name, data_type in c.fetchall()}
+        modifications = [
+            f"MODIFY {column} {column_type}"
+            for column, (column_type, older_types) in COLUMN_MIGRATIONS.items()
+            if data_types.get(column) in older_types
+        ] + [
+            f"ADD COLUMN {column} {column_type}"
+            for column, column_type in ADDED_COLUMNS.items()
+            if column not in data_types
+        ]
+        if modifications:
+            c.execute(f"ALTER TABLE user_database {', '.join(modifications)}")
+
+    def _migrate_keys(self, c):
+        """
+        The _migrate_keys function packs the API keys stored as text into their 16 bytes, in the key table and the usage rollups.
+        The column first becomes VARBINARY to keep the text bytes, the keys are unhexed, then the column is narrowed to BINARY(16).
+        MySQL commits each ALTER TABLE on its own, an interrupted migration resumes on the next start.
+
+        Args:
+            self: Access variables that belong to the class
+            c: A cursor of the connection running init_db
+
+        Returns:
+            Nothing
+        """
+        for table in ("user_database", "usage_rollup"):
             c.execute(
                 """
-            CREATE TABLE IF NOT EXISTS user_database (
-                api_key TEXT PRIMARY KEY,
-                is_active INTEGER,
-                never_expire INTEGER,
-                expiration_date TEXT,
-                latest_query_date TEXT,
-                total_queries INTEGER)
-            """
+                SELECT data_type
+                FROM information_schema.columns
+                WHERE table_schema = DATABASE() AND table_name = %s AND column_name = 'api_key'""",
+                (table,),
             )
-            connection.commit()
-            # Migration: Add api key username
+            if c.fetchone()[0].lower() not in ("varchar", "text", "varbinary"):
+                continue
+
+            c.execute(f"ALTER TABLE {table} MODIFY api_key VARBINARY(128) NOT NULL")
+            c.execute(
+                f"UPDATE {table} SET api_key = UNHEX(REPLACE(api_key, '-', '')) WHERE LENGTH(api_key) = 36"
+            )
+            c.execute(f"ALTER TABLE {table} MODIFY api_key BINARY(16) NOT NULL")
+
+    def _create_indexes(self, c):
+        """
+        The _create_indexes function creates the indexes serving the duplicate user check of create_key
+        and the ORDER BY of get_usage_stats. InnoDB stores the rows in the primary key, so the check_key lookup
+        is already covered and needs no extra index.
+        A unique index cannot be built over existing duplicate users, a plain index is created instead.
+
+        Args:
+            self: Access variables that belong to the class
+            c: A cursor of the connection running init_db
+
+        Returns:
+            Nothing
+        """
+        c.execute(
+            """
+            SELECT DISTINCT index_name
+            FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'user_database'"""
+        )
+        indexes = {row[0] for row in c.fetchall()}
+
+        for column in ("username", "email"):
+            if {f"user_database_{column}_key", f"user_database_{column}_idx"} & indexes:
+                continue
             try:
                 c.execute(
-                    "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS username TEXT"
-                )
-                c.execute(
-                    "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS email TEXT"
+                    f"CREATE UNIQUE INDEX user_database_{column}_key ON user_database ({column})"
                 )
+            except pymysql.err.IntegrityError:
+                print(f"Duplicate {column} values found, {column} is indexed without a unique constraint")
                 c.execute(
-                    "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS password TEXT"
+                    f"CREATE INDEX user_database_{column}_idx ON user_database ({column})"
                 )
-                connection.commit()
-            except pymysql.err.OperationalError as e:
-                pass
-        except (pymysql.err.OperationalError, KeyError) as e:
-            print("Error while connecting to MySQL:", e)
-            # pass  # Column already exist
+
+        # Serves the ORDER BY and the keyset of the usage logs pages
+        if "user_database_latest_query_date_idx" in indexes:
+            c.execute("DROP INDEX user_database_latest_query_date_idx ON user_database")
+        if "user_database_latest_query_date_api_key_idx" not in indexes:
+            c.execute(
+                "CREATE INDEX user_database_latest_query_date_api_key_idx ON user_database (latest_query_date, api_key)"
+            )
 
     def create_key(self, username, email, password, never_expire) -> dict:
         """
@@ -148,9 +331,8 @@ class MySQLAccess:
         """
         api_key = str(uuid.uuid4())
 
-        with pymysql.connect(
-            host="localhost", database="database", user="root", password="linda321"
-        ) as connection:
+        with self._connection() as connection:
+            connection.begin()
             c = connection.cursor()
             c.execute(
                 """SELECT username, email
@@ -166,19 +348,13 @@ class MySQLAccess:
                 )
             else:
                 c.execute(
-                    """
-                    INSERT INTO user_database
-                    (api_key, is_active, never_expire, expiration_date, \
-                        latest_query_date, total_queries, username, email, password)
-                    VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """,
+                    INSERT_KEY_QUERY,
                     (
-                        api_key,
+                        key_codec.encode(api_key),
                         1,
                         1 if never_expire else 0,
-                        (
-                            datetime.utcnow() + timedelta(days=self.expiration_limit)
-                        ).isoformat(timespec="seconds"),
+                        datetime.utcnow().replace(microsecond=0)
+                        + timedelta(days=self.expiration_limit),
                         None,
                         0,
                         username,
@@ -188,8 +364,66 @@ class MySQLAccess:
                 )
                 connection.commit()
 
+        key_filter.add(api_key)
         return {"api-key": api_key}
 
+    def create_keys(self, users: List[NewUser]) -> List[dict]:
+        """
+        The create_keys function creates an API key for each user, like create_key, in batches.
+        Each batch runs one duplicate user query and one executemany insert, which pymysql sends
+        as a multi-row INSERT, in a single transaction.
+
+        Args:
+            self: Access variables that belongs to the class
+            users:List[NewUser]: Tuples of username, email, hashed password and never_expire
+
+        Returns:
+            One dictionary per user, in order, with either the api-key created or the error
+        """
+        with self._connection() as connection:
+            c = connection.cursor()
+
+            def find_existing(usernames, emails):
+                # An empty IN list is a syntax error in MySQL
+                c.execute(
+                    f"""SELECT username, email
+                       FROM user_database
+                       WHERE username IN ({", ".join(["%s"] * len(usernames)) or "NULL"})
+                           OR email IN ({", ".join(["%s"] * len(emails)) or "NULL"})""",
+                    (*usernames, *emails),
+                )
+                existing = c.fetchall()
+                return existing_users(existing)
+
+            def insert(rows):
+                connection.begin()
+                try:
+                    c.executemany(INSERT_KEY_QUERY, rows)
+                    connection.commit()
+                    return set()
+                except pymysql.IntegrityError:
+                    connection.rollback()
+
+                # A user was created concurrently, the rows are inserted one by one in one transaction.
+                # A duplicate key error only rolls back its own statement
+                rejected = set()
+                connection.begin()
+                for position, row in enumerate(rows):
+                    try:
+                        c.execute(INSERT_KEY_QUERY, row)
+                    except pymysql.IntegrityError:
+                        rejected.add(position)
+                connection.commit()
+                return rejected
+
+            return create_keys_in_batches(
+                users,
+                datetime.utcnow().replace(microsecond=0)
+                + timedelta(days=self.expiration_limit),
+                find_existing,
+                insert,
+            )
+
     def renew_key(self, api_key: str, new_expiration_date: str) -> Optional[str]:
         """
         The renew_key function takes an API key and a new expiration date.
@@ -206,18 +440,16 @@ class MySQLAccess:
             A string
 
         """
-        with pymysql.connect(
-            host="localhost", database="database", user="root", password="linda321"
-        ) as connection:
+        with self._connection() as connection:
+            connection.begin()
             c = connection.cursor()
 
-            # We run the query like check_key but will use the response differently
             c.execute(
                 """
-            SELECT is_active, total_queries, expiration_date, never_expire
+            SELECT is_active
             FROM user_database
             WHERE api_key = %s""",
-                (api_key,),
+                (key_codec.encode(api_key),),
             )
 
             response = c.fetchone()
@@ -238,16 +470,13 @@ class MySQLAccess:
 
             # Without an expiration date, we set it here
             if not new_expiration_date:
-                parsed_expiration_date = (
-                    datetime.utcnow() + timedelta(days=self.expiration_limit)
-                ).isoformat(timespec="seconds")
+                expiration_date = datetime.utcnow() + timedelta(
+                    days=self.expiration_limit
+                )
 
             else:
                 try:
-                    # We parse and re-write to the right timespec
-                    parsed_expiration_date = datetime.fromisoformat(
-                        new_expiration_date
-                    ).isoformat(timespec="seconds")
+                    expiration_date = datetime.fromisoformat(new_expiration_date)
                 except ValueError as exc:
                     raise HTTPException(
                         status_code=HTTP_422_UNPROCESSABLE_ENTITY,
@@ -255,6 +484,14 @@ class MySQLAccess:
                             Please use ISO 8601.",
                     ) from exc
 
+            # Dates are stored in UTC, at the right timespec
+            if expiration_date.tzinfo is not None:
+                expiration_date = expiration_date.astimezone(timezone.utc).replace(
+                    tzinfo=None
+                )
+            expiration_date = expiration_date.replace(microsecond=0)
+            parsed_expiration_date = expiration_date.isoformat()
+
             c.execute(
                 """
             UPDATE user_database
@@ -262,12 +499,13 @@ class MySQLAccess:
             WHERE api_key = %s
             """,
                 (
-                    parsed_expiration_date,
-                    api_key,
+                    expiration_date,
+                    key_codec.encode(api_key),
                 ),
             )
 
             connection.commit()
+            key_cache.invalidate(api_key)
 
             response_lines.append(
                 f"The new expiration date for the API key is {parsed_expiration_date}"
@@ -287,9 +525,7 @@ class MySQLAccess:
             None
 
         """
-        with pymysql.connect(
-            host="localhost", database="database", user="root", password="linda321"
-        ) as connection:
+        with self._connection() as connection:
             c = connection.cursor()
 
             c.execute(
@@ -298,90 +534,390 @@ class MySQLAccess:
             SET is_active = 0
             WHERE api_key = %s
             """,
-                (api_key,),
+                (key_codec.encode(api_key),),
             )
 
             connection.commit()
+            key_cache.invalidate(api_key)
+
+    def revoke_keys(self, selection: KeySelection) -> dict:
+        """
+        The revoke_keys function revokes every API key of the selection with a single UPDATE.
+
+        Args:
+            self: Access the class attributes and methods
+            selection:KeySelection: The API keys, or the filters, of the keys to revoke
+
+        Returns:
+            The number of API keys revoked, keys already revoked are not counted
+        """
+        conditions, parameters = self._selection_conditions(selection)
+
+        with self._connection() as connection:
+            c = connection.cursor()
+
+            c.execute(
+                f"""
+            UPDATE user_database
+            SET is_active = 0
+            WHERE is_active = 1 AND {" AND ".join(conditions)}
+            """,
+                parameters,
+            )
+            revoked = c.rowcount
+
+            connection.commit()
+
+        invalidate_selection(selection)
+        return {"revoked": revoked}
+
+    def renew_keys(
+        self, selection: KeySelection, expiration_date: Optional[datetime] = None
+    ) -> dict:
+        """
+        The renew_keys function sets a new expiration date on every API key of the selection with a single UPDATE,
+        reactivating the revoked ones.
+
+        Args:
+            self: Access the class attributes and methods
+            selection:KeySelection: The API keys, or the filters, of the keys to renew
+            expiration_date:Optional[datetime]: The new expiration date, FASTAPI_AUTH_AUTOMATIC_EXPIRATION days from now by default
+
+        Returns:
+            The number of API keys renewed and their new expiration date
+        """
+        conditions, parameters = self._selection_conditions(selection)
+        expiration_date = to_utc(
+            expiration_date or datetime.utcnow() + timedelta(days=self.expiration_limit)
+        )
+
+        with self._connection() as connection:
+            c = connection.cursor()
+
+            c.execute(
+                f"""
+            UPDATE user_database
+            SET expiration_date = %s, is_active = 1
+            WHERE {" AND ".join(conditions)}
+            """,
+                (expiration_date, *parameters),
+            )
+            renewed = c.rowcount
+
+            connection.commit()
+
+        invalidate_selection(selection)
+        return {"renewed": renewed, "expiration_date": expiration_date.isoformat()}
+
+    def _selection_conditions(self, selection: KeySelection) -> Tuple[List[str], list]:
+        check_selection(selection)
+        conditions, parameters = sql_selection_conditions(
+            selection, "%s", "username", lambda date: date
+        )
+        if selection.api_keys is not None:
+            # An empty IN list is a syntax error in MySQL
+            conditions.insert(
+                0, f"api_key IN ({', '.join(['%s'] * len(selection.api_keys)) or 'NULL'})"
+            )
+            parameters[:0] = [key_codec.encode(api_key) for api_key in selection.api_keys]
+        return conditions, parameters
 
     def check_key(self, api_key: str) -> bool:
         """
         The check_key function checks if the API key is valid.
         It returns True if it is, False otherwise.
 
-
         Args:
             self: Access the class attributes
-            api_key:str: Fetch the api_key from the database
+            api_key:str: The API key to validate
 
         Returns:
             True if the api key is valid, false otherwise
         """
-        with pymysql.connect(
-            host="localhost", database="database", user="root", password="linda321"
-        ) as connection:
+        return self.check_key_status(api_key) is None
+
+    def check_key_status(self, api_key: str) -> Optional[str]:
+        """
+        The check_key_status function validates an API key like check_key, and tells why it is not valid.
+        The reason comes from the same single row lookup, so the denial counters of the metrics cost no extra query.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        with self._connection() as connection:
             c = connection.cursor()
 
-            c.execute(
-                """
-            SELECT is_active, total_queries, expiration_date, never_expire
-            FROM user_database
-            WHERE api_key = %s""",
-                (api_key,),
-            )
+            c.execute(CHECK_KEY_QUERY, (key_codec.encode(api_key),))
 
             response = c.fetchone()
 
-            if (
-                # Cannot fetch a row
-                not response
-                # Inactive
-                or response[0] != 1
-                # Expired key
-                or (
-                    (not response[3])
-                    and (datetime.fromisoformat(response[2]) < datetime.utcnow())
-                )
-            ):
-                # The key is not valid
-                return False
-            else:
-                # The key is valid
-
-                # We run the logging in a separate thread as writing takes some time
-                threading.Thread(
-                    target=self._update_usage,
-                    args=(
-                        api_key,
-                        response[1],
-                    ),
-                ).start()
+        return self._check_status(api_key, response)
+
+    def _check_status(self, api_key: str, response: Optional[tuple]) -> Optional[str]:
+        """
+        The _check_status function decides if an API key is valid from the row fetched by check_key_status.
+        Valid keys are cached and their usage recorded. It is shared with the native async drivers.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key that was looked up
+            response:Optional[tuple]: The expiration_date, never_expire and denial reason row, or None if the key is missing
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        if not response:
+            return "unknown"
 
-                # We return directly
-                return True
+        expiration_date, never_expire, reason = response
+        if reason is not None:
+            return reason
 
-    def _update_usage(self, api_key: str, usage_count: int):
-        with pymysql.connect(
-            host="localhost", database="database", user="root", password="linda321"
-        ) as connection:
+        # The key is valid
+        key_cache.add(
+            api_key,
+            None if never_expire else expiration_date.replace(tzinfo=timezone.utc).timestamp(),
+        )
+
+        # Usage is aggregated in memory and written in bulk by a background thread
+        self.usage_recorder.record(api_key)
+
+        return None
+
+    def _update_usage(self, usage: List[Tuple[int, int, str]]):
+        """
+        The _update_usage function is called by the usage recorder with every usage delta aggregated since its last flush.
+        All the keys are updated with a single executemany in one transaction.
+
+        Args:
+            self: Access the class attributes
+            usage:List[Tuple[int, int, str]]: Tuples of query count delta, latest query epoch and api_key
+
+        Returns:
+            Nothing
+        """
+        with self._connection() as connection:
+            # One transaction for the whole batch
+            connection.begin()
             c = connection.cursor()
 
-            # If we get there, this means it’s an active API key that’s in the database.\
-            #   We update the table.
-            c.execute(
+            c.executemany(
                 """
             UPDATE user_database
-            SET total_queries = %s, latest_query_date = %s
+            SET total_queries = total_queries + %s, latest_query_date = %s
             WHERE api_key = %s
             """,
-                (
-                    usage_count + 1,
-                    datetime.utcnow().isoformat(timespec="seconds"),
-                    api_key,
-                ),
+                [
+                    (delta, datetime.utcfromtimestamp(latest_query_date), key_codec.encode(api_key))
+                    for delta, latest_query_date, api_key in usage
+                ],
             )
 
             connection.commit()
 
+    def _update_usage_rollups(self, rollups: List[Tuple[int, int, str]]):
+        """
+        The _update_usage_rollups function is called by the usage recorder with the query counts of the rollup buckets that ended.
+        Each row is added to the count of its bucket, which other workers may have written too, with a multi-row INSERT in one transaction.
+
+        Args:
+            self: Access the class attributes
+            rollups:List[Tuple[int, int, str]]: Tuples of query count, bucket start epoch and api_key
+
+        Returns:
+            Nothing
+        """
+        with self._connection() as connection:
+            c = connection.cursor()
+            connection.begin()
+            c.executemany(
+                """
+                INSERT INTO usage_rollup (api_key, bucket_start, count)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+                """,
+                [
+                    (key_codec.encode(api_key), datetime.utcfromtimestamp(bucket_start), count)
+                    for count, bucket_start, api_key in rollups
+                ],
+            )
+            connection.commit()
+
+    def get_usage_rollups(
+        self, api_key: Optional[str], start: datetime, end: datetime, granularity: int
+    ) -> List[Tuple[str, int]]:
+        """
+        The get_usage_rollups function sums the usage rollups of a period per bucket of the given granularity.
+
+        Args:
+            self: Access the class attributes
+            api_key:Optional[str]: Only count the queries of this API key, None for every key
+            start:datetime: Start of the period, naive UTC
+            end:datetime: End of the period, excluded, naive UTC
+            granularity:int: Size of the buckets returned, in seconds, a multiple of the rollup bucket
+
+        Returns:
+            A list of bucket start, in ISO 8601, and query count, for the buckets with queries
+        """
+        conditions, parameters = ["bucket_start >= %s", "bucket_start < %s"], [start, end]
+        if api_key is not None:
+            conditions.append("api_key = %s")
+            parameters.append(key_codec.encode(api_key))
+
+        with self._connection() as connection:
+            c = connection.cursor()
+            # Computed from the epoch without UNIX_TIMESTAMP, which depends on the session time zone
+            c.execute(
+                f"""
+                SELECT DATE_FORMAT(
+                        DATE_ADD(
+                            '1970-01-01',
+                            INTERVAL FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01', bucket_start) / %s) * %s SECOND
+                        ),
+                        '%%Y-%%m-%%dT%%H:%%i:%%s'
+                    ) AS bucket,
+                    SUM(count)
+                FROM usage_rollup
+                WHERE {" AND ".join(conditions)}
+                GROUP BY bucket
+                ORDER BY bucket
+                """,
+                (granularity, granularity, *parameters),
+            )
+
+            return [(bucket, int(count)) for bucket, count in c.fetchall()]
+
+    def get_api_keys(self) -> Iterator[str]:
+        """
+        The get_api_keys function yields every API key stored in the database.
+        It is used to build the negative lookup filter at startup, through an unbuffered cursor
+        so the whole key set is never held in memory.
+
+        Args:
+            self: Refer to the object of the class
+
+        Returns:
+            An iterator over the api_key values
+        """
+        with self._connection() as connection:
+            c = connection.cursor(pymysql.cursors.SSCursor)
+            try:
+                c.execute("SELECT api_key FROM user_database")
+                for row in c:
+                    yield key_codec.decode(row[0])
+            finally:
+                # Reads the rows left unread, the connection cannot be reused before
+                c.close()
+
+    def get_revoked_keys(self) -> List[str]:
+        """
+        The get_revoked_keys function returns every revoked API key.
+        It is used to refresh the revoked set of the signed API keys.
+
+        Args:
+            self: Refer to the object of the class
+
+        Returns:
+            A list of api_key values
+        """
+        with self._connection() as connection:
+            c = connection.cursor()
+            c.execute("SELECT api_key FROM user_database WHERE is_active = 0")
+
+            return [key_codec.decode(row[0]) for row in c.fetchall()]
+
+    def set_rate_limit(
+        self, api_key: str, rate: Optional[float], burst: Optional[int]
+    ) -> dict:
+        """
+        The set_rate_limit function sets the rate limit of an API key, overriding FASTAPI_AUTH_RATE_LIMIT.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to limit
+            rate:Optional[float]: Requests per second, 0 for no limit, None for the global rate
+            burst:Optional[int]: Requests allowed at once, None for the global burst
+
+        Returns:
+            The rate limit of the key
+        """
+        with self._connection() as connection:
+            c = connection.cursor()
+            # The affected rows do not count the rows left unchanged, the key is looked up first
+            c.execute(
+                "SELECT 1 FROM user_database WHERE api_key = %s", (key_codec.encode(api_key),)
+            )
+            if not c.fetchone():
+                raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="API key not found")
+
+            c.execute(
+                """
+                UPDATE user_database
+                SET rate_limit = %s, rate_limit_burst = %s
+                WHERE api_key = %s
+                """,
+                (rate, burst, key_codec.encode(api_key)),
+            )
+
+        return {"rate_limit": rate, "rate_limit_burst": burst}
+
+    def get_rate_limits(self) -> Dict[str, Tuple[Optional[float], Optional[int]]]:
+        """
+        The get_rate_limits function returns the API keys that have their own rate limit.
+        It is used to refresh the limits of the rate limiter.
+
+        Args:
+            self: Access the class attributes
+
+        Returns:
+            A dictionary of api_key to rate and burst, None when the global one applies
+        """
+        with self._connection() as connection:
+            c = connection.cursor()
+            c.execute(
+                """SELECT api_key, rate_limit, rate_limit_burst
+                FROM user_database
+                WHERE rate_limit IS NOT NULL OR rate_limit_burst IS NOT NULL"""
+            )
+
+            return {key_codec.decode(row[0]): (row[1], row[2]) for row in c.fetchall()}
+
+    def _sync_rate_counts(self, counts: List[Tuple[int, str]]) -> Dict[str, int]:
+        """
+        The _sync_rate_counts function is called by the rate limiter to share the token buckets between the workers.
+        The requests each worker allowed are added to rate_limit_count, and the counts of the keys are read back.
+
+        Args:
+            self: Access the class attributes
+            counts:List[Tuple[int, str]]: Tuples of allowed requests delta and api_key
+
+        Returns:
+            A dictionary of api_key to rate_limit_count
+        """
+        api_keys = [key_codec.encode(api_key) for _, api_key in counts]
+
+        with self._connection() as connection:
+            c = connection.cursor()
+            connection.begin()
+            c.executemany(
+                "UPDATE user_database SET rate_limit_count = rate_limit_count + %s WHERE api_key = %s",
+                [(delta, key_codec.encode(api_key)) for delta, api_key in counts if delta],
+            )
+            c.execute(
+                f"""SELECT api_key, rate_limit_count
+                FROM user_database
+                WHERE api_key IN ({", ".join(["%s"] * len(api_keys))})""",
+                api_keys,
+            )
+            shared_counts = {key_codec.decode(row[0]): row[1] for row in c.fetchall()}
+            connection.commit()
+
+        return shared_counts
+
     def get_usage_stats(self) -> List[Tuple[str, bool, bool, str, str, int]]:
         """
         The get_usage_stats function returns a list of tuples with values being api_key, is_active, expiration_date, \
@@ -393,23 +929,90 @@ class MySQLAccess:
         Returns:
             A list of tuples with values being api_key, is_active, expiration_date, latest_query_date, and total
         """
-        with pymysql.connect(
-            host="localhost", database="database", user="root", password="linda321"
-        ) as connection:
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        with self._connection() as connection:
             c = connection.cursor()
 
             c.execute(
-                """
-            SELECT api_key, is_active, never_expire, expiration_date, \
-                latest_query_date, total_queries, username, email
+                f"""
+            SELECT {USAGE_COLUMNS}
             FROM user_database
             ORDER BY latest_query_date DESC
             """,
+                (),
             )
 
             response = c.fetchall()
 
-        return response
+        return [key_codec.decode_row(row) for row in response]
+
+    def get_usage_logs(self, query: UsageQuery) -> List[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The get_usage_logs function returns a page of the usage stats, filtered and paginated in SQL.
+        The rows are sorted by latest query date then api_key, most recent first, and the never used keys come last.
+
+        Args:
+            self: Access variables that belong to the class
+            query:UsageQuery: The filters, page size and cursor
+
+        Returns:
+            A list of tuples like get_usage_stats
+        """
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        filters, filter_parameters = sql_filter_conditions(
+            query, "%s", "username", "UTC_TIMESTAMP()"
+        )
+
+        with self._connection() as connection:
+            c = connection.cursor()
+
+            def fetch(used, after_date, after_key, limit):
+                conditions, parameters = sql_page_conditions(
+                    used,
+                    None if after_date is None else datetime.fromisoformat(after_date),
+                    None if after_key is None else key_codec.encode(after_key),
+                    "%s",
+                )
+                c.execute(
+                    f"""
+            SELECT {USAGE_COLUMNS}
+            FROM user_database
+            WHERE {" AND ".join(conditions + filters)}
+            ORDER BY latest_query_date DESC, api_key DESC
+            LIMIT %s""",
+                    (*parameters, *filter_parameters, limit),
+                )
+                return [key_codec.decode_row(row) for row in c.fetchall()]
+
+            return fetch_usage_page(fetch, query)
+
+    def iter_usage_stats(self) -> Iterator[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The iter_usage_stats function yields the usage stats of every API key, like get_usage_stats, through an unbuffered cursor
+        so the whole table is never held in memory. The pool connection is held until the iterator is exhausted or closed.
+
+        Args:
+            self: Refer to the object of the class
+
+        Returns:
+            An iterator over tuples like get_usage_stats, in no particular order
+        """
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        with self._connection() as connection:
+            c = connection.cursor(pymysql.cursors.SSCursor)
+            try:
+                c.execute(f"SELECT {USAGE_COLUMNS} FROM user_database", ())
+                for row in c:
+                    yield key_codec.decode_row(row)
+            finally:
+                # Reads the rows left unread, the connection cannot be reused before
+                c.close()
 
 
 mysql_access = MySQLAccess()
@@ -0,0 +1,88 @@
+"""bcrypt hashing on a dedicated thread pool.
+
+bcrypt releases the GIL while hashing, so a few threads hash in parallel without a process pool,
+and the bounded pool keeps key creation bursts from using up the threadpool serving the other endpoints.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+
+class PasswordHasher:
+    """Hashes passwords with a configurable bcrypt work factor, on a size-limited pool of threads"""
+
+    def __init__(self, rounds: Optional[int] = None, max_workers: Optional[int] = None):
+        self.rounds = (
+            int(os.getenv("FASTAPI_AUTH_BCRYPT_ROUNDS", "12"))
+            if rounds is None
+            else rounds
+        )
+        self.max_workers = (
+            int(os.getenv("FASTAPI_AUTH_HASH_WORKERS", "0"))
+            if max_workers is None
+            else max_workers
+        ) or min(4, os.cpu_count() or 1)
+
+        # Fails early on a work factor bcrypt does not support
+        bcrypt.gensalt(self.rounds)
+
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, password: str) -> str:
+        """
+        The hash function salts and hashes a password with bcrypt, in the calling thread.
+
+        Args:
+            self: Access the class attributes
+            password:str: The password to hash
+
+        Returns:
+            The bcrypt hash
+        """
+        salt = bcrypt.gensalt(self.rounds)
+        return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+
+    async def hash_async(self, password: str) -> str:
+        """
+        The hash_async function hashes a password on the hashing pool, without blocking the event loop.
+        When every worker is busy, the password waits for a free worker.
+
+        Args:
+            self: Access the class attributes
+            password:str: The password to hash
+
+        Returns:
+            The bcrypt hash
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), self.hash, password
+        )
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="fastapi_auth_bcrypt",
+                    )
+
+        return self._executor
+
+    def shutdown(self):
+        """
+        Stops the hashing threads. They are restarted by the next hash_async call.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher()
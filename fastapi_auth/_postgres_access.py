@@ -3,12 +3,12 @@ Postgres Database Connection Class. This class should be used in production. Set
 """
 
 import os
-import threading
 import uuid
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import psycopg2 as pg
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from fastapi import HTTPException
 from starlette.status import (
@@ -17,6 +17,27 @@ from starlette.status import (
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
 
+from fastapi_auth._bulk_provisioning import NewUser, create_keys_in_batches, existing_users
+from fastapi_auth._bulk_updates import (
+    KeySelection,
+    check_selection,
+    invalidate_selection,
+    sql_selection_conditions,
+    to_utc,
+)
+from fastapi_auth._connection_pool import ConnectionPool
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._key_events import key_events
+from fastapi_auth._key_filter import key_filter
+from fastapi_auth._key_storage import key_codec
+from fastapi_auth._usage_logs import (
+    UsageQuery,
+    fetch_usage_page,
+    sql_filter_conditions,
+    sql_page_conditions,
+)
+from fastapi_auth._usage_recorder import UsageRecorder
+
 load_dotenv()
 try:
     if (
@@ -31,36 +52,82 @@ try:
 except KeyError as e:
     POSTGRES_URI = None
 
+# Columns of get_usage_stats and get_usage_logs, with the dates formatted as ISO 8601
+USAGE_COLUMNS = """api_key, is_active, never_expire, \
+                    to_char(expiration_date, 'YYYY-MM-DD"T"HH24:MI:SS'), \
+                    to_char(latest_query_date, 'YYYY-MM-DD"T"HH24:MI:SS'), \
+                    total_queries, username, email"""
+
+# The validity predicate is evaluated in SQL, the row of a key tells why it is denied, NULL if it is valid
+CHECK_KEY_QUERY = """
+                SELECT expiration_date, never_expire,
+                    CASE
+                        WHEN is_active = 0 THEN 'revoked'
+                        WHEN never_expire = 0 AND expiration_date < now() AT TIME ZONE 'UTC' THEN 'expired'
+                    END
+                FROM user_database
+                WHERE api_key = %s"""
+
+INSERT_KEYS_QUERY = """
+                INSERT INTO user_database
+                (api_key, is_active, never_expire, expiration_date, \
+                    latest_query_date, total_queries, username, email, password)
+                VALUES %s"""
+
 
 class PostgresAccess:
     """Class handling Remote Postgres connection and writes. Change POSTGRES_URI, if migrating database to a new location."""
 
     def __init__(self):
+        # Connections are shared by every method and thread through the pool
+        self.pool = ConnectionPool(
+            connect=self.connect,
+            check=self._check_connection,
+            reset=lambda connection: connection.rollback(),
+        )
+
         try:
             # Connect to an existing database
-            connection = pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
-
-            # Create a cursor to perform database operations
-            cursor = connection.cursor()
-            # Print PostgreSQL details
-            print("PostgreSQL server information")
-            print(connection.get_dsn_parameters(), "\n")
-            # Executing a SQL query
-            cursor.execute("SELECT version();")
-            # Fetch result
-            record = cursor.fetchone()
-            print("You are connected to - ", record, "\n")
+            with self.pool.connection() as connection:
+                # Create a cursor to perform database operations
+                cursor = connection.cursor()
+                # Print PostgreSQL details
+                print("PostgreSQL server information")
+                print(connection.get_dsn_parameters(), "\n")
+                # Executing a SQL query
+                cursor.execute("SELECT version();")
+                # Fetch result
+                record = cursor.fetchone()
+                print("You are connected to - ", record, "\n")
 
         except (Exception, pg.OperationalError) as error:
             print("Error while connecting to PostgreSQL:", error)
 
         try:
             self.expiration_limit = int(os.getenv("FASTAPI_AUTH_AUTOMATIC_EXPIRATION"))
-        except KeyError:
+        except (KeyError, TypeError):
             self.expiration_limit = 15
 
+        self.usage_recorder = UsageRecorder(
+            self._update_usage, flush_rollups=self._update_usage_rollups
+        )
+
         self.init_db()
 
+    @staticmethod
+    def connect():
+        """
+        Opens a new connection to POSTGRES_URI, for the pool and the key events listener
+        """
+        return pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
+
+    @staticmethod
+    def _check_connection(connection):
+        # Health check of connections that stayed idle in the pool
+        with connection.cursor() as c:
+            c.execute("SELECT 1")
+        connection.rollback()
+
     def init_db(self):
         """
         The init_db function creates a new database if one does not exist.
@@ -73,38 +140,171 @@ class PostgresAccess:
             The connection to the database
         """
         try:
-            connection = pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
-            c = connection.cursor()
-            # Create database
-            c.execute(
+            with self.pool.connection() as connection:
+                c = connection.cursor()
+                # Create database
+                c.execute(
+                    f"""
+                CREATE TABLE IF NOT EXISTS user_database (
+                    api_key {"BYTEA" if key_codec.binary else "TEXT"} PRIMARY KEY,
+                    is_active INTEGER,
+                    never_expire INTEGER,
+                    expiration_date TIMESTAMP,
+                    latest_query_date TIMESTAMP,
+                    total_queries INTEGER)
+                """
+                )
+                # Query count of each API key per rollup bucket, written once the bucket ended
+                c.execute(
+                    f"""
+                CREATE TABLE IF NOT EXISTS usage_rollup (
+                    api_key {"BYTEA" if key_codec.binary else "TEXT"} NOT NULL,
+                    bucket_start TIMESTAMP NOT NULL,
+                    count BIGINT NOT NULL,
+                    PRIMARY KEY (api_key, bucket_start))
                 """
-            CREATE TABLE IF NOT EXISTS user_database (
-                api_key TEXT PRIMARY KEY,
-                is_active INTEGER,
-                never_expire INTEGER,
-                expiration_date TEXT,
-                latest_query_date TEXT,
-                total_queries INTEGER)
+                )
+                connection.commit()
+                # Migration: Add api key username
+                try:
+                    c.execute(
+                        "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS username TEXT"
+                    )
+                    c.execute(
+                        "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS email TEXT"
+                    )
+                    c.execute(
+                        "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS password TEXT"
+                    )
+                    # Migration: Add per-key rate limits
+                    c.execute(
+                        "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS rate_limit DOUBLE PRECISION"
+                    )
+                    c.execute(
+                        "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS rate_limit_burst INTEGER"
+                    )
+                    c.execute(
+                        "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS rate_limit_count BIGINT NOT NULL DEFAULT 0"
+                    )
+                    connection.commit()
+                except pg.OperationalError as e:
+                    pass
+
+                self._migrate_dates(connection)
+                if key_codec.binary:
+                    self._migrate_keys(connection)
+                self._create_indexes(connection)
+        except pg.OperationalError as e:
+            print(e)
+            # pass  # Column already exist
+
+    def _migrate_dates(self, connection):
+        """
+        The _migrate_dates function converts the expiration_date and latest_query_date columns of older databases
+        from ISO 8601 TEXT to TIMESTAMP, in place. The check_key index including them is recreated by _create_indexes.
+
+        Args:
+            self: Access variables that belong to the class
+            connection: The connection running init_db
+
+        Returns:
+            Nothing
+        """
+        c = connection.cursor()
+        c.execute(
             """
+            SELECT data_type
+            FROM information_schema.columns
+            WHERE table_name = 'user_database' AND column_name = 'expiration_date'"""
+        )
+        if c.fetchone()[0] != "text":
+            return
+
+        c.execute("DROP INDEX IF EXISTS user_database_check_key_idx")
+        c.execute(
+            """
+            ALTER TABLE user_database
+            ALTER COLUMN expiration_date TYPE TIMESTAMP USING NULLIF(expiration_date, '')::timestamp,
+            ALTER COLUMN latest_query_date TYPE TIMESTAMP USING NULLIF(latest_query_date, '')::timestamp"""
+        )
+        connection.commit()
+
+    def _migrate_keys(self, connection):
+        """
+        The _migrate_keys function packs the API keys stored as text into their 16 bytes, in place,
+        in the key table and the usage rollups. Each table and its indexes are rewritten by a single ALTER TABLE.
+
+        Args:
+            self: Access variables that belong to the class
+            connection: The connection running init_db
+
+        Returns:
+            Nothing
+        """
+        c = connection.cursor()
+        for table in ("user_database", "usage_rollup"):
+            c.execute(
+                """
+                SELECT data_type
+                FROM information_schema.columns
+                WHERE table_name = %s AND column_name = 'api_key'""",
+                (table,),
+            )
+            if c.fetchone()[0] != "text":
+                continue
+
+            c.execute(
+                f"""
+                ALTER TABLE {table}
+                ALTER COLUMN api_key TYPE BYTEA USING decode(replace(api_key, '-', ''), 'hex')"""
             )
             connection.commit()
-            # Migration: Add api key username
+
+    def _create_indexes(self, connection):
+        """
+        The _create_indexes function creates the indexes serving the duplicate user check of create_key,
+        the ORDER BY of get_usage_stats and the check_key lookup. The check_key index carries the validated
+        columns so the lookup can be answered by an index-only scan.
+        A unique index cannot be built over existing duplicate users, a plain index is created instead.
+
+        Args:
+            self: Access variables that belong to the class
+            connection: The connection running init_db
+
+        Returns:
+            Nothing
+        """
+        c = connection.cursor()
+        for column in ("username", "email"):
             try:
                 c.execute(
-                    "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS username TEXT"
-                )
-                c.execute(
-                    "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS email TEXT"
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS user_database_{column}_key ON user_database ({column})"
                 )
+                connection.commit()
+            except pg.IntegrityError:
+                connection.rollback()
+                print(f"Duplicate {column} values found, {column} is indexed without a unique constraint")
                 c.execute(
-                    "ALTER TABLE user_database ADD COLUMN IF NOT EXISTS password TEXT"
+                    f"CREATE INDEX IF NOT EXISTS user_database_{column}_idx ON user_database ({column})"
                 )
                 connection.commit()
-            except pg.OperationalError as e:
-                pass
-        except pg.OperationalError as e:
-            print(e)
-            # pass  # Column already exist
+
+        # Serves the ORDER BY and the keyset of the usage logs pages
+        c.execute("DROP INDEX IF EXISTS user_database_latest_query_date_idx")
+        c.execute(
+            """CREATE INDEX IF NOT EXISTS user_database_latest_query_date_api_key_idx
+            ON user_database (latest_query_date, api_key)"""
+        )
+        c.execute(
+            """CREATE INDEX IF NOT EXISTS user_database_check_key_idx
+            ON user_database (api_key)
+            INCLUDE (is_active, never_expire, expiration_date)"""
+        )
+        # Serves the usage rollups of every key, the primary key serves the ones of a single key
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS usage_rollup_bucket_start_idx ON usage_rollup (bucket_start)"
+        )
+        connection.commit()
 
     def create_key(self, username, email, password, never_expire) -> dict:
         """
@@ -125,46 +325,114 @@ class PostgresAccess:
         """
         api_key = str(uuid.uuid4())
 
-        connection = pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
-        c = connection.cursor()
-        c.execute(
-            """SELECT username, email
-                   FROM user_database
-                   WHERE username=%s OR email=%s""",
-            (username, email),
-        )
-        result = c.fetchone()
-        if result:
-            raise HTTPException(
-                status_code=HTTP_403_FORBIDDEN,
-                detail="This user already exists in the database. Please choose another userusername or password.",
-            )
-        else:
+        with self.pool.connection() as connection:
+            c = connection.cursor()
             c.execute(
-                """
-                    INSERT INTO user_database
-                    (api_key, is_active, never_expire, expiration_date, \
-                        latest_query_date, total_queries, username, email, password)
-                    VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    api_key,
-                    1,
-                    1 if never_expire else 0,
-                    (
-                        datetime.utcnow() + timedelta(days=self.expiration_limit)
-                    ).isoformat(timespec="seconds"),
-                    None,
-                    0,
-                    username,
-                    email,
-                    password,
-                ),
+                """SELECT username, email
+                       FROM user_database
+                       WHERE username=%s OR email=%s""",
+                (username, email),
             )
-            connection.commit()
+            result = c.fetchone()
+            if result:
+                raise HTTPException(
+                    status_code=HTTP_403_FORBIDDEN,
+                    detail="This user already exists in the database. Please choose another userusername or password.",
+                )
+            else:
+                c.execute(
+                    """
+                        INSERT INTO user_database
+                        (api_key, is_active, never_expire, expiration_date, \
+                            latest_query_date, total_queries, username, email, password)
+                        VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (
+                        key_codec.encode(api_key),
+                        1,
+                        1 if never_expire else 0,
+                        datetime.utcnow().replace(microsecond=0)
+                        + timedelta(days=self.expiration_limit),
+                        None,
+                        0,
+                        username,
+                        email,
+                        password,
+                    ),
+                )
+                key_events.notify(c, "create", [api_key])
+                connection.commit()
 
+        key_filter.add(api_key)
         return {"api-key": api_key}
 
+    def create_keys(self, users: List[NewUser]) -> List[dict]:
+        """
+        The create_keys function creates an API key for each user, like create_key, in batches.
+        Each batch runs one duplicate user query and one multi-row INSERT in a single transaction.
+
+        Args:
+            self: Access variables that belongs to the class
+            users:List[NewUser]: Tuples of username, email, hashed password and never_expire
+
+        Returns:
+            One dictionary per user, in order, with either the api-key created or the error
+        """
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+
+            def find_existing(usernames, emails):
+                c.execute(
+                    """SELECT username, email
+                       FROM user_database
+                       WHERE username = ANY(%s) OR email = ANY(%s)""",
+                    (usernames, emails),
+                )
+                existing = c.fetchall()
+                connection.commit()
+                return existing_users(existing)
+
+            def insert(rows):
+                try:
+                    execute_values(c, INSERT_KEYS_QUERY, rows, page_size=len(rows))
+                    key_events.notify(c, "create", [key_codec.decode(row[0]) for row in rows])
+                    connection.commit()
+                    return set()
+                except pg.IntegrityError:
+                    connection.rollback()
+
+                # A user was created concurrently, the rows are inserted one by one in one transaction.
+                # A failed statement aborts a Postgres transaction, so each row runs in a savepoint
+                rejected = set()
+                for position, row in enumerate(rows):
+                    c.execute("SAVEPOINT create_key")
+                    try:
+                        execute_values(c, INSERT_KEYS_QUERY, [row])
+                    except pg.IntegrityError:
+                        c.execute("ROLLBACK TO SAVEPOINT create_key")
+                        rejected.add(position)
+                    else:
+                        c.execute("RELEASE SAVEPOINT create_key")
+                key_events.notify(
+                    c,
+                    "create",
+                    [
+                        key_codec.decode(row[0])
+                        for position, row in enumerate(rows)
+                        if position not in rejected
+                    ],
+                )
+                connection.commit()
+                return rejected
+
+            return create_keys_in_batches(
+                users,
+                datetime.utcnow().replace(microsecond=0)
+                + timedelta(days=self.expiration_limit),
+                find_existing,
+                insert,
+            )
+
     def renew_key(self, api_key: str, new_expiration_date: str) -> Optional[str]:
         """
         The renew_key function takes an API key and a new expiration date.
@@ -181,64 +449,73 @@ class PostgresAccess:
             A string
 
         """
-        connection = pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
-        c = connection.cursor()
+        with self.pool.connection() as connection:
+            c = connection.cursor()
 
-        # We run the query like check_key but will use the response differently
-        c.execute(
-            """
-            SELECT is_active, total_queries, expiration_date, never_expire
-            FROM user_database
-            WHERE api_key = %s""",
-            (api_key,),
-        )
+            c.execute(
+                """
+                SELECT is_active
+                FROM user_database
+                WHERE api_key = %s""",
+                (key_codec.encode(api_key),),
+            )
 
-        response = c.fetchone()
+            response = c.fetchone()
 
-        # API key not found
-        if not response:
-            raise HTTPException(
-                status_code=HTTP_404_NOT_FOUND, detail="API key not found"
-            )
+            # API key not found
+            if not response:
+                raise HTTPException(
+                    status_code=HTTP_404_NOT_FOUND, detail="API key not found"
+                )
 
-        response_lines = []
+            response_lines = []
 
-        # Previously revoked key. Issue a text warning and reactivate it.
-        if response[0] == 0:
-            response_lines.append("This API key was revoked and has been reactivated.")
+            # Previously revoked key. Issue a text warning and reactivate it.
+            if response[0] == 0:
+                response_lines.append(
+                    "This API key was revoked and has been reactivated."
+                )
 
             # Without an expiration date, we set it here
-        if not new_expiration_date:
-            parsed_expiration_date = (
-                datetime.utcnow() + timedelta(days=self.expiration_limit)
-            ).isoformat(timespec="seconds")
+            if not new_expiration_date:
+                expiration_date = datetime.utcnow() + timedelta(
+                    days=self.expiration_limit
+                )
 
-        else:
-            try:
-                # We parse and re-write to the right timespec
-                parsed_expiration_date = datetime.fromisoformat(
-                    new_expiration_date
-                ).isoformat(timespec="seconds")
-            except ValueError as exc:
-                raise HTTPException(
-                    status_code=HTTP_422_UNPROCESSABLE_ENTITY,
-                    detail="The expiration date could not be parsed. \
-                            Please use ISO 8601.",
-                ) from exc
+            else:
+                try:
+                    expiration_date = datetime.fromisoformat(new_expiration_date)
+                except ValueError as exc:
+                    raise HTTPException(
+                        status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+                        detail="The expiration date could not be parsed. \
+                                Please use ISO 8601.",
+                    ) from exc
 
-        c.execute(
-            """
-            UPDATE user_database
-            SET expiration_date = %s, is_active = 1
-            WHERE api_key = %s
-            """,
-            (
-                parsed_expiration_date,
-                api_key,
-            ),
-        )
+            # Dates are stored in UTC, at the right timespec
+            if expiration_date.tzinfo is not None:
+                expiration_date = expiration_date.astimezone(timezone.utc).replace(
+                    tzinfo=None
+                )
+            expiration_date = expiration_date.replace(microsecond=0)
+            parsed_expiration_date = expiration_date.isoformat()
 
-        connection.commit()
+            c.execute(
+                """
+                UPDATE user_database
+                SET expiration_date = %s, is_active = 1
+                WHERE api_key = %s
+                """,
+                (
+                    expiration_date,
+                    key_codec.encode(api_key),
+                ),
+            )
+            key_events.notify(c, "renew", [api_key])
+
+            connection.commit()
+
+        key_cache.invalidate(api_key)
 
         response_lines.append(
             f"The new expiration date for the API key is {parsed_expiration_date}"
@@ -258,94 +535,405 @@ class PostgresAccess:
             None
 
         """
-        connection = pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
-        c = connection.cursor()
+        with self.pool.connection() as connection:
+            c = connection.cursor()
 
-        c.execute(
-            """
+            c.execute(
+                """
+                UPDATE user_database
+                SET is_active = 0
+                WHERE api_key = %s
+                """,
+                (key_codec.encode(api_key),),
+            )
+            key_events.notify(c, "revoke", [api_key])
+
+            connection.commit()
+
+        key_cache.invalidate(api_key)
+
+    def revoke_keys(self, selection: KeySelection) -> dict:
+        """
+        The revoke_keys function revokes every API key of the selection with a single UPDATE.
+
+        Args:
+            self: Access the class attributes and methods
+            selection:KeySelection: The API keys, or the filters, of the keys to revoke
+
+        Returns:
+            The number of API keys revoked, keys already revoked are not counted
+        """
+        conditions, parameters = self._selection_conditions(selection)
+
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+
+            c.execute(
+                f"""
             UPDATE user_database
             SET is_active = 0
-            WHERE api_key = %s
+            WHERE is_active = 1 AND {" AND ".join(conditions)}
             """,
-            (api_key,),
+                parameters,
+            )
+            revoked = c.rowcount
+            key_events.notify(c, "revoke", selection.api_keys)
+
+            connection.commit()
+
+        invalidate_selection(selection)
+        return {"revoked": revoked}
+
+    def renew_keys(
+        self, selection: KeySelection, expiration_date: Optional[datetime] = None
+    ) -> dict:
+        """
+        The renew_keys function sets a new expiration date on every API key of the selection with a single UPDATE,
+        reactivating the revoked ones.
+
+        Args:
+            self: Access the class attributes and methods
+            selection:KeySelection: The API keys, or the filters, of the keys to renew
+            expiration_date:Optional[datetime]: The new expiration date, FASTAPI_AUTH_AUTOMATIC_EXPIRATION days from now by default
+
+        Returns:
+            The number of API keys renewed and their new expiration date
+        """
+        conditions, parameters = self._selection_conditions(selection)
+        expiration_date = to_utc(
+            expiration_date or datetime.utcnow() + timedelta(days=self.expiration_limit)
         )
 
-        connection.commit()
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+
+            c.execute(
+                f"""
+            UPDATE user_database
+            SET expiration_date = %s, is_active = 1
+            WHERE {" AND ".join(conditions)}
+            """,
+                (expiration_date, *parameters),
+            )
+            renewed = c.rowcount
+            key_events.notify(c, "renew", selection.api_keys)
+
+            connection.commit()
+
+        invalidate_selection(selection)
+        return {"renewed": renewed, "expiration_date": expiration_date.isoformat()}
+
+    def _selection_conditions(self, selection: KeySelection) -> Tuple[List[str], list]:
+        check_selection(selection)
+        conditions, parameters = sql_selection_conditions(
+            selection, "%s", "username", lambda date: date
+        )
+        if selection.api_keys is not None:
+            # The keys are passed as a single array parameter, whatever their number
+            conditions.insert(0, "api_key = ANY(%s)")
+            parameters.insert(0, [key_codec.encode(api_key) for api_key in selection.api_keys])
+        return conditions, parameters
 
     def check_key(self, api_key: str) -> bool:
         """
         The check_key function checks if the API key is valid.
         It returns True if it is, False otherwise.
 
-
         Args:
             self: Access the class attributes
-            api_key:str: Fetch the api_key from the database
+            api_key:str: The API key to validate
 
         Returns:
             True if the api key is valid, false otherwise
         """
-        connection = pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
-        c = connection.cursor()
+        return self.check_key_status(api_key) is None
 
-        c.execute(
-            """
-            SELECT is_active, total_queries, expiration_date, never_expire
-            FROM user_database
-            WHERE api_key = %s""",
-            (api_key,),
+    def check_key_status(self, api_key: str) -> Optional[str]:
+        """
+        The check_key_status function validates an API key like check_key, and tells why it is not valid.
+        The reason comes from the same single row lookup, so the denial counters of the metrics cost no extra query.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+
+            c.execute(CHECK_KEY_QUERY, (key_codec.encode(api_key),))
+
+            response = c.fetchone()
+
+        return self._check_status(api_key, response)
+
+    def _check_status(self, api_key: str, response: Optional[tuple]) -> Optional[str]:
+        """
+        The _check_status function decides if an API key is valid from the row fetched by check_key_status.
+        Valid keys are cached and their usage recorded. It is shared with the native async drivers.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key that was looked up
+            response:Optional[tuple]: The expiration_date, never_expire and denial reason row, or None if the key is missing
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        if not response:
+            return "unknown"
+
+        expiration_date, never_expire, reason = response
+        if reason is not None:
+            return reason
+
+        # The key is valid
+        key_cache.add(
+            api_key,
+            None if never_expire else expiration_date.replace(tzinfo=timezone.utc).timestamp(),
         )
 
-        response = c.fetchone()
-
-        if (
-            # Cannot fetch a row
-            not response
-            # Inactive
-            or response[0] != 1
-            # Expired key
-            or (
-                (not response[3])
-                and (datetime.fromisoformat(response[2]) < datetime.utcnow())
+        # Usage is aggregated in memory and written in bulk by a background thread
+        self.usage_recorder.record(api_key)
+
+        return None
+
+    def _update_usage(self, usage: List[Tuple[int, int, str]]):
+        """
+        The _update_usage function is called by the usage recorder with every usage delta aggregated since its last flush.
+        All the keys are updated with a single UPDATE ... FROM (VALUES ...) statement.
+
+        Args:
+            self: Access the class attributes
+            usage:List[Tuple[int, int, str]]: Tuples of query count delta, latest query epoch and api_key
+
+        Returns:
+            Nothing
+        """
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+
+            execute_values(
+                c,
+                """
+                UPDATE user_database
+                SET total_queries = user_database.total_queries + usage.delta,
+                    latest_query_date = to_timestamp(usage.latest_query_date) AT TIME ZONE 'UTC'
+                FROM (VALUES %s) AS usage (delta, latest_query_date, api_key)
+                WHERE user_database.api_key = usage.api_key
+                """,
+                [(delta, last_seen, key_codec.encode(api_key)) for delta, last_seen, api_key in usage],
+                page_size=1000,
+            )
+
+            connection.commit()
+
+    def _update_usage_rollups(self, rollups: List[Tuple[int, int, str]]):
+        """
+        The _update_usage_rollups function is called by the usage recorder with the query counts of the rollup buckets that ended.
+        Each row is added to the count of its bucket, which other workers may have written too, with a single INSERT ... ON CONFLICT.
+
+        Args:
+            self: Access the class attributes
+            rollups:List[Tuple[int, int, str]]: Tuples of query count, bucket start epoch and api_key
+
+        Returns:
+            Nothing
+        """
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+
+            execute_values(
+                c,
+                """
+                INSERT INTO usage_rollup (api_key, bucket_start, count)
+                VALUES %s
+                ON CONFLICT (api_key, bucket_start)
+                DO UPDATE SET count = usage_rollup.count + EXCLUDED.count
+                """,
+                [(key_codec.encode(api_key), bucket_start, count) for count, bucket_start, api_key in rollups],
+                template="(%s, to_timestamp(%s) AT TIME ZONE 'UTC', %s)",
+                page_size=1000,
             )
-        ):
-            # The key is not valid
-            return False
-        else:
-            # The key is valid
-
-            # We run the logging in a separate thread as writing takes some time
-            threading.Thread(
-                target=self._update_usage,
-                args=(
-                    api_key,
-                    response[1],
-                ),
-            ).start()
 
-            # We return directly
-            return True
+            connection.commit()
 
-    def _update_usage(self, api_key: str, usage_count: int):
-        connection = pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
-        c = connection.cursor()
+    def get_usage_rollups(
+        self, api_key: Optional[str], start: datetime, end: datetime, granularity: int
+    ) -> List[Tuple[str, int]]:
+        """
+        The get_usage_rollups function sums the usage rollups of a period per bucket of the given granularity.
 
-        # If we get there, this means it’s an active API key that’s in the database.\
-        #   We update the table.
-        c.execute(
-            """
-            UPDATE user_database
-            SET total_queries = %s, latest_query_date = %s
-            WHERE api_key = %s
-            """,
-            (
-                usage_count + 1,
-                datetime.utcnow().isoformat(timespec="seconds"),
-                api_key,
-            ),
-        )
+        Args:
+            self: Access the class attributes
+            api_key:Optional[str]: Only count the queries of this API key, None for every key
+            start:datetime: Start of the period, naive UTC
+            end:datetime: End of the period, excluded, naive UTC
+            granularity:int: Size of the buckets returned, in seconds, a multiple of the rollup bucket
 
-        connection.commit()
+        Returns:
+            A list of bucket start, in ISO 8601, and query count, for the buckets with queries
+        """
+        conditions, parameters = ["bucket_start >= %s", "bucket_start < %s"], [start, end]
+        if api_key is not None:
+            conditions.append("api_key = %s")
+            parameters.append(key_codec.encode(api_key))
+
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+            c.execute(
+                f"""
+                SELECT to_char(
+                        to_timestamp(floor(extract(epoch FROM bucket_start) / %s) * %s) AT TIME ZONE 'UTC',
+                        'YYYY-MM-DD"T"HH24:MI:SS'
+                    ) AS bucket,
+                    SUM(count)
+                FROM usage_rollup
+                WHERE {" AND ".join(conditions)}
+                GROUP BY bucket
+                ORDER BY bucket
+                """,
+                (granularity, granularity, *parameters),
+            )
+            rollups = [(bucket, int(count)) for bucket, count in c.fetchall()]
+            connection.commit()
+
+        return rollups
+
+    def get_api_keys(self) -> Iterator[str]:
+        """
+        The get_api_keys function yields every API key stored in the database.
+        It is used to build the negative lookup filter at startup, through a server-side cursor
+        so the whole key set is never held in memory.
+
+        Args:
+            self: Refer to the object of the class
+
+        Returns:
+            An iterator over the api_key values
+        """
+        with self.pool.connection() as connection:
+            c = connection.cursor(name="fastapi_auth_api_keys")
+            c.itersize = 10000
+
+            c.execute("SELECT api_key FROM user_database")
+            for row in c:
+                yield key_codec.decode(row[0])
+
+            connection.commit()
+
+    def get_revoked_keys(self) -> List[str]:
+        """
+        The get_revoked_keys function returns every revoked API key.
+        It is used to refresh the revoked set of the signed API keys.
+
+        Args:
+            self: Refer to the object of the class
+
+        Returns:
+            A list of api_key values
+        """
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+            c.execute("SELECT api_key FROM user_database WHERE is_active = 0")
+            revoked = [key_codec.decode(row[0]) for row in c.fetchall()]
+            connection.commit()
+
+        return revoked
+
+    def set_rate_limit(
+        self, api_key: str, rate: Optional[float], burst: Optional[int]
+    ) -> dict:
+        """
+        The set_rate_limit function sets the rate limit of an API key, overriding FASTAPI_AUTH_RATE_LIMIT.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to limit
+            rate:Optional[float]: Requests per second, 0 for no limit, None for the global rate
+            burst:Optional[int]: Requests allowed at once, None for the global burst
+
+        Returns:
+            The rate limit of the key
+        """
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+            c.execute(
+                """
+                UPDATE user_database
+                SET rate_limit = %s, rate_limit_burst = %s
+                WHERE api_key = %s
+                """,
+                (rate, burst, key_codec.encode(api_key)),
+            )
+            updated = c.rowcount
+            connection.commit()
+
+        if not updated:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="API key not found")
+
+        return {"rate_limit": rate, "rate_limit_burst": burst}
+
+    def get_rate_limits(self) -> Dict[str, Tuple[Optional[float], Optional[int]]]:
+        """
+        The get_rate_limits function returns the API keys that have their own rate limit.
+        It is used to refresh the limits of the rate limiter.
+
+        Args:
+            self: Access the class attributes
+
+        Returns:
+            A dictionary of api_key to rate and burst, None when the global one applies
+        """
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+            c.execute(
+                """SELECT api_key, rate_limit, rate_limit_burst
+                FROM user_database
+                WHERE rate_limit IS NOT NULL OR rate_limit_burst IS NOT NULL"""
+            )
+            rate_limits = {key_codec.decode(row[0]): (row[1], row[2]) for row in c.fetchall()}
+            connection.commit()
+
+        return rate_limits
+
+    def _sync_rate_counts(self, counts: List[Tuple[int, str]]) -> Dict[str, int]:
+        """
+        The _sync_rate_counts function is called by the rate limiter to share the token buckets between the workers.
+        The requests each worker allowed are added to rate_limit_count, and the counts of the keys are read back.
+
+        Args:
+            self: Access the class attributes
+            counts:List[Tuple[int, str]]: Tuples of allowed requests delta and api_key
+
+        Returns:
+            A dictionary of api_key to rate_limit_count
+        """
+        deltas = [(delta, key_codec.encode(api_key)) for delta, api_key in counts if delta]
+
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+            if deltas:
+                execute_values(
+                    c,
+                    """
+                    UPDATE user_database
+                    SET rate_limit_count = user_database.rate_limit_count + deltas.delta
+                    FROM (VALUES %s) AS deltas (delta, api_key)
+                    WHERE user_database.api_key = deltas.api_key""",
+                    deltas,
+                    page_size=len(deltas),
+                )
+            c.execute(
+                "SELECT api_key, rate_limit_count FROM user_database WHERE api_key = ANY(%s)",
+                ([key_codec.encode(api_key) for _, api_key in counts],),
+            )
+            shared_counts = {key_codec.decode(row[0]): row[1] for row in c.fetchall()}
+            connection.commit()
+
+        return shared_counts
 
     def get_usage_stats(self) -> List[Tuple[str, bool, bool, str, str, int]]:
         """
@@ -358,20 +946,88 @@ class PostgresAccess:
         Returns:
             A list of tuples with values being api_key, is_active, expiration_date, latest_query_date, and total
         """
-        connection = pg.connect(POSTGRES_URI, sslmode=POSTGRES_SSL)
-        c = connection.cursor()
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
 
-        c.execute(
-            """
-            SELECT api_key, is_active, never_expire, expiration_date, \
-                latest_query_date, total_queries, username, email
-            FROM user_database
-            ORDER BY latest_query_date DESC
-            """,
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+
+            c.execute(
+                f"""
+                SELECT {USAGE_COLUMNS}
+                FROM user_database
+                ORDER BY latest_query_date DESC
+                """,
+            )
+            response = c.fetchall()
+
+        return [key_codec.decode_row(row) for row in response]
+
+    def get_usage_logs(self, query: UsageQuery) -> List[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The get_usage_logs function returns a page of the usage stats, filtered and paginated in SQL.
+        The rows are sorted by latest query date then api_key, most recent first, and the never used keys come last.
+
+        Args:
+            self: Access variables that belong to the class
+            query:UsageQuery: The filters, page size and cursor
+
+        Returns:
+            A list of tuples like get_usage_stats
+        """
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        filters, filter_parameters = sql_filter_conditions(
+            query, "%s", "username", "now() AT TIME ZONE 'UTC'"
         )
-        response = c.fetchall()
 
-        return response
+        with self.pool.connection() as connection:
+            c = connection.cursor()
+
+            def fetch(used, after_date, after_key, limit):
+                conditions, parameters = sql_page_conditions(
+                    used,
+                    None if after_date is None else datetime.fromisoformat(after_date),
+                    None if after_key is None else key_codec.encode(after_key),
+                    "%s",
+                )
+                c.execute(
+                    f"""
+                SELECT {USAGE_COLUMNS}
+                FROM user_database
+                WHERE {" AND ".join(conditions + filters)}
+                ORDER BY latest_query_date DESC, api_key DESC
+                LIMIT %s""",
+                    (*parameters, *filter_parameters, limit),
+                )
+                return [key_codec.decode_row(row) for row in c.fetchall()]
+
+            return fetch_usage_page(fetch, query)
+
+    def iter_usage_stats(self) -> Iterator[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The iter_usage_stats function yields the usage stats of every API key, like get_usage_stats, through a server-side cursor
+        so the whole table is never held in memory. The pool connection is held until the iterator is exhausted or closed.
+
+        Args:
+            self: Refer to the object of the class
+
+        Returns:
+            An iterator over tuples like get_usage_stats, in no particular order
+        """
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        with self.pool.connection() as connection:
+            c = connection.cursor(name="fastapi_auth_usage_export")
+            c.itersize = 10000
+
+            c.execute(f"SELECT {USAGE_COLUMNS} FROM user_database")
+            for row in c:
+                yield key_codec.decode_row(row)
+
+            connection.commit()
 
 
 postgres_access = PostgresAccess()
@@ -0,0 +1,212 @@
+"""Per API key rate limiting with in-memory token buckets.
+
+Each API key has a bucket of ``burst`` tokens refilled at ``rate`` tokens per second, and every request
+takes one token. The limits are FASTAPI_AUTH_RATE_LIMIT and FASTAPI_AUTH_RATE_LIMIT_BURST, unless the key
+has its own in the rate_limit and rate_limit_burst columns of the key table.
+
+Buckets are local to the worker. With FASTAPI_AUTH_RATE_LIMIT_SHARED=true, each worker adds the requests it
+allowed to the rate_limit_count column of the keys every FASTAPI_AUTH_RATE_LIMIT_SYNC seconds, and takes
+the requests allowed by the other workers since the previous sync out of its own buckets.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# rate, burst of a key, None for the global limit
+RateLimit = Tuple[Optional[float], Optional[int]]
+
+
+class RateLimiter:
+    """Token bucket of each API key, with the limits of the keys that override the global one"""
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        shared: Optional[bool] = None,
+    ):
+        # Rate limiting is enabled once FASTAPI_AUTH_RATE_LIMIT is set, 0 only limits the keys with their own limit
+        self.enabled = rate is not None or os.getenv("FASTAPI_AUTH_RATE_LIMIT") is not None
+        self.rate = (
+            float(os.getenv("FASTAPI_AUTH_RATE_LIMIT") or "0") if rate is None else rate
+        )
+        if burst is None and os.getenv("FASTAPI_AUTH_RATE_LIMIT_BURST"):
+            burst = float(os.getenv("FASTAPI_AUTH_RATE_LIMIT_BURST"))
+        self.burst = burst
+        self.shared = (
+            os.getenv("FASTAPI_AUTH_RATE_LIMIT_SHARED", "false").lower() in ("1", "true")
+            if shared is None
+            else shared
+        )
+        self.sync_interval = float(os.getenv("FASTAPI_AUTH_RATE_LIMIT_SYNC", "1"))
+        self.refresh_interval = float(os.getenv("FASTAPI_AUTH_RATE_LIMIT_REFRESH", "60"))
+
+        self.limited = 0
+        self._overrides: Dict[str, RateLimit] = {}
+        # api_key -> [tokens, last update on the monotonic clock, rate, burst], least recently used first
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        # Requests allowed since the last sync, and rate_limit_count read then, of the shared buckets
+        self._allowed: Dict[str, int] = {}
+        self._shared_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def limits(self, api_key: str) -> Tuple[float, float]:
+        """
+        The limits function returns the rate and the burst applying to an API key.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key, as stored in the database
+
+        Returns:
+            The rate in requests per second, 0 for no limit, and the burst
+        """
+        rate, burst = self._overrides.get(api_key, (None, None))
+        if rate is None:
+            rate = self.rate
+        if burst is None:
+            burst = self.burst if self.burst is not None else max(1.0, rate)
+
+        return rate, max(1.0, burst)
+
+    def acquire(self, api_key: str) -> float:
+        """
+        The acquire function takes a token from the bucket of an API key, in constant time.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key, as stored in the database
+
+        Returns:
+            0 if the request is allowed, otherwise the number of seconds until the next token
+        """
+        if not self.enabled:
+            return 0.0
+
+        rate, burst = self.limits(api_key)
+        if rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(api_key)
+            if bucket is None:
+                bucket = self._buckets[api_key] = [burst, now, rate, burst]
+                self._evict(now)
+            else:
+                self._buckets.move_to_end(api_key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1:] = [now, rate, burst]
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                if self.shared:
+                    self._allowed[api_key] = self._allowed.get(api_key, 0) + 1
+                return 0.0
+
+            self.limited += 1
+            return (1 - bucket[0]) / rate
+
+    def _evict(self, now: float):
+        # A bucket that refilled behaves like a new one, the idle ones are dropped, oldest first
+        while len(self._buckets) > 1:
+            api_key, (tokens, updated, rate, burst) = next(iter(self._buckets.items()))
+            if tokens + (now - updated) * rate < burst:
+                break
+            del self._buckets[api_key]
+            self._shared_counts.pop(api_key, None)
+
+    def set_override(self, api_key: str, rate: Optional[float], burst: Optional[int]):
+        """
+        Applies the limits of a key changed through this worker, without waiting for the next refresh
+        """
+        with self._lock:
+            if rate is None and burst is None:
+                self._overrides.pop(api_key, None)
+            else:
+                self._overrides[api_key] = (rate, burst)
+
+    def load(self, overrides: Dict[str, RateLimit]):
+        """
+        Replaces the limits of the keys that override the global one by the ones read from the database
+        """
+        self._overrides = dict(overrides)
+
+    def sync(self, sync_counts: Callable[[List[Tuple[int, str]]], Dict[str, int]]):
+        """
+        The sync function shares the buckets with the other workers through the database.
+        The requests allowed by this worker are added to the rate_limit_count of the keys, and the requests
+        the other workers allowed since the previous sync are taken out of the buckets.
+
+        Args:
+            self: Access the class attributes
+            sync_counts:Callable[[List[Tuple[int, str]]], Dict[str, int]]: Backend method adding the deltas
+                of each api_key to rate_limit_count, and returning the new counts
+        """
+        with self._lock:
+            allowed, self._allowed = self._allowed, {}
+            api_keys = list(self._buckets)
+
+        if not api_keys:
+            return
+
+        counts = sync_counts([(allowed.get(api_key, 0), api_key) for api_key in api_keys])
+
+        with self._lock:
+            for api_key, count in counts.items():
+                previous = self._shared_counts.get(api_key)
+                bucket = self._buckets.get(api_key)
+                if bucket is None:
+                    continue
+                self._shared_counts[api_key] = count
+                if previous is not None:
+                    # Tokens may go negative, the key then waits for the other workers' share to refill
+                    bucket[0] -= max(0, count - previous - allowed.get(api_key, 0))
+
+    def start(
+        self,
+        get_rate_limits: Callable[[], Dict[str, RateLimit]],
+        sync_counts: Callable[[List[Tuple[int, str]]], Dict[str, int]],
+    ):
+        """
+        The start function loads the limits of the keys, and starts a background thread reloading them every
+        FASTAPI_AUTH_RATE_LIMIT_REFRESH seconds and, if the buckets are shared, syncing them every FASTAPI_AUTH_RATE_LIMIT_SYNC seconds.
+
+        Args:
+            self: Access the class attributes
+            get_rate_limits:Callable[[], Dict[str, RateLimit]]: Backend method returning the keys with their own limits
+            sync_counts:Callable[[List[Tuple[int, str]]], Dict[str, int]]: Backend method syncing rate_limit_count
+        """
+        if not self.enabled:
+            return
+
+        try:
+            self.load(get_rate_limits())
+        except Exception as e:
+            print("Error while loading the API key rate limits:", e)
+
+        if self._thread is None and (self.shared or self.refresh_interval > 0):
+            self._thread = threading.Thread(
+                target=self._run, args=(get_rate_limits, sync_counts), daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, get_rate_limits, sync_counts):
+        interval = self.sync_interval if self.shared else self.refresh_interval
+        next_refresh = time.monotonic() + self.refresh_interval
+        while True:
+            time.sleep(interval)
+            try:
+                if self.shared:
+                    self.sync(sync_counts)
+                if self.refresh_interval > 0 and time.monotonic() >= next_refresh:
+                    next_refresh = time.monotonic() + self.refresh_interval
+                    self.load(get_rate_limits())
+            except Exception as e:
+                print("Error while syncing the API key rate limits:", e)
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,226 @@
+"""Stateless signed API keys.
+
+With FASTAPI_AUTH_SIGNED_KEYS=true, the API keys given to the users embed the id of the key stored in the
+database and its expiration epoch, signed with FASTAPI_AUTH_SECRET:
+
+    <key id>.<expiration epoch, 0 if it never expires>.<HMAC-SHA256, base64url>
+
+``api_key_security`` checks the signature and the expiration date on the CPU, then only looks the key id up
+in an in-memory set of revoked keys, refreshed from the database periodically.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from typing import Callable, FrozenSet, Iterable, Optional, Tuple
+
+from fastapi_auth._security_secret import secret
+
+SEPARATOR = "."
+
+
+class SignedKeys:
+    """Issues and verifies signed API keys, and keeps the set of revoked key ids"""
+
+    def __init__(self, enabled: Optional[bool] = None, refresh_interval: Optional[float] = None):
+        self.enabled = (
+            os.getenv("FASTAPI_AUTH_SIGNED_KEYS", "false").lower() in ("1", "true")
+            if enabled is None
+            else enabled
+        )
+        self.refresh_interval = (
+            float(os.getenv("FASTAPI_AUTH_SIGNED_KEYS_REFRESH", "60"))
+            if refresh_interval is None
+            else refresh_interval
+        )
+
+        self._mac = None
+        self._revoked: FrozenSet[str] = frozenset()
+        self._lock = threading.Lock()
+        # Revocations and renewals made by this worker while the set is being reloaded
+        self._changed_during_load = None
+        self._refresh_thread = None
+
+    def _signature(self, payload: str) -> str:
+        if self._mac is None:
+            # The key schedule is computed once, each signature starts from a copy of it
+            self._mac = hmac.new(secret.value.encode("utf-8"), digestmod=hashlib.sha256)
+
+        mac = self._mac.copy()
+        mac.update(payload.encode("utf-8"))
+
+        return base64.urlsafe_b64encode(mac.digest()).rstrip(b"=").decode("ascii")
+
+    def sign(self, key_id: str, expires_at: Optional[int]) -> str:
+        """
+        The sign function builds the signed API key given to the user for a key stored in the database.
+
+        Args:
+            self: Access the class attributes
+            key_id:str: The api_key value stored in the database
+            expires_at:Optional[int]: UTC epoch of the expiration date, None for keys that never expire
+
+        Returns:
+            The signed API key
+        """
+        payload = f"{key_id}{SEPARATOR}{expires_at or 0}"
+
+        return f"{payload}{SEPARATOR}{self._signature(payload)}"
+
+    def issue(self, response: dict, never_expire: bool, expires_at: int) -> dict:
+        """
+        The issue function replaces the api-key of a create_key response by its signed form, if signed keys are enabled.
+        Responses without an api-key, the errors of create_keys, are returned unchanged.
+
+        Args:
+            self: Access the class attributes
+            response:dict: The dictionary returned by the backend for the key
+            never_expire:bool: Whether the key never expires
+            expires_at:int: UTC epoch taken before the key was created, plus the expiration limit
+
+        Returns:
+            The response with the API key to give to the user
+        """
+        if not self.enabled or "api-key" not in response:
+            return response
+
+        return {
+            **response,
+            "api-key": self.sign(response["api-key"], None if never_expire else expires_at),
+        }
+
+    @staticmethod
+    def is_signed(api_key: str) -> bool:
+        return api_key.count(SEPARATOR) == 2
+
+    def key_id(self, api_key: str) -> str:
+        """
+        The key_id function returns the id stored in the database of an API key given by a user,
+        so the administration endpoints accept both forms. The signature is not checked.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: A signed API key, or the stored key itself
+
+        Returns:
+            The api_key value stored in the database
+        """
+        if self.enabled and self.is_signed(api_key):
+            return api_key.split(SEPARATOR, 1)[0]
+
+        return api_key
+
+    def verify(self, api_key: str) -> Optional[Tuple[str, int]]:
+        """
+        The verify function checks the signature of a signed API key.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The signed API key
+
+        Returns:
+            The key id and the expiration epoch, 0 if the key never expires, or None if the key was not signed by this server
+        """
+        payload, _, signature = api_key.rpartition(SEPARATOR)
+        if not hmac.compare_digest(signature.encode("utf-8"), self._signature(payload).encode("ascii")):
+            return None
+
+        key_id, _, expires_at = payload.partition(SEPARATOR)
+        try:
+            return key_id, int(expires_at)
+        except ValueError:
+            return None
+
+    def is_revoked(self, key_id: str) -> bool:
+        return key_id in self._revoked
+
+    def revoke(self, *key_ids: str):
+        """
+        Adds keys revoked through this worker to the revoked set, without waiting for the next refresh
+        """
+        self._change(key_ids, True)
+
+    def reinstate(self, *key_ids: str):
+        """
+        Removes keys renewed through this worker from the revoked set, without waiting for the next refresh
+        """
+        self._change(key_ids, False)
+
+    def _change(self, key_ids: Tuple[str, ...], revoked: bool):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if self._changed_during_load is not None:
+                self._changed_during_load.append((key_ids, revoked))
+
+            # The set is replaced, never updated in place, so it is read without the lock
+            if revoked:
+                self._revoked = self._revoked.union(key_ids)
+            else:
+                self._revoked = self._revoked.difference(key_ids)
+
+    def load(self, revoked_keys: Iterable[str]):
+        """
+        The load function replaces the set of revoked key ids by the one read from the database.
+        Revocations and renewals made by this worker during the query are applied on top of it.
+
+        Args:
+            self: Access the class attributes
+            revoked_keys:Iterable[str]: The api_key values of every revoked key
+        """
+        with self._lock:
+            self._changed_during_load = []
+
+        try:
+            revoked = set(revoked_keys)
+        except Exception:
+            with self._lock:
+                self._changed_during_load = None
+            raise
+
+        with self._lock:
+            for key_ids, is_revoked in self._changed_during_load:
+                if is_revoked:
+                    revoked.update(key_ids)
+                else:
+                    revoked.difference_update(key_ids)
+            self._changed_during_load = None
+
+            self._revoked = frozenset(revoked)
+
+    def start(self, get_revoked_keys: Callable[[], Iterable[str]]):
+        """
+        The start function loads the revoked key ids and reloads them every FASTAPI_AUTH_SIGNED_KEYS_REFRESH seconds
+        in a background thread, so keys revoked through other workers are rejected.
+
+        Args:
+            self: Access the class attributes
+            get_revoked_keys:Callable[[], Iterable[str]]: Backend method returning the api_key of every revoked key
+        """
+        if not self.enabled:
+            return
+
+        try:
+            self.load(get_revoked_keys())
+        except Exception as e:
+            print("Error while loading the revoked API keys:", e)
+
+        if self.refresh_interval > 0 and self._refresh_thread is None:
+            self._refresh_thread = threading.Thread(
+                target=self._refresh, args=(get_revoked_keys,), daemon=True
+            )
+            self._refresh_thread.start()
+
+    def _refresh(self, get_revoked_keys: Callable[[], Iterable[str]]):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.load(get_revoked_keys())
+            except Exception as e:
+                print("Error while refreshing the revoked API keys:", e)
+
+
+signed_keys = SignedKeys()
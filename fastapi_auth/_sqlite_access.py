@@ -4,9 +4,11 @@ Sqlite3 Database Connection Class. This class should be used in development. Set
 import os
 import sqlite3
 import threading
+import time
 import uuid
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.request import pathname2url
 
 from fastapi import HTTPException
 from starlette.status import (
@@ -15,6 +17,66 @@ from starlette.status import (
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
 
+from fastapi_auth._bulk_provisioning import NewUser, create_keys_in_batches, existing_users
+from fastapi_auth._bulk_updates import (
+    KeySelection,
+    check_selection,
+    invalidate_selection,
+    sql_selection_conditions,
+    to_utc,
+)
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._key_filter import key_filter
+from fastapi_auth._key_storage import key_codec
+from fastapi_auth._usage_logs import (
+    UsageQuery,
+    fetch_usage_page,
+    sql_filter_conditions,
+    sql_page_conditions,
+)
+from fastapi_auth._usage_recorder import UsageRecorder
+
+# Columns of get_usage_stats and get_usage_logs, with the dates formatted as ISO 8601
+USAGE_COLUMNS = """api_key, is_active, never_expire, \
+                strftime('%Y-%m-%dT%H:%M:%S', expiration_date, 'unixepoch'), \
+                strftime('%Y-%m-%dT%H:%M:%S', latest_query_date, 'unixepoch'), \
+                total_queries, name, email"""
+
+# Dates are stored as integer UTC epochs, so the validity predicate is evaluated in SQL,
+# and the row of a key tells why it is denied, NULL if it is valid.
+# SQLite always prefers the primary key index for an equality lookup, the covering index is requested explicitly
+CHECK_KEY_QUERY = """
+            SELECT expiration_date, never_expire,
+                CASE
+                    WHEN is_active = 0 THEN 'revoked'
+                    WHEN never_expire = 0 AND expiration_date < ? THEN 'expired'
+                END
+            FROM FASTAPI_AUTH INDEXED BY ix_fastapi_auth_check_key
+            WHERE api_key = ?"""
+
+INSERT_KEY_QUERY = """
+                    INSERT INTO FASTAPI_AUTH
+                    (api_key, is_active, never_expire, expiration_date, \
+                        latest_query_date, total_queries, name, email, password)
+                    VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """
+
+
+def to_epoch(date: datetime) -> int:
+    """
+    The to_epoch function converts a datetime to an integer UTC epoch. Naive datetimes are taken as UTC.
+
+    Args:
+        date:datetime: The datetime to convert
+
+    Returns:
+        The number of seconds since the epoch
+    """
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return int(date.timestamp())
+
 
 class SQLiteAccess:
     """Class handling SQLite connection and writes"""
@@ -22,18 +84,73 @@ class SQLiteAccess:
     # TODO This should not be a class, a fully functional approach is better
 
     def __init__(self):
-        try:
-            self.db_location = os.getenv("FASTAPI_AUTH_DB_LOCATION")
-        except (KeyError, TypeError):
-            self.db_location = "sqlite.db"
+        self.db_location = os.getenv("FASTAPI_AUTH_DB_LOCATION") or "sqlite.db"
 
         try:
             self.expiration_limit = int(os.getenv("FASTAPI_AUTH_AUTOMATIC_EXPIRATION"))
-        except KeyError:
+        except (KeyError, TypeError):
             self.expiration_limit = 15
 
+        # Page cache size in KiB and memory-mapped I/O size in bytes, per connection
+        self.cache_size = int(os.getenv("FASTAPI_AUTH_SQLITE_CACHE_SIZE", "8192"))
+        self.mmap_size = int(os.getenv("FASTAPI_AUTH_SQLITE_MMAP_SIZE", "268435456"))
+
+        # Every thread keeps its own connection open, see _connection
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._generation = 0
+
+        self.usage_recorder = UsageRecorder(
+            self._update_usage, flush_rollups=self._update_usage_rollups
+        )
+
         self.init_db()
 
+    def _connection(self) -> sqlite3.Connection:
+        """
+        The _connection function returns the persistent connection of the calling thread, opening it on first use.
+        Connections run in WAL mode so check_key readers and the usage writer do not block each other,
+        and keep their prepared statements cached between calls.
+
+        Args:
+            self: Access variables that belongs to the class
+
+        Returns:
+            A sqlite3 connection, usable as a transaction context manager
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.generation == self._generation:
+            return connection
+
+        connection = sqlite3.connect(
+            self.db_location, check_same_thread=False, cached_statements=256
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        connection.execute(f"PRAGMA cache_size=-{self.cache_size}")
+        connection.execute(f"PRAGMA mmap_size={self.mmap_size}")
+
+        with self._connections_lock:
+            self._connections.append(connection)
+        self._local.connection = connection
+        self._local.generation = self._generation
+
+        return connection
+
+    def close(self):
+        """
+        Closes the connections of every thread. They are reopened on the next query.
+        It must not be called while queries are running, e.g. before removing the database file.
+        """
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+
+        for connection in connections:
+            connection.close()
+
     def init_db(self):
         """
         The init_db function creates a new database file if one does not already exist.
@@ -45,18 +162,28 @@ class SQLiteAccess:
         Returns:
             Nothing
         """
-        with sqlite3.connect(self.db_location) as connection:
+        with self._connection() as connection:
             c = connection.cursor()
             # Create database
             c.execute(
-                """
+                f"""
         CREATE TABLE IF NOT EXISTS FASTAPI_AUTH (
-            api_key TEXT PRIMARY KEY,
+            api_key {"BLOB" if key_codec.binary else "TEXT"} PRIMARY KEY,
             is_active INTEGER,
             never_expire INTEGER,
-            expiration_date TEXT,
-            latest_query_date TEXT,
+            expiration_date INTEGER,
+            latest_query_date INTEGER,
             total_queries INTEGER)
+        """
+            )
+            # Query count of each API key per rollup bucket, written once the bucket ended
+            c.execute(
+                f"""
+        CREATE TABLE IF NOT EXISTS FASTAPI_AUTH_USAGE (
+            api_key {"BLOB" if key_codec.binary else "TEXT"} NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (api_key, bucket_start)) WITHOUT ROWID
         """
             )
             connection.commit()
@@ -68,6 +195,141 @@ class SQLiteAccess:
                 connection.commit()
             except sqlite3.OperationalError:
                 pass  # Column already exist
+            # Migration: Add per-key rate limits
+            try:
+                c.execute("ALTER TABLE FASTAPI_AUTH ADD COLUMN rate_limit REAL")
+                c.execute("ALTER TABLE FASTAPI_AUTH ADD COLUMN rate_limit_burst INTEGER")
+                c.execute(
+                    "ALTER TABLE FASTAPI_AUTH ADD COLUMN rate_limit_count INTEGER NOT NULL DEFAULT 0"
+                )
+                connection.commit()
+            except sqlite3.OperationalError:
+                pass  # Column already exist
+
+            # Migration: ISO 8601 TEXT dates to integer epochs
+            column_types = {
+                row[1]: row[2] for row in c.execute("PRAGMA table_info(FASTAPI_AUTH)")
+            }
+            if column_types["expiration_date"] == "TEXT":
+                self._migrate_dates(c)
+                connection.commit()
+
+            # Migration: API keys stored as text to their 16 bytes
+            if key_codec.binary:
+                self._migrate_keys(c)
+                connection.commit()
+
+            self._create_indexes(c)
+
+    def _migrate_dates(self, c):
+        """
+        The _migrate_dates function converts the expiration_date and latest_query_date TEXT columns to integer epochs.
+        SQLite cannot change the type of a column, so the table is rebuilt in a single transaction and its indexes are recreated by init_db.
+
+        Args:
+            self: Access variables that belongs to the class
+            c: A cursor of the connection running init_db
+
+        Returns:
+            Nothing
+        """
+        # Every column is copied, with its constraints, so the columns added by the other migrations survive
+        definitions, values = [], []
+        for _, name, column_type, not_null, default, primary_key in c.execute(
+            "PRAGMA table_info(FASTAPI_AUTH)"
+        ).fetchall():
+            if name in ("expiration_date", "latest_query_date"):
+                definitions.append(f"{name} INTEGER")
+                values.append(f"CAST(strftime('%s', {name}) AS INTEGER)")
+                continue
+
+            definition = f"{name} {column_type}"
+            if primary_key:
+                definition += " PRIMARY KEY"
+            if not_null:
+                definition += " NOT NULL"
+            if default is not None:
+                definition += f" DEFAULT {default}"
+            definitions.append(definition)
+            values.append(name)
+
+        c.execute("BEGIN")
+        c.execute(f"CREATE TABLE FASTAPI_AUTH_MIGRATION ({', '.join(definitions)})")
+        c.execute(
+            f"INSERT INTO FASTAPI_AUTH_MIGRATION SELECT {', '.join(values)} FROM FASTAPI_AUTH"
+        )
+        c.execute("DROP TABLE FASTAPI_AUTH")
+        c.execute("ALTER TABLE FASTAPI_AUTH_MIGRATION RENAME TO FASTAPI_AUTH")
+
+    def _migrate_keys(self, c):
+        """
+        The _migrate_keys function packs the API keys stored as text into their 16 bytes, in a single transaction,
+        in the key table and the usage rollups. SQLite stores a BLOB as is in a TEXT column, so the tables do not need to be rebuilt.
+
+        Args:
+            self: Access variables that belongs to the class
+            c: A cursor of the connection running init_db
+
+        Returns:
+            Nothing
+        """
+        c.execute("BEGIN")
+        for table in ("FASTAPI_AUTH", "FASTAPI_AUTH_USAGE"):
+            api_keys = [
+                row[0]
+                for row in c.execute(
+                    f"SELECT DISTINCT api_key FROM {table} WHERE typeof(api_key) = 'text'"
+                )
+            ]
+            # Keys that are not UUIDs cannot be packed, nor validated in this format, they are left as they are
+            c.executemany(
+                f"UPDATE {table} SET api_key = ? WHERE api_key = ?",
+                [
+                    (key_codec.encode(api_key), api_key)
+                    for api_key in api_keys
+                    if key_codec.encode(api_key) is not None
+                ],
+            )
+
+    def _create_indexes(self, c):
+        """
+        The _create_indexes function creates the indexes serving the duplicate user check of create_key,
+        the ORDER BY of get_usage_stats and the check_key lookup, which the covering index answers without reading the table.
+        A unique index cannot be built over existing duplicate users, a plain index is created instead.
+
+        Args:
+            self: Access variables that belongs to the class
+            c: A cursor of the connection running init_db
+
+        Returns:
+            Nothing
+        """
+        for column in ("name", "email"):
+            try:
+                c.execute(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS ix_fastapi_auth_{column} ON FASTAPI_AUTH ({column})"
+                )
+            except sqlite3.IntegrityError:
+                print(f"Duplicate {column} values found, {column} is indexed without a unique constraint")
+                c.execute(
+                    f"CREATE INDEX IF NOT EXISTS ix_fastapi_auth_{column}_non_unique ON FASTAPI_AUTH ({column})"
+                )
+
+        # Serves the ORDER BY and the keyset of the usage logs pages
+        c.execute("DROP INDEX IF EXISTS ix_fastapi_auth_latest_query_date")
+        c.execute(
+            """CREATE INDEX IF NOT EXISTS ix_fastapi_auth_latest_query_date_api_key
+            ON FASTAPI_AUTH (latest_query_date, api_key)"""
+        )
+        c.execute(
+            """CREATE INDEX IF NOT EXISTS ix_fastapi_auth_check_key
+            ON FASTAPI_AUTH (api_key, is_active, never_expire, expiration_date)"""
+        )
+        # Serves the usage rollups of every key, the primary key serves the ones of a single key
+        c.execute(
+            """CREATE INDEX IF NOT EXISTS ix_fastapi_auth_usage_bucket_start
+            ON FASTAPI_AUTH_USAGE (bucket_start)"""
+        )
 
     def create_key(self, name, email, password, never_expire) -> str:
         """
@@ -85,7 +347,7 @@ class SQLiteAccess:
         """
         api_key = str(uuid.uuid4())
 
-        with sqlite3.connect(self.db_location) as connection:
+        with self._connection() as connection:
             c = connection.cursor()
             c.execute(
                 """SELECT name, email
@@ -95,7 +357,6 @@ class SQLiteAccess:
                 (name, email),
             )
             result = c.fetchone()
-            print(result)
             if result:
                 raise HTTPException(
                     status_code=HTTP_403_FORBIDDEN,
@@ -103,19 +364,12 @@ class SQLiteAccess:
                 )
             else:
                 c.execute(
-                    """
-                    INSERT INTO FASTAPI_AUTH
-                    (api_key, is_active, never_expire, expiration_date, \
-                        latest_query_date, total_queries, name, email, password)
-                    VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
+                    INSERT_KEY_QUERY,
                     (
-                        api_key,
+                        key_codec.encode(api_key),
                         1,
                         1 if never_expire else 0,
-                        (
-                            datetime.utcnow() + timedelta(days=self.expiration_limit)
-                        ).isoformat(timespec="seconds"),
+                        int(time.time()) + self.expiration_limit * 86400,
                         None,
                         0,
                         name,
@@ -125,8 +379,58 @@ class SQLiteAccess:
                 )
                 connection.commit()
 
+        key_filter.add(api_key)
         return {"api-key": api_key}
 
+    def create_keys(self, users: List[NewUser]) -> List[dict]:
+        """
+        The create_keys function creates an API key for each user, like create_key, in batches.
+        Each batch runs one duplicate user query and one executemany insert in a single transaction.
+
+        Args:
+            self: Access attributes of the class
+            users:List[NewUser]: Tuples of name, email, hashed password and never_expire
+
+        Returns:
+            One dictionary per user, in order, with either the api-key created or the error
+        """
+        with self._connection() as connection:
+
+            def find_existing(names, emails):
+                existing = connection.execute(
+                    f"""SELECT name, email
+                          FROM FASTAPI_AUTH
+                          WHERE name IN ({", ".join("?" * len(names))})
+                              OR email IN ({", ".join("?" * len(emails))})""",
+                    (*names, *emails),
+                ).fetchall()
+                return existing_users(existing)
+
+            def insert(rows):
+                try:
+                    with connection:
+                        connection.executemany(INSERT_KEY_QUERY, rows)
+                    return set()
+                except sqlite3.IntegrityError:
+                    pass
+
+                # A user was created concurrently, the rows are inserted one by one in one transaction
+                rejected = set()
+                with connection:
+                    for position, row in enumerate(rows):
+                        try:
+                            connection.execute(INSERT_KEY_QUERY, row)
+                        except sqlite3.IntegrityError:
+                            rejected.add(position)
+                return rejected
+
+            return create_keys_in_batches(
+                users,
+                int(time.time()) + self.expiration_limit * 86400,
+                find_existing,
+                insert,
+            )
+
     def renew_key(self, api_key: str, new_expiration_date: str) -> Optional[str]:
         """
         The renew_key function takes an API key and a new expiration date.
@@ -143,16 +447,15 @@ class SQLiteAccess:
         Returns:
             A string with a message about the api key's new expiration date
         """
-        with sqlite3.connect(self.db_location) as connection:
+        with self._connection() as connection:
             c = connection.cursor()
 
-            # We run the query like check_key but will use the response differently
             c.execute(
                 """
-            SELECT is_active, total_queries, expiration_date, never_expire
+            SELECT is_active
             FROM FASTAPI_AUTH
             WHERE api_key = ?""",
-                (api_key,),
+                (key_codec.encode(api_key),),
             )
 
             response = c.fetchone()
@@ -173,16 +476,13 @@ class SQLiteAccess:
 
             # Without an expiration date, we set it here
             if not new_expiration_date:
-                parsed_expiration_date = (
-                    datetime.utcnow() + timedelta(days=self.expiration_limit)
-                ).isoformat(timespec="seconds")
+                expiration_date = datetime.utcnow() + timedelta(
+                    days=self.expiration_limit
+                )
 
             else:
                 try:
-                    # We parse and re-write to the right timespec
-                    parsed_expiration_date = datetime.fromisoformat(
-                        new_expiration_date
-                    ).isoformat(timespec="seconds")
+                    expiration_date = datetime.fromisoformat(new_expiration_date)
                 except ValueError as exc:
                     raise HTTPException(
                         status_code=HTTP_422_UNPROCESSABLE_ENTITY,
@@ -190,6 +490,9 @@ class SQLiteAccess:
                             Please use ISO 8601.",
                     ) from exc
 
+            # We re-write to the right timespec
+            parsed_expiration_date = expiration_date.isoformat(timespec="seconds")
+
             c.execute(
                 """
             UPDATE FASTAPI_AUTH
@@ -197,12 +500,13 @@ class SQLiteAccess:
             WHERE api_key = ?
             """,
                 (
-                    parsed_expiration_date,
-                    api_key,
+                    to_epoch(expiration_date),
+                    key_codec.encode(api_key),
                 ),
             )
 
             connection.commit()
+            key_cache.invalidate(api_key)
 
             response_lines.append(
                 f"The new expiration date for the API key is {parsed_expiration_date}"
@@ -217,7 +521,7 @@ class SQLiteAccess:
         Args:
             api_key: the API key to revoke
         """
-        with sqlite3.connect(self.db_location) as connection:
+        with self._connection() as connection:
             c = connection.cursor()
 
             c.execute(
@@ -226,10 +530,79 @@ class SQLiteAccess:
             SET is_active = 0
             WHERE api_key = ?
             """,
-                (api_key,),
+                (key_codec.encode(api_key),),
             )
 
             connection.commit()
+            key_cache.invalidate(api_key)
+
+    def revoke_keys(self, selection: KeySelection) -> dict:
+        """
+        The revoke_keys function revokes every API key of the selection with a single UPDATE.
+
+        Args:
+            self: Access the class attributes
+            selection:KeySelection: The API keys, or the filters, of the keys to revoke
+
+        Returns:
+            The number of API keys revoked, keys already revoked are not counted
+        """
+        conditions, parameters = self._selection_conditions(selection)
+
+        with self._connection() as connection:
+            revoked = connection.execute(
+                f"""
+            UPDATE FASTAPI_AUTH
+            SET is_active = 0
+            WHERE is_active = 1 AND {" AND ".join(conditions)}
+            """,
+                parameters,
+            ).rowcount
+
+        invalidate_selection(selection)
+        return {"revoked": revoked}
+
+    def renew_keys(
+        self, selection: KeySelection, expiration_date: Optional[datetime] = None
+    ) -> dict:
+        """
+        The renew_keys function sets a new expiration date on every API key of the selection with a single UPDATE,
+        reactivating the revoked ones.
+
+        Args:
+            self: Access the class attributes
+            selection:KeySelection: The API keys, or the filters, of the keys to renew
+            expiration_date:Optional[datetime]: The new expiration date, FASTAPI_AUTH_AUTOMATIC_EXPIRATION days from now by default
+
+        Returns:
+            The number of API keys renewed and their new expiration date
+        """
+        conditions, parameters = self._selection_conditions(selection)
+        expiration_date = to_utc(
+            expiration_date or datetime.utcnow() + timedelta(days=self.expiration_limit)
+        )
+
+        with self._connection() as connection:
+            renewed = connection.execute(
+                f"""
+            UPDATE FASTAPI_AUTH
+            SET expiration_date = ?, is_active = 1
+            WHERE {" AND ".join(conditions)}
+            """,
+                (to_epoch(expiration_date), *parameters),
+            ).rowcount
+
+        invalidate_selection(selection)
+        return {"renewed": renewed, "expiration_date": expiration_date.isoformat()}
+
+    def _selection_conditions(self, selection: KeySelection) -> Tuple[List[str], list]:
+        check_selection(selection)
+        conditions, parameters = sql_selection_conditions(selection, "?", "name", to_epoch)
+        if selection.api_keys is not None:
+            conditions.insert(0, f"api_key IN ({', '.join('?' * len(selection.api_keys))})")
+            parameters[:0] = [key_codec.encode(api_key) for api_key in selection.api_keys]
+
+        return conditions, parameters
 
     def check_key(self, api_key: str) -> bool:
         """
@@ -238,82 +611,258 @@ class SQLiteAccess:
         Args:
              api_key: the API key to validate
         """
+        return self.check_key_status(api_key) is None
 
-        with sqlite3.connect(self.db_location) as connection:
+    def check_key_status(self, api_key: str) -> Optional[str]:
+        """
+        The check_key_status function validates an API key like check_key, and tells why it is not valid.
+        The reason comes from the same single row lookup, so the denial counters of the metrics cost no extra query.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to validate
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        with self._connection() as connection:
             c = connection.cursor()
 
-            c.execute(
-                """
-            SELECT is_active, total_queries, expiration_date, never_expire
-            FROM FASTAPI_AUTH
-            WHERE api_key = ?""",
-                (api_key,),
-            )
+            c.execute(CHECK_KEY_QUERY, (int(time.time()), key_codec.encode(api_key)))
 
             response = c.fetchone()
 
-            if (
-                # Cannot fetch a row
-                not response
-                # Inactive
-                or response[0] != 1
-                # Expired key
-                or (
-                    (not response[3])
-                    and (datetime.fromisoformat(response[2]) < datetime.utcnow())
-                )
-            ):
-                # The key is not valid
-                return False
-            else:
-                # The key is valid
-
-                # We run the logging in a separate thread as writing takes some time
-                threading.Thread(
-                    target=self._update_usage,
-                    args=(
-                        api_key,
-                        response[1],
-                    ),
-                ).start()
+        return self._check_status(api_key, response)
+
+    def _check_status(self, api_key: str, response: Optional[tuple]) -> Optional[str]:
+        """
+        The _check_status function decides if an API key is valid from the row fetched by check_key_status.
+        Valid keys are cached and their usage recorded. It is shared with the native async drivers.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key that was looked up
+            response:Optional[tuple]: The expiration_date, never_expire and denial reason row, or None if the key is missing
+
+        Returns:
+            None if the api key is valid, otherwise unknown, revoked or expired
+        """
+        if not response:
+            return "unknown"
+
+        expiration_date, never_expire, reason = response
+        if reason is not None:
+            return reason
 
-                # We return directly
-                return True
+        # The key is valid
+        key_cache.add(api_key, None if never_expire else expiration_date)
 
-    def _update_usage(self, api_key: str, usage_count: int):
+        # Usage is aggregated in memory and written in bulk by a background thread
+        self.usage_recorder.record(api_key)
+
+        return None
+
+    def _update_usage(self, usage: List[Tuple[int, int, str]]):
         """
-        The _update_usage function is called by the @use_api_key decorator.
-        It takes an API key and a usage count as arguments, and updates the database to reflect that.
-        The usage count is passed in from the @use_api_key decorator, which increments it every time it’s called.
+        The _update_usage function is called by the usage recorder with every usage delta aggregated since its last flush.
+        All the keys are updated with a single executemany in one transaction.
 
         Args:
             self: Access the class attributes
-            api_key:str: Identify the row in the database
-            usage_count:int: Increment the usage count of the api key
+            usage:List[Tuple[int, int, str]]: Tuples of query count delta, latest query epoch and api_key
 
         Returns:
-            The number of queries that were performed
+            Nothing
         """
-        with sqlite3.connect(self.db_location) as connection:
+        with self._connection() as connection:
             c = connection.cursor()
 
-            # If we get there, this means it’s an active API key that’s in the database.\
-            #   We update the table.
-            c.execute(
+            c.executemany(
                 """
             UPDATE FASTAPI_AUTH
-            SET total_queries = ?, latest_query_date = ?
+            SET total_queries = total_queries + ?, latest_query_date = ?
             WHERE api_key = ?
             """,
-                (
-                    usage_count + 1,
-                    datetime.utcnow().isoformat(timespec="seconds"),
-                    api_key,
-                ),
+                [(delta, last_seen, key_codec.encode(api_key)) for delta, last_seen, api_key in usage],
             )
 
             connection.commit()
 
+    def _update_usage_rollups(self, rollups: List[Tuple[int, int, str]]):
+        """
+        The _update_usage_rollups function is called by the usage recorder with the query counts of the rollup buckets that ended.
+        Each row is added to the count of its bucket, which other workers may have written too, in one transaction.
+
+        Args:
+            self: Access the class attributes
+            rollups:List[Tuple[int, int, str]]: Tuples of query count, bucket start epoch and api_key
+
+        Returns:
+            Nothing
+        """
+        with self._connection() as connection:
+            with connection:
+                connection.executemany(
+                    """
+            INSERT INTO FASTAPI_AUTH_USAGE (api_key, bucket_start, count)
+            VALUES (?, ?, ?)
+            ON CONFLICT (api_key, bucket_start) DO UPDATE SET count = count + excluded.count
+            """,
+                    [(key_codec.encode(api_key), bucket_start, count) for count, bucket_start, api_key in rollups],
+                )
+
+    def get_usage_rollups(
+        self, api_key: Optional[str], start: datetime, end: datetime, granularity: int
+    ) -> List[Tuple[str, int]]:
+        """
+        The get_usage_rollups function sums the usage rollups of a period per bucket of the given granularity.
+
+        Args:
+            self: Access the class attributes
+            api_key:Optional[str]: Only count the queries of this API key, None for every key
+            start:datetime: Start of the period, naive UTC
+            end:datetime: End of the period, excluded, naive UTC
+            granularity:int: Size of the buckets returned, in seconds, a multiple of the rollup bucket
+
+        Returns:
+            A list of bucket start, in ISO 8601, and query count, for the buckets with queries
+        """
+        conditions, parameters = ["bucket_start >= ?", "bucket_start < ?"], [to_epoch(start), to_epoch(end)]
+        if api_key is not None:
+            conditions.append("api_key = ?")
+            parameters.append(key_codec.encode(api_key))
+
+        with self._connection() as connection:
+            return connection.execute(
+                f"""
+            SELECT strftime('%Y-%m-%dT%H:%M:%S', bucket_start - bucket_start % ?, 'unixepoch') AS bucket,
+                SUM(count)
+            FROM FASTAPI_AUTH_USAGE
+            WHERE {" AND ".join(conditions)}
+            GROUP BY bucket
+            ORDER BY bucket
+            """,
+                (granularity, *parameters),
+            ).fetchall()
+
+    def get_api_keys(self) -> Iterator[str]:
+        """
+        The get_api_keys function yields every API key stored in the database.
+        It is used to build the negative lookup filter at startup.
+
+        Args:
+            self: Access variables that belongs to the class
+
+        Returns:
+            An iterator over the api_key values
+        """
+        with self._connection() as connection:
+            for row in connection.execute("SELECT api_key FROM FASTAPI_AUTH"):
+                yield key_codec.decode(row[0])
+
+    def get_revoked_keys(self) -> List[str]:
+        """
+        The get_revoked_keys function returns every revoked API key.
+        It is used to refresh the revoked set of the signed API keys.
+
+        Args:
+            self: Access variables that belongs to the class
+
+        Returns:
+            A list of api_key values
+        """
+        with self._connection() as connection:
+            return [
+                key_codec.decode(row[0])
+                for row in connection.execute("SELECT api_key FROM FASTAPI_AUTH WHERE is_active = 0")
+            ]
+
+    def set_rate_limit(
+        self, api_key: str, rate: Optional[float], burst: Optional[int]
+    ) -> dict:
+        """
+        The set_rate_limit function sets the rate limit of an API key, overriding FASTAPI_AUTH_RATE_LIMIT.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key to limit
+            rate:Optional[float]: Requests per second, 0 for no limit, None for the global rate
+            burst:Optional[int]: Requests allowed at once, None for the global burst
+
+        Returns:
+            The rate limit of the key
+        """
+        with self._connection() as connection:
+            updated = connection.execute(
+                """
+            UPDATE FASTAPI_AUTH
+            SET rate_limit = ?, rate_limit_burst = ?
+            WHERE api_key = ?
+            """,
+                (rate, burst, key_codec.encode(api_key)),
+            ).rowcount
+            connection.commit()
+
+        if not updated:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="API key not found")
+
+        return {"rate_limit": rate, "rate_limit_burst": burst}
+
+    def get_rate_limits(self) -> Dict[str, Tuple[Optional[float], Optional[int]]]:
+        """
+        The get_rate_limits function returns the API keys that have their own rate limit.
+        It is used to refresh the limits of the rate limiter.
+
+        Args:
+            self: Access the class attributes
+
+        Returns:
+            A dictionary of api_key to rate and burst, None when the global one applies
+        """
+        with self._connection() as connection:
+            return {
+                key_codec.decode(row[0]): (row[1], row[2])
+                for row in connection.execute(
+                    """SELECT api_key, rate_limit, rate_limit_burst
+                    FROM FASTAPI_AUTH
+                    WHERE rate_limit IS NOT NULL OR rate_limit_burst IS NOT NULL"""
+                )
+            }
+
+    def _sync_rate_counts(self, counts: List[Tuple[int, str]]) -> Dict[str, int]:
+        """
+        The _sync_rate_counts function is called by the rate limiter to share the token buckets between the workers.
+        The requests each worker allowed are added to rate_limit_count, and the counts of the keys are read back.
+
+        Args:
+            self: Access the class attributes
+            counts:List[Tuple[int, str]]: Tuples of allowed requests delta and api_key
+
+        Returns:
+            A dictionary of api_key to rate_limit_count
+        """
+        api_keys = [key_codec.encode(api_key) for _, api_key in counts]
+        shared_counts = {}
+
+        with self._connection() as connection:
+            with connection:
+                connection.executemany(
+                    "UPDATE FASTAPI_AUTH SET rate_limit_count = rate_limit_count + ? WHERE api_key = ?",
+                    [(delta, key_codec.encode(api_key)) for delta, api_key in counts if delta],
+                )
+                # Stays under the bound parameters limit of older SQLite versions
+                for i in range(0, len(api_keys), 500):
+                    chunk = api_keys[i : i + 500]
+                    for row in connection.execute(
+                        f"""SELECT api_key, rate_limit_count
+                        FROM FASTAPI_AUTH
+                        WHERE api_key IN ({", ".join("?" * len(chunk))})""",
+                        chunk,
+                    ):
+                        shared_counts[key_codec.decode(row[0])] = row[1]
+
+        return shared_counts
+
     def get_usage_stats(self) -> List[Tuple[str, bool, bool, str, str, int]]:
         """
         The get_usage_stats function returns a list of tuples with values being api_key, is_active, expiration_date, latest_query_date, and total_queries.
@@ -327,13 +876,15 @@ class SQLiteAccess:
                 latest_query_date, and total_queries
             
         """
-        with sqlite3.connect(self.db_location) as connection:
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        with self._connection() as connection:
             c = connection.cursor()
 
             c.execute(
-                """
-            SELECT api_key, is_active, never_expire, expiration_date, \
-                latest_query_date, total_queries, name
+                f"""
+            SELECT {USAGE_COLUMNS}
             FROM FASTAPI_AUTH
             ORDER BY latest_query_date DESC
             """,
@@ -341,7 +892,74 @@ class SQLiteAccess:
 
             response = c.fetchall()
 
-        return response
+        return [key_codec.decode_row(row) for row in response]
+
+    def get_usage_logs(self, query: UsageQuery) -> List[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The get_usage_logs function returns a page of the usage stats, filtered and paginated in SQL.
+        The rows are sorted by latest query date then api_key, most recent first, and the never used keys come last.
+
+        Args:
+            self: Access variables that belongs to the class
+            query:UsageQuery: The filters, page size and cursor
+
+        Returns:
+            A list of tuples like get_usage_stats
+        """
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        filters, filter_parameters = sql_filter_conditions(
+            query, "?", "name", "CAST(strftime('%s', 'now') AS INTEGER)"
+        )
+
+        with self._connection() as connection:
+
+            def fetch(used, after_date, after_key, limit):
+                conditions, parameters = sql_page_conditions(
+                    used,
+                    None if after_date is None else to_epoch(datetime.fromisoformat(after_date)),
+                    None if after_key is None else key_codec.encode(after_key),
+                    "?",
+                )
+                rows = connection.execute(
+                    f"""
+            SELECT {USAGE_COLUMNS}
+            FROM FASTAPI_AUTH
+            WHERE {" AND ".join(conditions + filters)}
+            ORDER BY latest_query_date DESC, api_key DESC
+            LIMIT ?""",
+                    (*parameters, *filter_parameters, limit),
+                )
+                return [key_codec.decode_row(row) for row in rows]
+
+            return fetch_usage_page(fetch, query)
+
+    def iter_usage_stats(self) -> Iterator[Tuple[str, bool, bool, str, str, int, str, str]]:
+        """
+        The iter_usage_stats function yields the usage stats of every API key, like get_usage_stats, without holding them in memory.
+        The rows are read from a dedicated read-only connection, so the export sees a consistent snapshot
+        and the connection of the thread stays free for other queries while the stream is consumed.
+
+        Args:
+            self: Access variables that belongs to the class
+
+        Returns:
+            An iterator over tuples like get_usage_stats, in no particular order
+        """
+        # Usage still buffered in memory is written first so the stats are up to date
+        self.usage_recorder.flush()
+
+        connection = sqlite3.connect(
+            f"file:{pathname2url(os.path.abspath(self.db_location))}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        try:
+            for row in connection.execute(f"SELECT {USAGE_COLUMNS} FROM FASTAPI_AUTH"):
+                yield key_codec.decode_row(row)
+        finally:
+            connection.close()
 
 
 sqlite_access = SQLiteAccess()
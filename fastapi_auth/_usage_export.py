@@ -0,0 +1,60 @@
+"""Serialization of the usage stats export, in chunks for a StreamingResponse.
+"""
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+
+# Columns of the rows returned by iter_usage_stats
+EXPORT_FIELDS = [
+    "api_key",
+    "is_active",
+    "never_expire",
+    "expiration_date",
+    "latest_query_date",
+    "total_queries",
+    "username",
+    "email",
+]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_usage(
+    rows: Iterable[tuple], export_format: str, chunk_size: int = 1000
+) -> Iterator[str]:
+    """
+    The export_usage function serializes usage stats rows as NDJSON or CSV.
+    Rows are consumed lazily and written in chunks of chunk_size rows, so memory use does not depend on the number of rows.
+
+    Args:
+        rows:Iterable[tuple]: Rows like those of iter_usage_stats
+        export_format:str: ndjson or csv
+        chunk_size:int: Number of rows per yielded chunk
+
+    Returns:
+        An iterator over the chunks of the export
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    if writer:
+        writer.writerow(EXPORT_FIELDS)
+
+    count = 0
+    for row in rows:
+        row = (row[0], bool(row[1]), bool(row[2]), *row[3:])
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, row))))
+            buffer.write("\n")
+
+        count += 1
+        if count == chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
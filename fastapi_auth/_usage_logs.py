@@ -0,0 +1,180 @@
+"""Filtering and keyset pagination of the usage logs, shared by the backends.
+
+Pages are sorted on ``latest_query_date DESC, api_key DESC``. Keys that were never used have no
+``latest_query_date`` and the databases disagree on where NULLs sort, so they always come last,
+fetched by a second query once the used keys are exhausted. Both queries are index range scans.
+"""
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@dataclass
+class UsageQuery:
+    """Page of usage logs requested from a backend"""
+
+    limit: int = 100
+    # latest_query_date (ISO 8601, None for never used keys) and api_key of the last row of the previous page
+    after_date: Optional[str] = None
+    after_key: Optional[str] = None
+    active: bool = False
+    expired: bool = False
+    never_used: bool = False
+    username_prefix: Optional[str] = None
+    email_prefix: Optional[str] = None
+    min_total_queries: Optional[int] = None
+
+
+def encode_cursor(row: tuple) -> str:
+    """
+    The encode_cursor function builds the opaque cursor pointing after a row of get_usage_logs.
+
+    Args:
+        row:tuple: The last row of a page
+
+    Returns:
+        A URL safe string
+    """
+    return base64.urlsafe_b64encode(json.dumps([row[4], row[0]]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], str]:
+    """
+    The decode_cursor function reads a cursor built by encode_cursor.
+
+    Args:
+        cursor:str: The cursor sent by the client
+
+    Returns:
+        The latest_query_date and api_key of the last row of the previous page
+
+    Raises:
+        HTTPException 422 if the cursor is malformed
+    """
+    try:
+        after_date, after_key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(after_key, str):
+            raise ValueError(cursor)
+        if after_date is not None:
+            datetime.fromisoformat(after_date)
+    except (ValueError, TypeError, binascii.Error) as exc:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid cursor."
+        ) from exc
+
+    return after_date, after_key
+
+
+def escape_wildcards(text: str) -> str:
+    """
+    Escapes the LIKE wildcards of a text, to be used with ESCAPE '!'
+    """
+    return text.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+
+def escape_like(prefix: str) -> str:
+    """
+    Escapes the LIKE wildcards of a prefix, to be used with ESCAPE '!'
+    """
+    return escape_wildcards(prefix) + "%"
+
+
+def sql_filter_conditions(
+    query: UsageQuery, placeholder: str, username_column: str, now: str
+) -> Tuple[List[str], list]:
+    """
+    The sql_filter_conditions function translates the filters of a UsageQuery into SQL conditions.
+
+    Args:
+        query:UsageQuery: The requested page
+        placeholder:str: The parameter placeholder of the driver
+        username_column:str: The column holding the username
+        now:str: The SQL expression of the current UTC time, in the type of the date columns
+
+    Returns:
+        The conditions to join with AND, and their parameters
+    """
+    conditions = []
+    parameters = []
+
+    if query.active:
+        conditions.append(
+            f"is_active = 1 AND (never_expire = 1 OR expiration_date >= {now})"
+        )
+    if query.expired:
+        conditions.append(f"never_expire = 0 AND expiration_date < {now}")
+    if query.username_prefix:
+        conditions.append(f"{username_column} LIKE {placeholder} ESCAPE '!'")
+        parameters.append(escape_like(query.username_prefix))
+    if query.email_prefix:
+        conditions.append(f"email LIKE {placeholder} ESCAPE '!'")
+        parameters.append(escape_like(query.email_prefix))
+    if query.min_total_queries is not None:
+        conditions.append(f"total_queries >= {placeholder}")
+        parameters.append(query.min_total_queries)
+
+    return conditions, parameters
+
+
+def sql_page_conditions(
+    used: bool, after_date, after_key: Optional[str], placeholder: str
+) -> Tuple[List[str], list]:
+    """
+    The sql_page_conditions function builds the keyset conditions of one of the two queries of fetch_usage_page.
+
+    Args:
+        used:bool: Whether the query fetches keys that were used, or never used keys
+        after_date: latest_query_date of the previous page, converted to the type of the column
+        after_key:Optional[str]: api_key of the last row of the previous page
+        placeholder:str: The parameter placeholder of the driver
+
+    Returns:
+        The conditions to join with AND, and their parameters
+    """
+    if not used:
+        conditions = ["latest_query_date IS NULL"]
+        if after_key is None:
+            return conditions, []
+        return conditions + [f"api_key < {placeholder}"], [after_key]
+
+    conditions = ["latest_query_date IS NOT NULL"]
+    if after_key is None:
+        return conditions, []
+    return conditions + [
+        f"(latest_query_date, api_key) < ({placeholder}, {placeholder})"
+    ], [after_date, after_key]
+
+
+def fetch_usage_page(
+    fetch: Callable[[bool, Optional[str], Optional[str], int], List[tuple]],
+    query: UsageQuery,
+) -> List[tuple]:
+    """
+    The fetch_usage_page function reads a page of usage logs, the used keys first then the never used ones.
+
+    Args:
+        fetch:Callable: Runs one query, from whether it reads used keys, the cursor date and key and the number of rows
+        query:UsageQuery: The requested page
+
+    Returns:
+        At most query.limit rows of api_key, is_active, never_expire, expiration_date, latest_query_date,
+        total_queries, username and email
+    """
+    rows = []
+    # A cursor without a date points into the never used keys
+    in_used_keys = query.after_key is None or query.after_date is not None
+
+    if in_used_keys and not query.never_used:
+        rows.extend(fetch(True, query.after_date, query.after_key, query.limit))
+
+    if len(rows) < query.limit:
+        after_key = None if in_used_keys else query.after_key
+        rows.extend(fetch(False, None, after_key, query.limit - len(rows)))
+
+    return rows
@@ -0,0 +1,233 @@
+"""Write-behind recorder of API key usage.
+
+Besides the total_queries and latest_query_date of each key, queries are counted per key and per
+FASTAPI_AUTH_USAGE_ROLLUP_BUCKET seconds. The count of a bucket is kept in memory until the bucket ends,
+then written to the rollup table once.
+"""
+import atexit
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class UsageRecorder:
+    """Aggregates API key usage in memory and flushes it to the backend in bulk from a single thread"""
+
+    def __init__(
+        self,
+        flush: Callable[[List[Tuple[int, int, str]]], None],
+        flush_interval: Optional[float] = None,
+        max_buffer_size: Optional[int] = None,
+        flush_rollups: Optional[Callable[[List[Tuple[int, int, str]]], None]] = None,
+        rollup_bucket: Optional[int] = None,
+    ):
+        self._flush = flush
+        self._flush_rollups = flush_rollups
+        self.flush_interval = (
+            float(os.getenv("FASTAPI_AUTH_USAGE_FLUSH_INTERVAL", "1"))
+            if flush_interval is None
+            else flush_interval
+        )
+        self.max_buffer_size = (
+            int(os.getenv("FASTAPI_AUTH_USAGE_BUFFER_SIZE", "10000"))
+            if max_buffer_size is None
+            else max_buffer_size
+        )
+        self.rollup_bucket = (
+            int(os.getenv("FASTAPI_AUTH_USAGE_ROLLUP_BUCKET", "3600"))
+            if rollup_bucket is None
+            else rollup_bucket
+        )
+        if self.rollup_bucket < 0 or (self.rollup_bucket and 86400 % self.rollup_bucket):
+            raise ValueError(
+                f"FASTAPI_AUTH_USAGE_ROLLUP_BUCKET must divide a day, {self.rollup_bucket} seconds does not"
+            )
+
+        # api_key -> [query count since the last flush, latest query timestamp]
+        self._pending: Dict[str, list] = {}
+        # api_key -> [start of its current rollup bucket, query count in the bucket]
+        self._rollups: Dict[str, list] = {}
+        # (api_key, bucket start) -> query count, of the buckets that ended
+        self._ended_rollups: Dict[Tuple[str, int], int] = {}
+        self._last_swept_bucket = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+        self.flush_count = 0
+        self.last_flush_size = 0
+        self.last_flush_duration = 0.0
+        self.max_flush_duration = 0.0
+        self.rollup_rows = 0
+
+    @property
+    def rollups_enabled(self) -> bool:
+        return self._flush_rollups is not None and self.rollup_bucket > 0
+
+    def record(self, api_key: str):
+        """
+        The record function counts one successful query for an API key.
+        It only touches memory, the database is updated by the next flush.
+
+        Args:
+            self: Access the class attributes
+            api_key:str: The API key that was used
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._pending.get(api_key)
+            if entry is None:
+                self._pending[api_key] = [1, now]
+            else:
+                entry[0] += 1
+                entry[1] = now
+            buffer_size = len(self._pending)
+
+            if self.rollups_enabled:
+                bucket_start = int(now) - int(now) % self.rollup_bucket
+                rollup = self._rollups.get(api_key)
+                if rollup is None:
+                    self._rollups[api_key] = [bucket_start, 1]
+                elif rollup[0] == bucket_start:
+                    rollup[1] += 1
+                else:
+                    self._end_rollup(api_key, rollup)
+                    rollup[:] = [bucket_start, 1]
+
+            if self._thread is None and not self._stopped:
+                self._start()
+
+        if buffer_size >= self.max_buffer_size:
+            self._wakeup.set()
+
+    def _end_rollup(self, api_key: str, rollup: list):
+        key = (api_key, rollup[0])
+        self._ended_rollups[key] = self._ended_rollups.get(key, 0) + rollup[1]
+
+    def flush(self, final: bool = False):
+        """
+        The flush function writes every pending usage delta to the backend in a single call,
+        then the rollup buckets that ended in another one.
+        If a write fails, the deltas are kept for the next flush.
+
+        Args:
+            self: Access the class attributes
+            final:bool: Also write the rollup buckets still in progress, when the process stops
+        """
+        with self._flush_lock:
+            self._flush_usage()
+            if self.rollups_enabled:
+                self._flush_ended_rollups(final)
+
+    def _flush_usage(self):
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+
+        rows = [
+            (
+                delta,
+                int(last_seen),
+                api_key,
+            )
+            for api_key, (delta, last_seen) in pending.items()
+        ]
+
+        start = time.perf_counter()
+        try:
+            self._flush(rows)
+        except Exception as e:
+            print("Error while flushing API key usage:", e)
+            with self._lock:
+                for api_key, (delta, last_seen) in pending.items():
+                    entry = self._pending.setdefault(api_key, [0, last_seen])
+                    entry[0] += delta
+                    entry[1] = max(entry[1], last_seen)
+            return
+
+        duration = time.perf_counter() - start
+        self.flush_count += 1
+        self.last_flush_size = len(rows)
+        self.last_flush_duration = duration
+        self.max_flush_duration = max(self.max_flush_duration, duration)
+
+    def _flush_ended_rollups(self, final: bool):
+        now = int(time.time())
+        current_bucket = now - now % self.rollup_bucket
+
+        with self._lock:
+            # Keys not used since their bucket ended are only found by going through all of them,
+            # which is done once per bucket
+            if final or current_bucket > self._last_swept_bucket:
+                for api_key, rollup in list(self._rollups.items()):
+                    if final or rollup[0] < current_bucket:
+                        self._end_rollup(api_key, rollup)
+                        del self._rollups[api_key]
+                self._last_swept_bucket = current_bucket
+
+            if not self._ended_rollups:
+                return
+            ended, self._ended_rollups = self._ended_rollups, {}
+
+        rows = [(count, bucket_start, api_key) for (api_key, bucket_start), count in ended.items()]
+        try:
+            self._flush_rollups(rows)
+        except Exception as e:
+            print("Error while flushing API key usage rollups:", e)
+            with self._lock:
+                for key, count in ended.items():
+                    self._ended_rollups[key] = self._ended_rollups.get(key, 0) + count
+            return
+
+        self.rollup_rows += len(rows)
+
+    def stop(self):
+        """
+        Stops the background thread and drains the pending usage to the backend
+        """
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+
+        self.flush(final=True)
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the state of the usage buffer and the latency of the flushes.
+
+        Returns:
+            A dictionary of the recorder settings and metrics
+        """
+        return {
+            "flush_interval": self.flush_interval,
+            "max_buffer_size": self.max_buffer_size,
+            "pending_keys": len(self._pending),
+            "flushing": int(self._flush_lock.locked()),
+            "flush_count": self.flush_count,
+            "last_flush_size": self.last_flush_size,
+            "last_flush_duration": self.last_flush_duration,
+            "max_flush_duration": self.max_flush_duration,
+            "rollup_bucket": self.rollup_bucket,
+            "rollup_keys": len(self._rollups),
+            "rollup_rows": self.rollup_rows,
+        }
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
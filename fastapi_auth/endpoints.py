@@ -1,42 +1,57 @@
 """Endpoints defined by the dependency.
 """
+import asyncio
+import json
 import os
 import re
-from typing import List, Optional
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple, Union
+
+if sys.version_info >= (3, 8):
+    from typing import Literal
+else:
+    from typing_extensions import Literal
 
-import bcrypt
 from dotenv import load_dotenv
 
 load_dotenv()
 from email_validator import EmailNotValidError, validate_email
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from passwordgenerator import pwgenerator
-from pydantic import BaseModel
-from starlette.status import HTTP_403_FORBIDDEN
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from starlette.status import (
+    HTTP_403_FORBIDDEN,
+    HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+)
 
-from fastapi_auth._mysql_access import mysql_access
-from fastapi_auth._mongodb_access import mongodb_access
-from fastapi_auth._postgres_access import postgres_access
+from fastapi_auth._backends import database_mode, get_backend
+from fastapi_auth._bulk_provisioning import NewUser
+from fastapi_auth._bulk_updates import KeySelection, to_utc
+from fastapi_auth._key_store import key_store
+from fastapi_auth._metrics import CONTENT_TYPE, metrics
+from fastapi_auth._password_hasher import password_hasher
+from fastapi_auth._rate_limiter import rate_limiter
 from fastapi_auth._security_secret import secret_based_security
-from fastapi_auth._sqlite_access import sqlite_access
+from fastapi_auth._signed_keys import signed_keys
+from fastapi_auth._usage_export import MEDIA_TYPES, export_usage
+from fastapi_auth._usage_logs import UsageQuery, decode_cursor, encode_cursor
 
 api_key_router = APIRouter()
 
 show_endpoints = "FASTAPI_AUTH_HIDE_DOCS" not in os.environ
 
-try:
-    DATABASE_MODE = os.getenv("DATABASE_MODE")
-    if DATABASE_MODE == "postgres":
-        dev = postgres_access
-    elif DATABASE_MODE == "mysql":
-        dev = mysql_access
-    elif DATABASE_MODE == "mongodb":
-        dev = mongodb_access
-    else:
-        dev = sqlite_access
-except KeyError as e:
-    print("DATABASE_MODE not set. Default=SQLite3 Database")
-    dev = sqlite_access
+# Maximum number of users of a /new/bulk request, and of their emails validated at once
+BULK_MAX_USERS = int(os.getenv("FASTAPI_AUTH_BULK_MAX_USERS", "100000"))
+BULK_VALIDATION_CONCURRENCY = 16
+
+# Only the backend of DATABASE_MODE is imported and connected, SQLite by default
+DATABASE_MODE = database_mode()
+dev = get_backend(DATABASE_MODE)
 
 
 def hash_password(password: str) -> str:
@@ -52,9 +67,7 @@ def hash_password(password: str) -> str:
     """
     if password is not None:
         try:
-            salt = bcrypt.gensalt()
-            hashed = bcrypt.hashpw(str(password).encode("utf-8"), salt)
-            return hashed.decode("utf-8")
+            return password_hasher.hash(str(password))
         except Exception as e:
             print(e)
     else:
@@ -133,7 +146,7 @@ def check_length_password(password: str) -> str:
     dependencies=[Depends(secret_based_security)],
     include_in_schema=show_endpoints,
 )
-def get_new_api_key(
+async def get_new_api_key(
     username: str = Query(
         None,
         description="set API key username",
@@ -150,14 +163,36 @@ def get_new_api_key(
         False,
         description="if set, the created API key will never be considered expired",
     ),
-) -> str:
+) -> dict:
     """
     Returns:
         api_key: a newly generated API key
     """
+    email, password = await validate_new_user(email, password)
+    # Taken before the key is created, so a signed key never outlives the stored one
+    expires_at = int(time.time()) + dev.expiration_limit * 86400
+    response = await run_in_threadpool(
+        dev.create_key, username, email, password, never_expires
+    )
+    return signed_keys.issue(response, never_expires, expires_at)
+
+
+async def validate_new_user(email: str, password: str) -> Tuple[str, str]:
+    """
+    The validate_new_user function checks the email and password of a new API key user, and hashes the password.
+
+    Args:
+        email:str: The email address of the user
+        password:str: The password of the user
+
+    Returns:
+        The normalized email address and the hashed password
+
+    Raises:
+        HTTPException 403 if the email or the password is rejected
+    """
     if password != "":
         password = check_length_password(password)
-        password = hash_password(password)
     else:
         new_password = str(pwgenerator.generate())
         raise HTTPException(
@@ -165,13 +200,95 @@ def get_new_api_key(
             detail=f"Input a password: {new_password} or choose another password longer than 8 characters.",
         )
     if email != "":
-        email = email_validate(email)
+        # The deliverability check may query DNS
+        email = await run_in_threadpool(email_validate, email)
     else:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN,
             detail="Input your email address.",
         )
-    return dev.create_key(username, email, password, never_expires)
+    # Hashing runs on its own bounded pool, see _password_hasher
+    password = await password_hasher.hash_async(password)
+    return email, password
+
+
+class BulkUser(BaseModel):
+    """User of a /new/bulk request, with the parameters of /new"""
+
+    username: Optional[str] = None
+    email: Optional[str] = None
+    password: Optional[str] = None
+    never_expires: bool = False
+
+
+@api_key_router.post(
+    "/new/bulk",
+    dependencies=[Depends(secret_based_security)],
+    include_in_schema=show_endpoints,
+)
+async def get_new_api_keys(request: Request) -> dict:
+    """
+    Creates an API key for each user of the request body, a JSON array or, with the
+    application/x-ndjson content type, one JSON object per line. Users take the parameters of /new.
+
+    Returns:
+        created: the number of API keys created
+        results: for each user, in order, the index of the user and either its api-key or the error
+    """
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            users = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            users = json.loads(body)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="The request body must be a JSON array or NDJSON.",
+        ) from exc
+    if not isinstance(users, list):
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="The request body must be a JSON array or NDJSON.",
+        )
+    if len(users) > BULK_MAX_USERS:
+        raise HTTPException(
+            status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BULK_MAX_USERS} users can be created per request.",
+        )
+
+    # Leaves threads of the threadpool to the other requests while emails are validated
+    validation_slots = asyncio.Semaphore(BULK_VALIDATION_CONCURRENCY)
+
+    async def validate(user) -> Union[NewUser, str]:
+        try:
+            user = BulkUser(**user)
+            async with validation_slots:
+                email, password = await validate_new_user(user.email, user.password)
+        except HTTPException as exc:
+            return exc.detail
+        except (ValidationError, TypeError):
+            return "Invalid user, expected an object with username, email, password and never_expires."
+        return user.username, email, password, user.never_expires
+
+    validated = await asyncio.gather(*(validate(user) for user in users))
+
+    valid = [(index, user) for index, user in enumerate(validated) if not isinstance(user, str)]
+    expires_at = int(time.time()) + dev.expiration_limit * 86400
+    created = await run_in_threadpool(dev.create_keys, [user for _, user in valid])
+    created = [
+        signed_keys.issue(result, user[3], expires_at)
+        for (_, user), result in zip(valid, created)
+    ]
+
+    results = [{"index": index, "error": user} for index, user in enumerate(validated)]
+    for (index, _), result in zip(valid, created):
+        results[index] = {"index": index, **result}
+
+    return {
+        "created": sum("api-key" in result for result in created),
+        "results": results,
+    }
 
 
 @api_key_router.get(
@@ -186,7 +303,11 @@ def revoke_api_key(
     Revokes the usage of the given API key
 
     """
-    return dev.revoke_key(api_key)
+    key_id = signed_keys.key_id(api_key)
+    response = dev.revoke_key(key_id)
+    signed_keys.revoke(key_id)
+    key_store.invalidate(key_id)
+    return response
 
 
 @api_key_router.get(
@@ -205,7 +326,122 @@ def renew_api_key(
     """
     Renews the chosen API key, reactivating it if it was revoked.
     """
-    return dev.renew_key(api_key, expiration_date)
+    key_id = signed_keys.key_id(api_key)
+    response = dev.renew_key(key_id, expiration_date)
+    signed_keys.reinstate(key_id)
+    key_store.invalidate(key_id)
+    return response
+
+
+@api_key_router.get(
+    "/rate-limit",
+    dependencies=[Depends(secret_based_security)],
+    include_in_schema=show_endpoints,
+)
+def set_api_key_rate_limit(
+    api_key: str = Query(..., alias="api-key", description="the API key to limit"),
+    rate: float = Query(
+        None, ge=0, description="requests per second, 0 for no limit, the global rate if not set"
+    ),
+    burst: int = Query(
+        None, ge=1, description="requests allowed at once, the global burst if not set"
+    ),
+):
+    """
+    Sets the rate limit of the given API key. Without rate and burst, the global limit applies again.
+    """
+    key_id = signed_keys.key_id(api_key)
+    response = dev.set_rate_limit(key_id, rate, burst)
+    rate_limiter.set_override(key_id, rate, burst)
+    return response
+
+
+class BulkKeys(BaseModel):
+    """API keys of /revoke/bulk and /renew/bulk, a list of keys and filters combined with AND"""
+
+    api_keys: Optional[List[str]] = None
+    username: Optional[str] = None
+    email_domain: Optional[str] = None
+    expires_after: Optional[datetime] = None
+    expires_before: Optional[datetime] = None
+
+    def to_selection(self) -> KeySelection:
+        return KeySelection(
+            api_keys=None
+            if self.api_keys is None
+            else [signed_keys.key_id(api_key) for api_key in self.api_keys],
+            username=self.username,
+            email_domain=self.email_domain,
+            expires_after=None if self.expires_after is None else to_utc(self.expires_after),
+            expires_before=None if self.expires_before is None else to_utc(self.expires_before),
+        )
+
+
+class BulkRenewal(BulkKeys):
+    expiration_date: Optional[datetime] = None
+
+
+@api_key_router.post(
+    "/revoke/bulk",
+    dependencies=[Depends(secret_based_security)],
+    include_in_schema=show_endpoints,
+)
+def revoke_api_keys(keys: BulkKeys) -> dict:
+    """
+    Revokes every selected API key with a single update.
+
+    Returns:
+        revoked: the number of API keys revoked
+    """
+    selection = keys.to_selection()
+    response = dev.revoke_keys(selection)
+    update_revoked_keys(selection, True)
+    return response
+
+
+@api_key_router.post(
+    "/renew/bulk",
+    dependencies=[Depends(secret_based_security)],
+    include_in_schema=show_endpoints,
+)
+def renew_api_keys(keys: BulkRenewal) -> dict:
+    """
+    Renews every selected API key with a single update, reactivating the revoked ones.
+
+    Returns:
+        renewed: the number of API keys renewed
+        expiration_date: their new expiration date
+    """
+    selection = keys.to_selection()
+    response = dev.renew_keys(selection, keys.expiration_date)
+    update_revoked_keys(selection, False)
+    return response
+
+
+def update_revoked_keys(selection: KeySelection, revoked: bool):
+    """
+    The update_revoked_keys function applies a bulk revocation or renewal to the revoked set of the signed API keys,
+    and to the memory-mapped key store. Keys selected by filters are only known to the database, the set is reloaded
+    from it and the key store is rebuilt.
+
+    Args:
+        selection:KeySelection: The API keys, or the filters, of the keys updated
+        revoked:bool: True if the keys were revoked, False if they were renewed
+    """
+    if selection.api_keys is None:
+        key_store.invalidate_all()
+    else:
+        key_store.invalidate(*selection.api_keys)
+
+    if not signed_keys.enabled:
+        return
+
+    if selection.api_keys is None:
+        signed_keys.load(dev.get_revoked_keys())
+    elif revoked:
+        signed_keys.revoke(*selection.api_keys)
+    else:
+        signed_keys.reinstate(*selection.api_keys)
 
 
 class UsageLog(BaseModel):
@@ -216,11 +452,12 @@ class UsageLog(BaseModel):
     expiration_date: str
     latest_query_date: Optional[str]
     total_queries: int
-    email: str
+    email: Optional[str]
 
 
 class UsageLogs(BaseModel):
     logs: List[UsageLog]
+    next_cursor: Optional[str] = None
 
 
 @api_key_router.get(
@@ -229,13 +466,48 @@ class UsageLogs(BaseModel):
     response_model=UsageLogs,
     include_in_schema=show_endpoints,
 )
-def get_api_key_usage_logs():
+def get_api_key_usage_logs(
+    limit: int = Query(
+        100, ge=1, le=1000, description="maximum number of API keys returned"
+    ),
+    cursor: str = Query(
+        None, description="the next_cursor of the previous page, to get the next one"
+    ),
+    active: bool = Query(False, description="only return valid API keys"),
+    expired: bool = Query(False, description="only return expired API keys"),
+    never_used: bool = Query(
+        False, alias="never-used", description="only return API keys never used"
+    ),
+    username: str = Query(None, description="only return usernames starting with this prefix"),
+    email: str = Query(None, description="only return emails starting with this prefix"),
+    min_total_queries: int = Query(
+        None,
+        ge=0,
+        alias="min-total-queries",
+        description="only return API keys used at least this many times",
+    ),
+):
     """
-    Returns usage information for all API keys
+    Returns usage information for the API keys, most recently used first, one page at a time.
+    The keys that were never used come last.
     """
-    # TODO Add some sort of filtering on older keys/unused keys?
+    after_date, after_key = decode_cursor(cursor) if cursor else (None, None)
+    rows = dev.get_usage_logs(
+        UsageQuery(
+            limit=limit,
+            after_date=after_date,
+            after_key=after_key,
+            active=active,
+            expired=expired,
+            never_used=never_used,
+            username_prefix=username,
+            email_prefix=email,
+            min_total_queries=min_total_queries,
+        )
+    )
 
     return UsageLogs(
+        next_cursor=encode_cursor(rows[-1]) if len(rows) == limit else None,
         logs=[
             UsageLog(
                 api_key=row[0],
@@ -247,6 +519,111 @@ def get_api_key_usage_logs():
                 username=row[6],
                 email=row[7],
             )
-            for row in dev.get_usage_stats()
+            for row in rows
         ]
     )
+
+
+# Seconds in each granularity of the usage rollups, and maximum number of buckets a query may span
+ROLLUP_GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+ROLLUP_MAX_BUCKETS = 10000
+
+
+class UsageBucket(BaseModel):
+    bucket_start: str
+    count: int
+
+
+class UsageRollups(BaseModel):
+    granularity: str
+    buckets: List[UsageBucket]
+
+
+@api_key_router.get(
+    "/logs/usage",
+    dependencies=[Depends(secret_based_security)],
+    response_model=UsageRollups,
+    include_in_schema=show_endpoints,
+)
+def get_api_key_usage_rollups(
+    key: str = Query(None, description="only count the queries of this API key"),
+    start: datetime = Query(
+        None, alias="from", description="start of the period, 24 hours before its end by default"
+    ),
+    end: datetime = Query(None, alias="to", description="end of the period, excluded, now by default"),
+    granularity: Literal["minute", "hour", "day"] = Query(
+        "hour", description="minute, hour or day"
+    ),
+):
+    """
+    Returns the number of queries per minute, hour or day over a period, for one API key or all of them.
+    Only the buckets with queries are returned, the bucket in progress is counted once it ended.
+    """
+    seconds = ROLLUP_GRANULARITIES[granularity]
+    if not dev.usage_recorder.rollups_enabled:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Usage rollups are disabled, set FASTAPI_AUTH_USAGE_ROLLUP_BUCKET to enable them.",
+        )
+    if seconds % dev.usage_recorder.rollup_bucket:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Usage is rolled up every {dev.usage_recorder.rollup_bucket} seconds, the granularity cannot be finer.",
+        )
+
+    end = to_utc(end) if end is not None else datetime.utcnow().replace(microsecond=0)
+    start = to_utc(start) if start is not None else end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="The start of the period must be before its end.",
+        )
+    if (end - start).total_seconds() / seconds > ROLLUP_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"The period spans more than {ROLLUP_MAX_BUCKETS} buckets, use a coarser granularity.",
+        )
+
+    buckets = dev.get_usage_rollups(
+        signed_keys.key_id(key) if key else None, start, end, seconds
+    )
+
+    return UsageRollups(
+        granularity=granularity,
+        buckets=[UsageBucket(bucket_start=bucket, count=count) for bucket, count in buckets],
+    )
+
+
+@api_key_router.get(
+    "/logs/export",
+    dependencies=[Depends(secret_based_security)],
+    include_in_schema=show_endpoints,
+)
+def export_api_key_usage_logs(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="ndjson or csv"),
+):
+    """
+    Streams the usage information of every API key, as NDJSON or CSV.
+    The rows are read through a server-side cursor, so the memory used does not depend on the number of API keys.
+    """
+    return StreamingResponse(
+        export_usage(dev.iter_usage_stats(), format),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="fastapi_auth_usage.{format}"'
+        },
+    )
+
+
+@api_key_router.get(
+    "/metrics",
+    dependencies=[Depends(secret_based_security)],
+    include_in_schema=show_endpoints,
+)
+def get_metrics():
+    """
+    Exports the API key validation metrics in the Prometheus text format: latency histograms per method,
+    allowed and denied validations per reason, and the connection pool and usage buffer gauges.
+    Validations are only measured with FASTAPI_AUTH_METRICS=true.
+    """
+    return Response(metrics.render(dev), media_type=CONTENT_TYPE)
@@ -1,18 +1,25 @@
 """Main dependency for other endpoints.
 """
 
-import os
+import math
+import time
 from re import L
 
 from dotenv import load_dotenv
 from fastapi import Security
 from fastapi.security import APIKeyHeader, APIKeyQuery
 from starlette.exceptions import HTTPException
-from starlette.status import HTTP_403_FORBIDDEN
+from starlette.status import HTTP_403_FORBIDDEN, HTTP_429_TOO_MANY_REQUESTS
 
-from fastapi_auth._mysql_access import mysql_access
-from fastapi_auth._postgres_access import postgres_access
-from fastapi_auth._sqlite_access import sqlite_access
+from fastapi_auth._async_access import get_async_access
+from fastapi_auth._backends import database_mode, get_backend
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._key_events import key_events
+from fastapi_auth._key_filter import key_filter
+from fastapi_auth._key_store import key_store
+from fastapi_auth._metrics import metrics
+from fastapi_auth._rate_limiter import rate_limiter
+from fastapi_auth._signed_keys import signed_keys
 
 load_dotenv()
 API_KEY_NAME = "api-key"
@@ -25,17 +32,115 @@ api_key_header = APIKeyHeader(
 )
 
 
-try:
-    DATABASE_MODE = os.getenv("DATABASE_MODE")
-    if DATABASE_MODE == "postgres":
-        dev = postgres_access
-    elif DATABASE_MODE == "mysql":
-        dev = mysql_access
-    else:
-        dev = sqlite_access
-except KeyError as e:
-    print("DATABASE_MODE not set. Default=SQLite3 Database")
-    dev = sqlite_access
+# Only the backend of DATABASE_MODE is imported and connected, SQLite by default
+DATABASE_MODE = database_mode()
+dev = get_backend(DATABASE_MODE)
+
+key_filter.start(dev.get_api_keys)
+key_store.start(dev.iter_usage_stats)
+signed_keys.start(dev.get_revoked_keys)
+rate_limiter.start(dev.get_rate_limits, dev._sync_rate_counts)
+if DATABASE_MODE == "postgres":
+    # Applies the keys created, revoked and renewed through the other workers
+    key_events.start(dev.connect, dev.get_revoked_keys, dev.get_api_keys)
+
+# Queries run off the event loop, see _async_access
+async_dev = get_async_access(dev, DATABASE_MODE)
+
+
+async def _check_key(api_key: str) -> bool:
+    """
+    The _check_key function validates an API key, answering from the in-process key cache when possible.
+    Keys the memory-mapped key store knows to be valid are accepted, and keys the negative lookup filter
+    knows to be absent are rejected, without querying the backend.
+    Otherwise the backend is awaited without blocking the event loop, and it caches the key itself if it is valid.
+
+    Signed keys are checked on the CPU against their signature, their expiration date and the revoked set,
+    and only go through the backend once their embedded expiration date passed, in case they were renewed.
+
+    With FASTAPI_AUTH_METRICS=true, the duration of the validation and its outcome are recorded.
+
+    Args:
+        api_key:str: The API key to validate
+
+    Returns:
+        True if the api key is valid, false otherwise
+    """
+    start = time.perf_counter_ns() if metrics.enabled else 0
+
+    if signed_keys.enabled and signed_keys.is_signed(api_key):
+        claims = signed_keys.verify(api_key)
+        if claims is None:
+            return _validated(start, "signed", "unknown")
+
+        key_id, expires_at = claims
+        if signed_keys.is_revoked(key_id):
+            return _validated(start, "signed", "revoked")
+
+        if not expires_at or expires_at > time.time():
+            dev.usage_recorder.record(key_id)
+            return _validated(start, "signed", "valid")
+
+        # The embedded expiration date passed, the key may have been renewed since
+        api_key = key_id
+
+    if key_cache.hit(api_key):
+        dev.usage_recorder.record(api_key)
+        return _validated(start, "cache", "valid")
+
+    if key_store.enabled and key_store.is_valid(api_key):
+        dev.usage_recorder.record(api_key)
+        return _validated(start, "store", "valid")
+
+    if not key_filter.might_contain(api_key):
+        return _validated(start, "filter", "unknown")
+
+    # The validation query also tells why a key is denied, so counting the denials costs no extra query
+    reason = await async_dev.check_key_status(api_key)
+
+    return _validated(start, "check_key", reason or "valid")
+
+
+def _validated(start: int, method: str, reason: str) -> bool:
+    """
+    The _validated function records the duration and the outcome of a validation, if metrics are enabled.
+
+    Args:
+        start:int: time.perf_counter_ns() when the validation started
+        method:str: What answered the validation: signed, cache, store, filter or check_key
+        reason:str: valid, or why the key was denied
+
+    Returns:
+        True if the api key is valid, false otherwise
+    """
+    if metrics.enabled:
+        metrics.observe(method, reason, time.perf_counter_ns() - start)
+
+    return reason == "valid"
+
+
+def _rate_limit(api_key: str) -> str:
+    """
+    The _rate_limit function takes a token from the bucket of a valid API key.
+
+    Args:
+        api_key:str: The API key that was validated
+
+    Returns:
+        The API key, if the request is allowed
+
+    Raises:
+        HTTPException 429, with the seconds to wait in the Retry-After header, if the key exceeded its rate limit
+    """
+    retry_after = rate_limiter.acquire(signed_keys.key_id(api_key))
+    if retry_after:
+        raise HTTPException(
+            status_code=HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded for this API key.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    return api_key
 
 
 async def api_key_security(
@@ -46,6 +151,7 @@ async def api_key_security(
     The api_key_security function is a custom type that checks for the presence of an API key in the query string and header.
     If no API key is present, it raises an HTTPException with status code 403.
     If an invalid or revoked API key is found, it also raises an HTTPException with status code 403.
+    If the key exceeded its rate limit, it raises an HTTPException with status code 429.
 
     Args:
         query_param:str=Security(api_key_query): Pass the api_key as a query parameter
@@ -56,16 +162,18 @@ async def api_key_security(
         The api key if it is passed in the query string or header
     """
     if not query_param and not header_param:
+        if metrics.enabled:
+            metrics.missing += 1
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN,
             detail="An API key must be passed as query or header",
         )
 
-    elif query_param and dev.check_key(query_param):
-        return query_param
+    elif query_param and await _check_key(query_param):
+        return _rate_limit(query_param)
 
-    elif header_param and dev.check_key(header_param):
-        return header_param
+    elif header_param and await _check_key(header_param):
+        return _rate_limit(header_param)
 
     else:
         raise HTTPException(
@@ -67,8 +67,12 @@ setup(
         "pymysql>=1.0.2",
         "uvicorn>=0.18.3",
         "pymongo>=4.0.0",
-        "python-dotenv>=0.20.0"
+        "python-dotenv>=0.20.0",
+        "typing_extensions>=3.7.4; " + env_marker_below_38,
     ],
+    extras_require={
+        "async": ["asyncpg>=0.27.0", "aiomysql>=0.1.1", "aiosqlite>=0.17.0"],
+    },
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Console",
@@ -7,6 +7,7 @@ import pytest
 from fastapi.testclient import TestClient
 
 from api.app import app
+from fastapi_auth._key_cache import key_cache
 from fastapi_auth._sqlite_access import sqlite_access
 
 # The environment variable needs to be set before importing app
@@ -22,7 +23,8 @@ def admin_key():
 @pytest.fixture
 def client():
     try:
-        # We remove the existing db file
+        # We close the persistent connections and remove the existing db file
+        sqlite_access.close()
         os.remove("sqlite.db")
         # We had disk I/O errors without this
         time.sleep(0.1)
@@ -32,4 +34,7 @@ def client():
     except FileNotFoundError:
         pass
 
+    # Keys cached by a previous test no longer exist
+    key_cache.clear()
+
     return TestClient(app)
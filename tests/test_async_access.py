@@ -0,0 +1,47 @@
+"""Async backend interface testing.
+"""
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from fastapi_auth._async_access import (
+    ThreadedAsyncAccess,
+    get_async_access,
+    numbered_placeholders,
+)
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+def test_threaded_access(client: TestClient):
+    async_access = ThreadedAsyncAccess(sqlite_access)
+
+    async def scenario():
+        api_key = (
+            await async_access.create_key("async", "async@example.com", "pw", False)
+        )["api-key"]
+        valid = await asyncio.gather(
+            *(async_access.check_key(api_key) for _ in range(10))
+        )
+        await async_access.revoke_key(api_key)
+        revoked = await async_access.check_key(api_key)
+
+        return valid, revoked
+
+    valid, revoked = asyncio.run(scenario())
+
+    assert all(valid)
+    assert not revoked
+
+
+def test_native_driver_falls_back_to_threadpool(monkeypatch):
+    monkeypatch.setenv("FASTAPI_AUTH_ASYNC_DRIVER", "native")
+    monkeypatch.setattr(
+        "fastapi_auth._async_access.NATIVE_DRIVERS",
+        {"sqlite": (None, None)},
+    )
+
+    assert isinstance(get_async_access(sqlite_access, None), ThreadedAsyncAccess)
+
+
+def test_numbered_placeholders():
+    assert numbered_placeholders("WHERE a = %s AND b >= %s") == "WHERE a = $1 AND b >= $2"
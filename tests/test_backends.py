@@ -0,0 +1,31 @@
+"""Backend registry testing.
+"""
+import os
+import subprocess
+import sys
+
+from fastapi_auth._backends import database_mode, get_backend
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+def test_unknown_mode_uses_sqlite(monkeypatch):
+    monkeypatch.setenv("DATABASE_MODE", "unknown")
+
+    assert database_mode() == "sqlite"
+    assert get_backend() is sqlite_access
+
+
+def test_only_the_selected_backend_is_imported():
+    env = dict(os.environ, DATABASE_MODE="sqlite")
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, fastapi_auth; print(sorted(m for m in ('psycopg2', 'pymysql', 'pymongo') if m in sys.modules))",
+        ],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+
+    assert output.decode().strip().splitlines()[-1] == "[]"
@@ -0,0 +1,93 @@
+"""Bulk API key creation testing.
+"""
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastapi_auth import _bulk_provisioning, endpoints
+from fastapi_auth._bulk_provisioning import DUPLICATE_USER
+from fastapi_auth._password_hasher import password_hasher
+from fastapi_auth._sqlite_access import sqlite_access
+
+PASSWORD = "Passw0rd!123"
+
+
+@pytest.fixture(autouse=True)
+def fast_validation(monkeypatch):
+    # The email deliverability check queries DNS, and the default bcrypt cost is slow on purpose
+    monkeypatch.setattr(endpoints, "email_validate", lambda email: email)
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+
+
+def user(i: int, **fields) -> dict:
+    return {"username": f"user{i}", "email": f"user{i}@example.com", "password": PASSWORD, **fields}
+
+
+def test_bulk_json(client: TestClient, admin_key: str):
+    users = [user(i) for i in range(5)]
+
+    response = client.post("/auth/new/bulk", headers={"secret-key": admin_key}, json=users)
+
+    assert response.status_code == 200, response.json()
+    assert response.json()["created"] == 5
+    api_keys = [result["api-key"] for result in response.json()["results"]]
+    assert all(sqlite_access.check_key(api_key) for api_key in api_keys)
+
+
+def test_bulk_ndjson_per_row_results(client: TestClient, admin_key: str):
+    sqlite_access.create_key("user0", "user0@example.com", "pw", False)
+    users = [user(0), user(1), user(1, username="other"), user(2, password="short"), "not a user"]
+
+    response = client.post(
+        "/auth/new/bulk",
+        headers={"secret-key": admin_key, "content-type": "application/x-ndjson"},
+        content="\n".join(json.dumps(u) for u in users),
+    )
+
+    assert response.status_code == 200, response.json()
+    results = response.json()["results"]
+    assert [result["index"] for result in results] == list(range(5))
+    assert results[0]["error"] == DUPLICATE_USER
+    assert "api-key" in results[1]
+    # Same email as the previous user of the request
+    assert results[2]["error"] == DUPLICATE_USER
+    assert "too short" in results[3]["error"]
+    assert "error" in results[4]
+    assert response.json()["created"] == 1
+
+
+def test_bulk_batches(client: TestClient, monkeypatch):
+    monkeypatch.setattr(_bulk_provisioning, "BATCH_SIZE", 2)
+    users = [(f"user{i}", f"user{i}@example.com", "pw", False) for i in range(7)]
+    sqlite_access.create_key("user3", "user3@example.com", "pw", False)
+
+    results = sqlite_access.create_keys(users[:5]) + sqlite_access.create_keys(users)
+
+    # Already created users are reported, in each batch
+    assert [("api-key" in result) for result in results] == [True] * 3 + [False] + [True] + [False] * 5 + [True] * 2
+
+
+def test_bulk_invalid_body(client: TestClient, admin_key: str):
+    response = client.post(
+        "/auth/new/bulk", headers={"secret-key": admin_key}, content='{"username": "user"}'
+    )
+
+    assert response.status_code == 422
+
+
+def test_bulk_users_without_username(client: TestClient):
+    sqlite_access.create_key(None, "nameless0@example.com", "pw", False)
+
+    results = sqlite_access.create_keys(
+        [
+            (None, "nameless0@example.com", None, False),
+            (None, "nameless1@example.com", None, False),
+            (None, "nameless2@example.com", None, False),
+            (None, None, None, False),
+            (None, None, None, False),
+        ]
+    )
+
+    assert results[0] == {"error": DUPLICATE_USER}
+    assert all("api-key" in result for result in results[1:])
@@ -0,0 +1,80 @@
+"""Bulk revoke and renew testing.
+"""
+from fastapi.testclient import TestClient
+
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+def create_keys() -> list:
+    return [
+        sqlite_access.create_key(f"user{i}", f"user{i}@{domain}", "pw", False)["api-key"]
+        for i, domain in enumerate(["a.com", "a.com", "b.com", "a_com"])
+    ]
+
+
+def test_bulk_revoke_by_keys(client: TestClient, admin_key: str):
+    api_keys = create_keys()
+    assert sqlite_access.check_key(api_keys[0])
+    assert key_cache.hit(api_keys[0])
+
+    response = client.post(
+        "/auth/revoke/bulk",
+        headers={"secret-key": admin_key},
+        json={"api_keys": api_keys[:2] + ["unknown"]},
+    )
+
+    assert response.status_code == 200, response.json()
+    assert response.json() == {"revoked": 2}
+    assert not key_cache.hit(api_keys[0])
+    assert not sqlite_access.check_key(api_keys[0])
+    assert sqlite_access.check_key(api_keys[2])
+
+    # Keys already revoked are not counted
+    response = client.post(
+        "/auth/revoke/bulk", headers={"secret-key": admin_key}, json={"api_keys": api_keys}
+    )
+    assert response.json() == {"revoked": 2}
+
+
+def test_bulk_revoke_by_email_domain(client: TestClient, admin_key: str):
+    api_keys = create_keys()
+    sqlite_access.check_key(api_keys[2])
+
+    response = client.post(
+        "/auth/revoke/bulk", headers={"secret-key": admin_key}, json={"email_domain": "a.com"}
+    )
+
+    assert response.json() == {"revoked": 2}
+    assert [sqlite_access.check_key(api_key) for api_key in api_keys] == [False, False, True, True]
+
+
+def test_bulk_renew_expiry_window(client: TestClient, admin_key: str):
+    api_keys = create_keys()
+    sqlite_access.renew_key(api_keys[0], "2000-01-01T00:00:00")
+    sqlite_access.revoke_key(api_keys[1])
+    sqlite_access.renew_key(api_keys[1], "2000-06-01T00:00:00")
+    sqlite_access.revoke_key(api_keys[1])
+
+    response = client.post(
+        "/auth/renew/bulk",
+        headers={"secret-key": admin_key},
+        json={
+            "expires_after": "1999-12-31T00:00:00",
+            "expires_before": "2001-01-01T00:00:00+00:00",
+            "expiration_date": "2099-01-01T02:00:00+02:00",
+        },
+    )
+
+    assert response.status_code == 200, response.json()
+    assert response.json() == {"renewed": 2, "expiration_date": "2099-01-01T00:00:00"}
+    assert all(sqlite_access.check_key(api_key) for api_key in api_keys)
+
+
+def test_bulk_requires_a_selection(client: TestClient, admin_key: str):
+    create_keys()
+
+    response = client.post("/auth/revoke/bulk", headers={"secret-key": admin_key}, json={})
+
+    assert response.status_code == 422
+    assert all(row[1] for row in sqlite_access.get_usage_stats())
@@ -0,0 +1,56 @@
+"""Key cache testing.
+"""
+import time
+
+from fastapi.testclient import TestClient
+
+from fastapi_auth._key_cache import KeyCache, key_cache
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+def test_cache_hit():
+    cache = KeyCache(max_size=10, ttl=60)
+    cache.add("key")
+
+    assert cache.hit("key")
+    assert not cache.hit("unknown")
+
+
+def test_cache_lru_eviction():
+    cache = KeyCache(max_size=2, ttl=60)
+    cache.add("a")
+    cache.add("b")
+    cache.hit("a")
+    cache.add("c")
+
+    assert not cache.hit("b")
+    assert cache.hit("a")
+    assert cache.hit("c")
+
+
+def test_cache_respects_key_expiration():
+    cache = KeyCache(max_size=10, ttl=60)
+    cache.add("key", time.time() - 1)
+
+    assert not cache.hit("key")
+
+
+def test_cache_disabled():
+    cache = KeyCache(max_size=0, ttl=60)
+    cache.add("key")
+
+    assert not cache.hit("key")
+
+
+def test_revoke_invalidates_cache(client: TestClient):
+    api_key = sqlite_access.create_key("cache", "cache@example.com", "pw", False)[
+        "api-key"
+    ]
+
+    assert sqlite_access.check_key(api_key)
+    assert key_cache.hit(api_key)
+
+    sqlite_access.revoke_key(api_key)
+
+    assert not key_cache.hit(api_key)
+    assert not sqlite_access.check_key(api_key)
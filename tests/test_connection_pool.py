@@ -0,0 +1,80 @@
+"""Connection pool testing.
+"""
+import sqlite3
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from fastapi_auth._connection_pool import ConnectionPool
+
+
+def make_pool(**kwargs):
+    def check(connection):
+        connection.execute("SELECT 1")
+
+    return ConnectionPool(
+        connect=lambda: sqlite3.connect(":memory:", check_same_thread=False),
+        check=check,
+        reset=lambda connection: connection.rollback(),
+        **kwargs,
+    )
+
+
+def test_pool_reuses_connections():
+    pool = make_pool(min_size=1, max_size=2, timeout=1, check_interval=30)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert pool.stats()["size"] == 1
+    assert pool.stats()["acquisitions"] == 2
+
+
+def test_pool_times_out_when_exhausted():
+    pool = make_pool(min_size=0, max_size=1, timeout=0.05, check_interval=30)
+
+    with pool.connection():
+        with pytest.raises(HTTPException) as exc_info:
+            pool.acquire()
+
+    assert exc_info.value.status_code == 503
+    assert pool.stats()["timeouts"] == 1
+    assert pool.stats()["in_use"] == 0
+
+
+def test_pool_waiters_get_released_connections():
+    pool = make_pool(min_size=0, max_size=2, timeout=5, check_interval=30)
+    results = []
+
+    def use_connection():
+        for _ in range(50):
+            with pool.connection() as connection:
+                results.append(connection.execute("SELECT 1").fetchone()[0])
+
+    threads = [threading.Thread(target=use_connection) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 400
+    assert pool.stats()["size"] <= 2
+    assert pool.stats()["in_use"] == 0
+
+
+def test_pool_replaces_broken_connections():
+    pool = make_pool(min_size=0, max_size=1, timeout=1, check_interval=0)
+
+    with pool.connection() as connection:
+        pass
+    connection.close()
+
+    with pool.connection() as replacement:
+        assert replacement.execute("SELECT 1").fetchone() == (1,)
+
+    assert replacement is not connection
+    assert pool.stats()["discarded"] == 1
@@ -65,3 +65,78 @@ def test_api_key_never_expire(client: TestClient, admin_key: str):
     assert len(response.json()["logs"]) == 1
     api_key_infos = response.json()["logs"][0]
     assert api_key_infos.get("never_expire") is True, api_key_infos
+
+
+def test_sqlite_persistent_connection(client: TestClient):
+    connection = sqlite_access._connection()
+
+    assert sqlite_access._connection() is connection
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert connection.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+
+def test_sqlite_date_migration(client: TestClient):
+    # Emulate a database storing ISO 8601 TEXT dates
+    sqlite_access.close()
+    with sqlite3.connect(sqlite_access.db_location) as connection:
+        connection.execute("DROP TABLE FASTAPI_AUTH")
+        connection.execute(
+            """
+    CREATE TABLE FASTAPI_AUTH (
+        api_key TEXT PRIMARY KEY,
+        is_active INTEGER,
+        never_expire INTEGER,
+        expiration_date TEXT,
+        latest_query_date TEXT,
+        total_queries INTEGER,
+        name TEXT,
+        email TEXT,
+        password TEXT)
+    """
+        )
+        connection.executemany(
+            "INSERT INTO FASTAPI_AUTH VALUES (?, 1, 0, ?, ?, 3, ?, ?, 'pw')",
+            [
+                ("valid", "2999-01-01T00:00:00", "2020-01-01T12:30:00", "a", "a@a"),
+                ("expired", "2000-01-01T00:00:00", None, "b", "b@b"),
+            ],
+        )
+
+    # Apply migration
+    sqlite_access.init_db()
+
+    with sqlite_access._connection() as connection:
+        columns = {
+            row[1]: row[2]
+            for row in connection.execute("PRAGMA table_info(FASTAPI_AUTH)")
+        }
+        assert columns["expiration_date"] == "INTEGER"
+        assert columns["latest_query_date"] == "INTEGER"
+        # The columns added before the rebuild are kept
+        assert {"rate_limit", "rate_limit_burst", "rate_limit_count"} <= set(columns)
+        assert connection.execute(
+            "SELECT expiration_date, latest_query_date FROM FASTAPI_AUTH WHERE api_key = 'valid'"
+        ).fetchone() == (32472144000, 1577881800)
+
+    assert sqlite_access.check_key("valid")
+    assert not sqlite_access.check_key("expired")
+
+    stats = {row[0]: row for row in sqlite_access.get_usage_stats()}
+    assert stats["valid"][3] == "2999-01-01T00:00:00"
+    assert stats["expired"][4] is None
+
+    assert sqlite_access.set_rate_limit("valid", 2.0, 4) == {"rate_limit": 2.0, "rate_limit_burst": 4}
+    assert sqlite_access.get_rate_limits()["valid"] == (2.0, 4)
+
+
+def test_sqlite_expiration_in_sql(client: TestClient):
+    api_key = sqlite_access.create_key("expiry", "expiry@example.com", "pw", False)[
+        "api-key"
+    ]
+    assert sqlite_access.check_key(api_key)
+
+    sqlite_access.renew_key(api_key, "2000-01-01T00:00:00")
+    assert not sqlite_access.check_key(api_key)
+
+    sqlite_access.renew_key(api_key, "2999-01-01T00:00:00+02:00")
+    assert sqlite_access.check_key(api_key)
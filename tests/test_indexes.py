@@ -0,0 +1,69 @@
+"""Query plan testing, the hot queries must be served by indexes.
+"""
+from fastapi.testclient import TestClient
+
+from fastapi_auth._sqlite_access import CHECK_KEY_QUERY, sqlite_access
+
+
+def query_plan(query: str, parameters: tuple = ()) -> str:
+    with sqlite_access._connection() as connection:
+        rows = connection.execute(f"EXPLAIN QUERY PLAN {query}", parameters).fetchall()
+
+    return "\n".join(row[-1] for row in rows)
+
+
+def test_check_key_uses_covering_index(client: TestClient):
+    plan = query_plan(CHECK_KEY_QUERY, (0, "key"))
+
+    assert "USING COVERING INDEX ix_fastapi_auth_check_key" in plan
+
+
+def test_duplicate_user_check_uses_indexes(client: TestClient):
+    plan = query_plan(
+        "SELECT name, email FROM FASTAPI_AUTH WHERE name=? OR email=?",
+        ("name", "email"),
+    )
+
+    assert "ix_fastapi_auth_name" in plan
+    assert "ix_fastapi_auth_email" in plan
+    assert "SCAN" not in plan
+
+
+def test_usage_stats_order_uses_index(client: TestClient):
+    plan = query_plan(
+        """
+        SELECT api_key, is_active, never_expire, expiration_date,
+            latest_query_date, total_queries, name
+        FROM FASTAPI_AUTH
+        ORDER BY latest_query_date DESC"""
+    )
+
+    assert "ix_fastapi_auth_latest_query_date_api_key" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_usage_logs_page_uses_index(client: TestClient):
+    plan = query_plan(
+        """
+        SELECT api_key FROM FASTAPI_AUTH
+        WHERE latest_query_date IS NOT NULL AND (latest_query_date, api_key) < (?, ?)
+        ORDER BY latest_query_date DESC, api_key DESC
+        LIMIT 100""",
+        (1600000000, "key"),
+    )
+
+    assert "SEARCH FASTAPI_AUTH USING COVERING INDEX ix_fastapi_auth_latest_query_date_api_key" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_unique_username(client: TestClient):
+    sqlite_access.create_key("unique", "unique@example.com", "pw", False)
+
+    with sqlite_access._connection() as connection:
+        indexes = {
+            row[1]: row[2]
+            for row in connection.execute("PRAGMA index_list(FASTAPI_AUTH)")
+        }
+
+    assert indexes["ix_fastapi_auth_name"] == 1
+    assert indexes["ix_fastapi_auth_email"] == 1
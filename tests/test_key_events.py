@@ -0,0 +1,128 @@
+"""Cross-worker invalidation testing, with a fake psycopg2 connection.
+"""
+import json
+import socket
+import time
+import uuid
+from types import SimpleNamespace
+
+from fastapi_auth import _key_events
+from fastapi_auth._key_cache import key_cache
+from fastapi_auth._key_events import KEYS_PER_NOTIFICATION, KeyEvents
+from fastapi_auth._key_filter import KeyFilter
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, parameters=None):
+        self.connection.queries.append((query, parameters))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeConnection:
+    """Notifications written to the socket pair are received like psycopg2 notifies"""
+
+    def __init__(self):
+        self.receiver, self.sender = socket.socketpair()
+        self.notifies = []
+        self.queries = []
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def fileno(self):
+        return self.receiver.fileno()
+
+    def poll(self):
+        for line in self.receiver.recv(65536).decode().splitlines():
+            self.notifies.append(SimpleNamespace(payload=line))
+
+    def send(self, payload: str):
+        self.sender.sendall(payload.encode() + b"\n")
+
+    def close(self):
+        self.receiver.close()
+        self.sender.close()
+
+
+def test_payloads_fit_notifications():
+    events = KeyEvents(enabled=True)
+    api_keys = [str(uuid.uuid4()) for _ in range(KEYS_PER_NOTIFICATION * 2 + 1)]
+
+    payloads = events.payloads("revoke", api_keys)
+
+    assert len(payloads) == 3
+    assert all(len(payload.encode()) < 8000 for payload in payloads)
+    assert sum((json.loads(payload)["keys"] for payload in payloads), []) == api_keys
+    assert json.loads(events.payloads("revoke", None)[0])["keys"] is None
+
+    connection = FakeConnection()
+    events.notify(connection.cursor(), "revoke", api_keys)
+    events.notify(connection.cursor(), "revoke", [])
+    assert len(connection.queries) == 1
+    assert len(connection.queries[0][1][1]) == 3
+
+
+def test_listener_applies_other_workers_events(monkeypatch):
+    monkeypatch.setattr(_key_events, "HEALTH_CHECK_INTERVAL", 0.01)
+    connection = FakeConnection()
+    events = KeyEvents(enabled=True)
+    other_worker = KeyEvents(enabled=True)
+    events.start(lambda: connection, lambda: [], lambda: [])
+
+    api_key = str(uuid.uuid4())
+    key_cache.add(api_key)
+    own_key = str(uuid.uuid4())
+    key_cache.add(own_key)
+
+    connection.send(other_worker.payloads("revoke", [api_key])[0])
+    connection.send(events.payloads("revoke", [own_key])[0])
+
+    deadline = time.time() + 5
+    while events.stats()["received"] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+
+    stats = events.stats()
+    assert stats["connected"]
+    assert stats["received"] == 2
+    assert stats["applied"] == 1
+    assert 0 <= stats["max_delay"] < 5
+    assert connection.autocommit
+    assert connection.queries[0][0] == f"LISTEN {_key_events.CHANNEL}"
+    assert not key_cache.hit(api_key)
+    # Notifications of this worker were applied when it made the change
+    assert key_cache.hit(own_key)
+
+
+def test_reconnection_reloads_the_key_filter(monkeypatch):
+    monkeypatch.setattr(_key_events, "RECONNECT_DELAY", 0.01)
+    key_filter = KeyFilter(capacity=1000, enabled=True)
+    key_filter.load([])
+    monkeypatch.setattr(_key_events, "key_filter", key_filter)
+    # Created through another worker while the listener was disconnected
+    api_key = str(uuid.uuid4())
+    connections = iter([None, FakeConnection()])
+
+    def connect():
+        connection = next(connections)
+        if connection is None:
+            raise ConnectionError("connection refused")
+        return connection
+
+    events = KeyEvents(enabled=True)
+    events.start(connect, lambda: [], lambda: [api_key])
+
+    deadline = time.time() + 5
+    while not events.stats()["connected"] and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert events.stats()["reconnections"] == 1
+    assert key_filter.might_contain(api_key)
@@ -0,0 +1,49 @@
+"""Negative lookup filter testing.
+"""
+import uuid
+
+from fastapi.testclient import TestClient
+
+from fastapi_auth._key_filter import KeyFilter
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+def test_filter_has_no_false_negatives():
+    key_filter = KeyFilter(capacity=1000, error_rate=0.01, enabled=True)
+    api_keys = [str(uuid.uuid4()) for _ in range(1000)]
+    key_filter.load(api_keys[:500])
+    for api_key in api_keys[500:]:
+        key_filter.add(api_key)
+
+    assert all(key_filter.might_contain(api_key) for api_key in api_keys)
+    assert key_filter.count == 1000
+
+
+def test_filter_rejects_unknown_keys():
+    key_filter = KeyFilter(capacity=1000, error_rate=0.01, enabled=True)
+    key_filter.load(str(uuid.uuid4()) for _ in range(1000))
+
+    false_positives = sum(
+        key_filter.might_contain(str(uuid.uuid4())) for _ in range(10000)
+    )
+
+    assert false_positives < 300
+    assert 0.005 < key_filter.false_positive_rate < 0.02
+    assert key_filter.size_in_bytes == (key_filter.num_bits + 7) // 8
+
+
+def test_filter_not_loaded_lets_keys_through():
+    key_filter = KeyFilter(capacity=1000, error_rate=0.01, enabled=True)
+
+    assert key_filter.might_contain("unknown")
+
+
+def test_filter_loads_backend_keys(client: TestClient):
+    api_key = sqlite_access.create_key("filter", "filter@example.com", "pw", False)[
+        "api-key"
+    ]
+    key_filter = KeyFilter(capacity=1000, error_rate=0.01, enabled=True)
+    key_filter.start(sqlite_access.get_api_keys)
+
+    assert key_filter.ready
+    assert key_filter.might_contain(api_key)
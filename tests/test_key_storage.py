@@ -0,0 +1,41 @@
+"""Binary API key storage testing.
+"""
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastapi_auth._key_storage import KeyCodec, key_codec
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+def test_uuid_codec():
+    codec = KeyCodec("uuid")
+    api_key = str(uuid.uuid4())
+
+    assert codec.encode(api_key) == uuid.UUID(api_key).bytes
+    assert codec.decode(codec.encode(api_key)) == api_key
+    assert codec.decode(memoryview(codec.encode(api_key))) == api_key
+    # Other spellings of the key are not the issued key
+    assert codec.encode(api_key.upper()) is None
+    assert codec.encode(api_key.replace("-", "")) is None
+    assert codec.encode("not a key") is None
+
+
+def test_invalid_storage():
+    with pytest.raises(ValueError):
+        KeyCodec("sha1")
+
+
+def test_sqlite_key_migration(client: TestClient, monkeypatch):
+    api_key = sqlite_access.create_key("user", "user@example.com", "pw", False)["api-key"]
+
+    monkeypatch.setattr(key_codec, "storage", "uuid")
+    sqlite_access.init_db()
+
+    with sqlite_access._connection() as connection:
+        stored = connection.execute("SELECT typeof(api_key), length(api_key) FROM FASTAPI_AUTH").fetchall()
+    assert stored == [("blob", 16)]
+    assert sqlite_access.check_key(api_key)
+    assert sqlite_access.get_usage_stats()[0][0] == api_key
+    assert list(sqlite_access.get_api_keys()) == [api_key]
@@ -0,0 +1,76 @@
+"""Memory-mapped key store testing.
+"""
+import os
+
+from fastapi_auth._key_store import KeyStore
+
+ROWS = [
+    ("active", 1, 0, "2099-01-01T00:00:00"),
+    ("revoked", 0, 1, "2099-01-01T00:00:00"),
+    ("expired", 1, 0, "2001-01-01T00:00:00"),
+    ("never_expire", 1, 1, "2001-01-01T00:00:00"),
+]
+
+
+def test_only_valid_keys_are_answered(tmp_path):
+    store = KeyStore(path=str(tmp_path / "keys"), refresh_interval=0, updater=True)
+    store.start(lambda: iter(ROWS))
+
+    assert store.stats()["keys"] == 4
+    assert store.is_valid("active")
+    assert store.is_valid("never_expire")
+    assert not store.is_valid("revoked")
+    assert not store.is_valid("expired")
+    assert not store.is_valid("unknown")
+
+
+def test_invalidations_are_shared_and_survive_a_rebuild(tmp_path):
+    path = str(tmp_path / "keys")
+    updater = KeyStore(path=path, refresh_interval=0, updater=True)
+    worker = KeyStore(path=path, refresh_interval=0, updater=True)
+    updater.start(lambda: iter(ROWS))
+    worker.start(lambda: iter(ROWS))
+
+    assert updater.stats()["updater"] == 1
+    assert worker.stats()["updater"] == 0
+
+    worker.invalidate("never_expire")
+    assert not updater.is_valid("never_expire")
+
+    def rows_read_during_a_revocation():
+        yield from ROWS
+        worker.invalidate("active")
+
+    # The new file was read from the backend before the revocation committed
+    updater.build(rows_read_during_a_revocation())
+    updater.load()
+    worker.load()
+
+    assert not updater.is_valid("active")
+    assert updater.is_valid("never_expire")
+
+    worker.invalidate_all()
+    assert not updater.is_valid("never_expire")
+    assert os.path.exists(path + ".lock")
+
+
+def test_invalidations_apply_to_a_read_only_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "keys")
+    KeyStore(path=path, refresh_interval=0, updater=True).build(iter(ROWS))
+
+    def read_only_open(file, mode="r", *args, **kwargs):
+        if "+" in mode:
+            raise PermissionError(file)
+        return open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr("fastapi_auth._key_store.open", read_only_open, raising=False)
+    worker = KeyStore(path=path, refresh_interval=0, updater=False)
+    worker.load()
+
+    assert worker.is_valid("active")
+    worker.invalidate("active")
+    assert not worker.is_valid("active")
+
+    assert worker.is_valid("never_expire")
+    worker.invalidate_all()
+    assert not worker.is_valid("never_expire")
@@ -0,0 +1,46 @@
+"""In-memory backend testing.
+"""
+import os
+
+from fastapi_auth._bulk_updates import KeySelection
+from fastapi_auth._memory_access import MemoryAccess
+
+
+def test_keys_are_validated_renewed_and_revoked():
+    access = MemoryAccess(path="")
+    api_key = access.create_key("memory_user", "memory_user@example.com", "pw", False)["api-key"]
+    created = access.create_keys(
+        [("memory_user", None, None, False), ("memory_other", "memory_other@test.com", None, True)]
+    )
+
+    assert "error" in created[0]
+    assert access.check_key(api_key)
+    assert not access.check_key("unknown")
+    assert access.check_key_status("unknown") == "unknown"
+
+    access.revoke_key(api_key)
+    assert not access.check_key(api_key)
+    assert access.check_key_status(api_key) == "revoked"
+
+    assert "reactivated" in access.renew_key(api_key, "2099-01-01")
+    assert access.check_key(api_key)
+    assert access.revoke_keys(KeySelection(email_domain="test.com")) == {"revoked": 1}
+    assert not access.check_key(created[1]["api-key"])
+
+
+def test_state_is_recovered_from_the_snapshot_and_the_log(tmp_path):
+    access = MemoryAccess(path=str(tmp_path), sync_interval=60, snapshot_interval=60)
+    kept = access.create_key("snapshot_user", None, None, True)["api-key"]
+    access.snapshot()
+    revoked = access.create_key("log_user", None, None, True)["api-key"]
+    access.revoke_key(revoked)
+    access.sync()
+    # A write cut short by a crash
+    with open(os.path.join(str(tmp_path), "log.1.jsonl"), "a") as f:
+        f.write('["set", ["')
+
+    recovered = MemoryAccess(path=str(tmp_path), sync_interval=60, snapshot_interval=60)
+
+    assert recovered.check_key(kept)
+    assert recovered.check_key_status(revoked) == "revoked"
+    assert recovered.get_revoked_keys() == [revoked]
@@ -0,0 +1,48 @@
+"""Validation metrics testing.
+"""
+from fastapi.testclient import TestClient
+
+from fastapi_auth._metrics import Histogram, metrics
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(0.001, 0.01))
+
+    for duration_ns in (500_000, 1_000_000, 5_000_000, 20_000_000):
+        histogram.observe(duration_ns)
+
+    # Bounds are inclusive, like the le label
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.sum_ns == 26_500_000
+    assert histogram.count == 4
+
+
+def test_metrics_endpoint(client: TestClient, admin_key: str, monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", True)
+    monkeypatch.setattr(metrics, "latency", {})
+    monkeypatch.setattr(metrics, "missing", 0)
+    api_key = sqlite_access.create_key("metrics", "metrics@example.com", "pw", False)["api-key"]
+    revoked_key = sqlite_access.create_key("revoked", "revoked@example.com", "pw", False)["api-key"]
+    sqlite_access.revoke_key(revoked_key)
+
+    assert client.get("/secure", headers={"api-key": api_key}).status_code == 200
+    assert client.get("/secure", headers={"api-key": api_key}).status_code == 200
+    assert client.get("/secure", headers={"api-key": revoked_key}).status_code == 403
+    assert client.get("/secure", headers={"api-key": "unknown"}).status_code == 403
+    assert client.get("/secure").status_code == 403
+
+    response = client.get("/auth/metrics", headers={"secret-key": admin_key})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+
+    assert 'fastapi_auth_validations_total{result="allow",reason="valid"} 2' in lines
+    assert 'fastapi_auth_validations_total{result="deny",reason="revoked"} 1' in lines
+    assert 'fastapi_auth_validations_total{result="deny",reason="unknown"} 1' in lines
+    assert 'fastapi_auth_validations_total{result="deny",reason="missing"} 1' in lines
+    # The second use of the valid key was answered by the cache, the other keys were looked up
+    assert 'fastapi_auth_validation_duration_seconds_count{backend="sqlite",method="cache"} 1' in lines
+    assert 'fastapi_auth_validation_duration_seconds_count{backend="sqlite",method="check_key"} 3' in lines
+    assert 'fastapi_auth_validation_duration_seconds_bucket{backend="sqlite",method="cache",le="+Inf"} 1' in lines
+    assert any(line.startswith("fastapi_auth_usage_pending_keys ") for line in lines)
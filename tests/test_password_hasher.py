@@ -0,0 +1,44 @@
+"""Password hashing testing.
+"""
+import asyncio
+import threading
+
+import bcrypt
+import pytest
+
+from fastapi_auth._password_hasher import PasswordHasher
+
+
+def test_hash_uses_configured_rounds():
+    hasher = PasswordHasher(rounds=5, max_workers=1)
+
+    hashed = hasher.hash("Passw0rd!")
+
+    assert hashed.startswith("$2b$05$")
+    assert bcrypt.checkpw(b"Passw0rd!", hashed.encode())
+
+
+def test_hash_async_runs_on_bounded_pool():
+    hasher = PasswordHasher(rounds=4, max_workers=2)
+    threads = set()
+
+    def hash(password: str) -> str:
+        threads.add(threading.current_thread().name)
+        return PasswordHasher.hash(hasher, password)
+
+    hasher.hash = hash
+
+    async def scenario():
+        return await asyncio.gather(*(hasher.hash_async(f"pw{i}") for i in range(8)))
+
+    hashes = asyncio.run(scenario())
+    hasher.shutdown()
+
+    assert all(bcrypt.checkpw(f"pw{i}".encode(), h.encode()) for i, h in enumerate(hashes))
+    assert len(threads) <= 2
+    assert all(name.startswith("fastapi_auth_bcrypt") for name in threads)
+
+
+def test_invalid_rounds():
+    with pytest.raises(ValueError):
+        PasswordHasher(rounds=100)
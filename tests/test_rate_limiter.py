@@ -0,0 +1,74 @@
+"""Per API key rate limiting testing.
+"""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastapi_auth._rate_limiter import RateLimiter, rate_limiter
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+def test_token_bucket():
+    limiter = RateLimiter(rate=10, burst=3)
+
+    assert [limiter.acquire("key") for _ in range(3)] == [0, 0, 0]
+    assert 0 < limiter.acquire("key") <= 0.1
+    # Buckets are per key
+    assert limiter.acquire("other") == 0
+
+    time.sleep(0.15)
+    assert limiter.acquire("key") == 0
+    assert limiter.limited == 1
+
+
+def test_per_key_override():
+    limiter = RateLimiter(rate=0)
+    limiter.load({"limited": (1, None), "unlimited": (0, 5)})
+
+    assert limiter.acquire("limited") == 0
+    assert limiter.acquire("limited") > 0
+    assert all(limiter.acquire("unlimited") == 0 for _ in range(10))
+    assert all(limiter.acquire("other") == 0 for _ in range(10))
+
+
+def test_rate_limit_endpoint(client: TestClient, admin_key: str, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+    monkeypatch.setattr(rate_limiter, "rate", 0.0)
+    monkeypatch.setattr(rate_limiter, "_overrides", {})
+    monkeypatch.setattr(rate_limiter, "_buckets", type(rate_limiter._buckets)())
+    api_key = sqlite_access.create_key("user", "user@example.com", "pw", False)["api-key"]
+
+    response = client.get(
+        "/auth/rate-limit",
+        headers={"secret-key": admin_key},
+        params={"api-key": api_key, "rate": 0.5, "burst": 2},
+    )
+    assert response.status_code == 200, response.json()
+    assert sqlite_access.get_rate_limits() == {api_key: (0.5, 2)}
+
+    assert [client.get("/secure", headers={"api-key": api_key}).status_code for _ in range(2)] == [200, 200]
+    response = client.get("/secure", headers={"api-key": api_key})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+    response = client.get(
+        "/auth/rate-limit", headers={"secret-key": admin_key}, params={"api-key": "unknown"}
+    )
+    assert response.status_code == 404
+
+
+def test_shared_buckets(client: TestClient):
+    api_key = sqlite_access.create_key("user", "user@example.com", "pw", False)["api-key"]
+    first, second = RateLimiter(rate=1, burst=2, shared=True), RateLimiter(rate=1, burst=2, shared=True)
+
+    assert [first.acquire(api_key), first.acquire(api_key), second.acquire(api_key)] == [0, 0, 0]
+    first.sync(sqlite_access._sync_rate_counts)
+    second.sync(sqlite_access._sync_rate_counts)
+    assert second.acquire(api_key) == 0
+
+    second.sync(sqlite_access._sync_rate_counts)
+    first.sync(sqlite_access._sync_rate_counts)
+
+    # The 2 requests allowed by the other worker are taken out of the bucket, which has to refill from -2
+    assert first.acquire(api_key) == pytest.approx(3, abs=0.1)
@@ -0,0 +1,81 @@
+"""Signed API key testing.
+"""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastapi_auth import endpoints, security_api_key
+from fastapi_auth._password_hasher import password_hasher
+from fastapi_auth._signed_keys import SignedKeys, signed_keys
+from fastapi_auth._sqlite_access import sqlite_access
+
+
+@pytest.fixture(autouse=True)
+def enable_signed_keys(monkeypatch):
+    monkeypatch.setattr(signed_keys, "enabled", True)
+    monkeypatch.setattr(signed_keys, "_revoked", frozenset())
+    monkeypatch.setattr(endpoints, "email_validate", lambda email: email)
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+
+
+def no_database(monkeypatch):
+    async def check_key(api_key):
+        raise AssertionError("The database was queried")
+
+    monkeypatch.setattr(security_api_key.async_dev, "check_key", check_key)
+
+
+def test_sign_and_verify():
+    keys = SignedKeys(enabled=True)
+    api_key = keys.sign("key-id", 2000000000)
+
+    assert keys.verify(api_key) == ("key-id", 2000000000)
+    assert keys.key_id(api_key) == "key-id"
+    # Any change to the key id, the expiration date or the signature is detected
+    assert keys.verify(api_key.replace("2000000000", "2000000001")) is None
+    assert keys.verify("other-id" + api_key[len("key-id"):]) is None
+    assert keys.verify(api_key[:-1] + ("A" if api_key[-1] != "A" else "B")) is None
+    assert keys.verify(api_key + "é") is None
+
+
+def test_signed_key_validated_without_database(client: TestClient, admin_key: str, monkeypatch):
+    response = client.get(
+        "/auth/new",
+        headers={"secret-key": admin_key},
+        params={"username": "signed", "email": "signed@example.com", "password": "Passw0rd!123"},
+    )
+    api_key = response.json()["api-key"]
+    assert signed_keys.is_signed(api_key)
+
+    no_database(monkeypatch)
+    assert client.get("/secure", headers={"api-key": api_key}).status_code == 200
+    assert client.get("/secure", headers={"api-key": api_key[:-2]}).status_code == 403
+
+    # Revoking through this worker applies at once
+    assert client.get("/auth/revoke", headers={"secret-key": admin_key}, params={"api-key": api_key}).status_code == 200
+    assert client.get("/secure", headers={"api-key": api_key}).status_code == 403
+    assert not sqlite_access.check_key(signed_keys.key_id(api_key))
+
+
+def test_revoked_set_loaded_from_backend(client: TestClient, monkeypatch):
+    key_id = sqlite_access.create_key("user", "user@example.com", "pw", False)["api-key"]
+    api_key = signed_keys.sign(key_id, None)
+    sqlite_access.revoke_key(key_id)
+
+    no_database(monkeypatch)
+    assert client.get("/secure", headers={"api-key": api_key}).status_code == 200
+
+    signed_keys.load(sqlite_access.get_revoked_keys())
+    assert client.get("/secure", headers={"api-key": api_key}).status_code == 403
+
+
+def test_expired_signed_key_checked_in_database(client: TestClient):
+    key_id = sqlite_access.create_key("user", "user@example.com", "pw", False)["api-key"]
+    api_key = signed_keys.sign(key_id, int(time.time()) - 1)
+
+    # The key was renewed after the signed key was issued
+    assert client.get("/secure", headers={"api-key": api_key}).status_code == 200
+
+    sqlite_access.renew_key(key_id, "2000-01-01T00:00:00")
+    assert client.get("/secure", headers={"api-key": api_key}).status_code == 403
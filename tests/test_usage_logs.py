@@ -0,0 +1,103 @@
+"""Usage logs filtering, pagination and export testing.
+"""
+import csv
+import io
+import json
+
+from fastapi.testclient import TestClient
+
+from fastapi_auth._sqlite_access import sqlite_access
+from fastapi_auth._usage_export import export_usage
+from fastapi_auth._usage_logs import UsageQuery
+
+
+def create_keys(count: int):
+    api_keys = [
+        sqlite_access.create_key(f"user{i}", f"user{i}@example.com", "pw", False)[
+            "api-key"
+        ]
+        for i in range(count)
+    ]
+    # The first half is used, oldest first
+    with sqlite_access._connection() as connection:
+        connection.executemany(
+            "UPDATE FASTAPI_AUTH SET latest_query_date = ?, total_queries = ? WHERE api_key = ?",
+            [(1600000000 + i, i, api_key) for i, api_key in enumerate(api_keys[: count // 2])],
+        )
+
+    return api_keys
+
+
+def test_usage_logs_pagination(client: TestClient, admin_key: str):
+    api_keys = create_keys(10)
+
+    pages = []
+    params = {"limit": 3}
+    while True:
+        response = client.get("/auth/logs", headers={"secret-key": admin_key}, params=params)
+        assert response.status_code == 200, response.json()
+        pages.append([log["api_key"] for log in response.json()["logs"]])
+        if response.json()["next_cursor"] is None:
+            break
+        params["cursor"] = response.json()["next_cursor"]
+
+    returned = [api_key for page in pages for api_key in page]
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    # Used keys, most recent first, then the never used ones
+    assert returned[:5] == api_keys[4::-1]
+    assert sorted(returned[5:], reverse=True) == returned[5:]
+    assert set(returned) == set(api_keys)
+
+
+def test_usage_logs_filters(client: TestClient):
+    api_keys = create_keys(6)
+    sqlite_access.revoke_key(api_keys[0])
+    sqlite_access.renew_key(api_keys[1], "2000-01-01T00:00:00")
+
+    def logs(**filters):
+        return {row[0] for row in sqlite_access.get_usage_logs(UsageQuery(**filters))}
+
+    assert logs(never_used=True) == set(api_keys[3:])
+    assert logs(min_total_queries=2) == {api_keys[2]}
+    assert logs(expired=True) == {api_keys[1]}
+    assert logs(active=True) == set(api_keys[2:])
+    assert logs(username_prefix="user5") == {api_keys[5]}
+    assert logs(email_prefix="user_") == set()
+    assert len(logs(active=True, never_used=True, limit=2)) == 2
+
+
+def test_usage_logs_invalid_cursor(client: TestClient, admin_key: str):
+    response = client.get(
+        "/auth/logs", headers={"secret-key": admin_key}, params={"cursor": "invalid"}
+    )
+
+    assert response.status_code == 422
+
+
+def test_usage_export(client: TestClient, admin_key: str):
+    api_keys = create_keys(4)
+
+    response = client.get(
+        "/auth/logs/export", headers={"secret-key": admin_key}, params={"format": "ndjson"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert {row["api_key"] for row in rows} == set(api_keys)
+    assert all(row["is_active"] is True for row in rows)
+
+    response = client.get(
+        "/auth/logs/export", headers={"secret-key": admin_key}, params={"format": "csv"}
+    )
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert {row["api_key"] for row in rows} == set(api_keys)
+    assert {row["total_queries"] for row in rows} == {"0", "1"}
+
+
+def test_usage_export_chunks():
+    rows = [("key", 1, 0, None, None, i, "name", "email") for i in range(5)]
+
+    chunks = list(export_usage(iter(rows), "ndjson", chunk_size=2))
+
+    assert [chunk.count("\n") for chunk in chunks] == [2, 2, 1]
@@ -0,0 +1,118 @@
+"""Usage recorder testing.
+"""
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from fastapi_auth._sqlite_access import sqlite_access
+from fastapi_auth._usage_recorder import UsageRecorder
+
+
+def test_recorder_aggregates_deltas():
+    flushed = []
+    recorder = UsageRecorder(flushed.append, flush_interval=3600, max_buffer_size=100)
+
+    def use_keys():
+        for _ in range(1000):
+            recorder.record("a")
+            recorder.record("b")
+
+    threads = [threading.Thread(target=use_keys) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.stop()
+
+    assert len(flushed) == 1
+    assert {api_key: delta for delta, _, api_key in flushed[0]} == {
+        "a": 4000,
+        "b": 4000,
+    }
+    assert recorder.stats()["pending_keys"] == 0
+
+
+def test_recorder_keeps_deltas_on_failed_flush():
+    calls = []
+
+    def flaky_flush(usage):
+        calls.append(usage)
+        if len(calls) == 1:
+            raise RuntimeError("database unavailable")
+
+    recorder = UsageRecorder(flaky_flush, flush_interval=3600, max_buffer_size=100)
+    recorder.record("a")
+    recorder.flush()
+    recorder.record("a")
+    recorder.stop()
+
+    assert calls[-1][0][0] == 2
+
+
+def test_sqlite_usage_flush(client: TestClient):
+    api_key = sqlite_access.create_key("usage", "usage@example.com", "pw", False)[
+        "api-key"
+    ]
+
+    for _ in range(5):
+        assert sqlite_access.check_key(api_key)
+    sqlite_access.usage_recorder.flush()
+
+    row = [row for row in sqlite_access.get_usage_stats() if row[0] == api_key][0]
+    assert row[5] == 5
+    assert row[4] is not None
+
+
+def test_recorder_writes_each_rollup_bucket_once(monkeypatch):
+    now = [7200.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    rollups = []
+    recorder = UsageRecorder(
+        lambda usage: None,
+        flush_interval=3600,
+        flush_rollups=rollups.append,
+        rollup_bucket=3600,
+    )
+
+    recorder.record("a")
+    recorder.record("a")
+    recorder.record("b")
+    recorder.flush()
+    # The bucket in progress is not written
+    assert rollups == []
+
+    now[0] = 10800.0
+    recorder.record("a")
+    recorder.flush()
+    recorder.flush()
+    assert sorted(rollups[0]) == [(1, 7200, "b"), (2, 7200, "a")]
+    assert len(rollups) == 1
+
+    recorder.stop()
+    assert rollups[-1] == [(1, 10800, "a")]
+    assert recorder.stats()["rollup_rows"] == 3
+
+
+def test_usage_rollups_endpoint(client: TestClient, admin_key: str):
+    api_key = sqlite_access.create_key("rollup", "rollup@example.com", "pw", False)[
+        "api-key"
+    ]
+    sqlite_access._update_usage_rollups([(3, 0, api_key), (4, 3600, api_key), (5, 86400, api_key)])
+
+    response = client.get(
+        "/auth/logs/usage",
+        headers={"secret-key": admin_key},
+        params={"key": api_key, "from": "1970-01-01T00:00:00", "to": "1970-01-03T00:00:00", "granularity": "day"},
+    )
+    assert response.status_code == 200, response.json()
+    assert response.json()["buckets"] == [
+        {"bucket_start": "1970-01-01T00:00:00", "count": 7},
+        {"bucket_start": "1970-01-02T00:00:00", "count": 5},
+    ]
+
+    # Rolled up every hour by default
+    response = client.get(
+        "/auth/logs/usage", headers={"secret-key": admin_key}, params={"granularity": "minute"}
+    )
+    assert response.status_code == 422